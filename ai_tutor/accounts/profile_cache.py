@@ -0,0 +1,88 @@
+# accounts/profile_cache.py
+# StudentProfile snapshot kept in the session, which every authenticated
+# request loads anyway, so reading the standard or language costs no query.
+# Saving a profile refreshes the snapshot of the request that saved it and
+# bumps a per-user version in the default cache; other sessions of that user
+# reload when they see the new version, or after TUTOR_PROFILE_SNAPSHOT_TTL
+# seconds in case the version never reached (or fell out of) the cache.
+from asgiref.sync import iscoroutinefunction
+from collections import namedtuple
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.decorators import sync_and_async_middleware
+import time
+import uuid
+from .models import StudentProfile
+
+SESSION_KEY = '_student_profile'
+FIELDS = ('id', 'user_id', 'standard', 'standard_selected', 'language')
+
+# Read-only view of the cached fields; load the model to change a profile
+ProfileSnapshot = namedtuple('ProfileSnapshot', FIELDS)
+
+# Request being served on this thread / task, set by profile_cache_middleware
+current_request = ContextVar('current_request', default=None)
+
+def _version_key(user_id):
+    return f'accounts:profile_version:{user_id}'
+
+def _snapshot(profile, version):
+    snapshot = {field: getattr(profile, field) for field in FIELDS}
+    snapshot['version'] = version
+    snapshot['loaded_at'] = time.time()
+    return snapshot
+
+def _is_current(snapshot, user_id, version):
+    if not snapshot or snapshot['user_id'] != user_id:
+        return False
+    if version is not None and snapshot['version'] != version:
+        return False
+    return time.time() - snapshot.get('loaded_at', 0) < settings.TUTOR_PROFILE_SNAPSHOT_TTL
+
+def get_profile(request):
+    """ProfileSnapshot of request.user's StudentProfile, from the session when current
+
+    Raises StudentProfile.DoesNotExist like StudentProfile.objects.get().
+    """
+    user = request.user
+    snapshot = request.session.get(SESSION_KEY)
+    version = cache.get(_version_key(user.id))
+    if not _is_current(snapshot, user.id, version):
+        profile = StudentProfile.objects.get(user=user)
+        snapshot = _snapshot(profile, version)
+        request.session[SESSION_KEY] = snapshot
+    return ProfileSnapshot(*(snapshot[field] for field in FIELDS))
+
+def invalidate(profile, deleted=False):
+    """Signal handler body: make every session of the user reload its snapshot"""
+    version = uuid.uuid4().hex
+    cache.set(_version_key(profile.user_id), version, timeout=None)
+
+    # The saving request keeps a fresh snapshot without reloading it
+    request = current_request.get()
+    if request is None or getattr(request, 'user', None) is None or request.user.id != profile.user_id:
+        return
+    if deleted:
+        request.session.pop(SESSION_KEY, None)
+    else:
+        request.session[SESSION_KEY] = _snapshot(profile, version)
+
+@sync_and_async_middleware
+def profile_cache_middleware(get_response):
+    """Expose the current request to the profile save signal"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = current_request.set(request)
+            try:
+                return await get_response(request)
+            finally:
+                current_request.reset(token)
+    else:
+        def middleware(request):
+            token = current_request.set(request)
+            try:
+                return get_response(request)
+            finally:
+                current_request.reset(token)
+    return middleware
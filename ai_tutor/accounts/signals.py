@@ -0,0 +1,13 @@
+# accounts/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import profile_cache
+from .models import StudentProfile
+
+@receiver(post_save, sender=StudentProfile)
+def refresh_profile_cache(sender, instance, **kwargs):
+    profile_cache.invalidate(instance)
+
+@receiver(post_delete, sender=StudentProfile)
+def drop_profile_cache(sender, instance, **kwargs):
+    profile_cache.invalidate(instance, deleted=True)
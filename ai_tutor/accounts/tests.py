@@ -1,3 +1,97 @@
+import json
+
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .models import StudentProfile
+from .profile_cache import ProfileSnapshot, get_profile
+
+
+class ProfileCacheTests(TestCase):
+    """Profile reads come from the session snapshot: only the session and user are queried"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'pw')
+        self.profile = StudentProfile.objects.create(user=self.user, standard='9th', standard_selected=True)
+        self.client.force_login(self.user)
+
+    def user_info(self):
+        return self.client.get('/api/auth/user-info/').json()['user']
+
+    def test_user_info_reads_profile_from_session(self):
+        self.user_info()
+        # session + user
+        with self.assertNumQueries(2):
+            user = self.user_info()
+        self.assertEqual(user['standard'], '9th')
+        self.assertEqual(user['language'], 'en')
+
+    def test_login_seeds_snapshot(self):
+        self.client.logout()
+        response = self.client.post(
+            '/api/auth/login/',
+            json.dumps({'email': 'student@example.com', 'password': 'pw'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.json()['user']['standard'], '9th')
+        with self.assertNumQueries(2):
+            self.user_info()
+
+    def test_update_settings_refreshes_snapshot(self):
+        self.user_info()
+        response = self.client.post(
+            '/api/auth/update-settings/',
+            json.dumps({'standard': '10th', 'language': 'hi'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.profile.refresh_from_db()
+        self.assertEqual((self.profile.standard, self.profile.language), ('10th', 'hi'))
+
+        with self.assertNumQueries(2):
+            user = self.user_info()
+        self.assertEqual((user['standard'], user['language']), ('10th', 'hi'))
+
+    def test_select_standard_refreshes_snapshot(self):
+        self.user_info()
+        self.client.post(
+            '/api/auth/select-standard/',
+            json.dumps({'standard': '8th'}),
+            content_type='application/json'
+        )
+        with self.assertNumQueries(2):
+            self.assertEqual(self.user_info()['standard'], '8th')
+
+    def test_save_elsewhere_invalidates_snapshot(self):
+        self.user_info()
+        # e.g. an admin edit, outside this user's requests
+        profile = StudentProfile.objects.get(pk=self.profile.pk)
+        profile.language = 'gu'
+        profile.save()
+
+        # session + user + profile reload + session save (in a savepoint)
+        with self.assertNumQueries(6):
+            self.assertEqual(self.user_info()['language'], 'gu')
+        with self.assertNumQueries(2):
+            self.user_info()
+
+    def test_snapshot_expires_without_a_version(self):
+        self.user_info()
+        # Written behind the signal's back, and the version key is gone too
+        StudentProfile.objects.filter(pk=self.profile.pk).update(language='gu')
+        cache.clear()
+        self.assertEqual(self.user_info()['language'], 'en')
+
+        with mock.patch('accounts.profile_cache.time.time', return_value=time.time() + 301):
+            self.assertEqual(self.user_info()['language'], 'gu')
+
+    def test_snapshot_is_not_a_model(self):
+        request = mock.Mock(user=self.user, session={})
+        profile = get_profile(request)
+        self.assertIsInstance(profile, ProfileSnapshot)
+        self.assertEqual((profile.standard, profile.standard_selected), ('9th', True))
+        self.assertFalse(hasattr(profile, 'save'))
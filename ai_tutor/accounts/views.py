@@ -6,6 +6,7 @@ from django.http import JsonResponse
 from django.db import transaction
 import json
 from .models import StudentProfile
+from .profile_cache import get_profile
 
 def ajax_login_required(func):
     def wrapper(request, *args, **kwargs):
@@ -82,7 +83,8 @@ def login_view(request):
             
             if user:
                 login(request, user)
-                profile = StudentProfile.objects.get(user=user)
+                # Seeds the session snapshot later requests read from
+                profile = get_profile(request)
                 
                 return JsonResponse({
                     'message': 'Login successful',
@@ -123,7 +125,7 @@ def select_standard_view(request):
             profile = StudentProfile.objects.get(user=request.user)
             profile.standard = standard
             profile.standard_selected = True
-            profile.save()
+            profile.save(update_fields=['standard', 'standard_selected', 'updated_at'])
             
             return JsonResponse({
                 'message': 'Standard selected successfully',
@@ -142,7 +144,7 @@ def select_standard_view(request):
 @ajax_login_required
 def user_info_view(request):
     try:
-        profile = StudentProfile.objects.get(user=request.user)
+        profile = get_profile(request)
         return JsonResponse({
             'user': {
                 'id': request.user.id,
@@ -169,15 +171,18 @@ def update_settings_view(request):
                 return JsonResponse({'error': 'At least one field is required'}, status=400)
 
             profile = StudentProfile.objects.get(user=request.user)
+            update_fields = ['updated_at']
 
             if standard:
                 profile.standard = standard
                 # Ensure downstream endpoints recognize that a standard has been selected
                 profile.standard_selected = True
+                update_fields += ['standard', 'standard_selected']
             if language:
                 profile.language = language
+                update_fields.append('language')
 
-            profile.save()
+            profile.save(update_fields=update_fields)
 
             response_data = {'message': 'Settings updated successfully'}
             if standard:
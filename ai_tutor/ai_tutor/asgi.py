@@ -3,6 +3,10 @@ ASGI config for ai_tutor project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Set TUTOR_ASYNC_VIEWS=True and run it with an ASGI server, e.g.
+``uvicorn ai_tutor.asgi:application --workers 2``, to serve the chat, history
+and subjects endpoints from tutor/async_views.py.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -48,12 +49,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tutor.log_pipeline.request_id_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.profile_cache.profile_cache_middleware',
+    'tutor.metrics.metrics_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,12 +85,73 @@ WSGI_APPLICATION = 'ai_tutor.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# TUTOR_DB_PROFILE selects the storage profile:
+#   "sqlite"      - stock SQLite, one connection per request (the default)
+#   "sqlite_wal"  - opt-in SQLite in WAL mode with synchronous=NORMAL, memory-mapped
+#                   reads and a busy timeout, applied on every new connection;
+#                   writers take the lock up front (BEGIN IMMEDIATE) and
+#                   connections are kept for TUTOR_DB_CONN_MAX_AGE seconds
+#   "postgres"    - PostgreSQL (needs psycopg), with a psycopg connection pool
+#                   of TUTOR_DB_POOL_MIN..TUTOR_DB_POOL_MAX connections per
+#                   process, or persistent connections if TUTOR_DB_POOL=False
+# WAL mode is stored in the database file, so switching back to "sqlite"
+# leaves it in WAL until reset with "PRAGMA journal_mode=DELETE".
+TUTOR_DB_PROFILE = os.getenv('TUTOR_DB_PROFILE', 'sqlite')
+TUTOR_DB_SQLITE_PATH = os.getenv('TUTOR_DB_SQLITE_PATH', BASE_DIR / 'db.sqlite3')
+TUTOR_DB_CONN_MAX_AGE = int(os.getenv('TUTOR_DB_CONN_MAX_AGE', '60'))
+TUTOR_DB_BUSY_TIMEOUT = int(os.getenv('TUTOR_DB_BUSY_TIMEOUT', '5000'))  # milliseconds
+TUTOR_DB_MMAP_SIZE = int(os.getenv('TUTOR_DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+TUTOR_DB_POOL = os.getenv('TUTOR_DB_POOL', 'True') == 'True'
+TUTOR_DB_POOL_MIN = int(os.getenv('TUTOR_DB_POOL_MIN', '2'))
+TUTOR_DB_POOL_MAX = int(os.getenv('TUTOR_DB_POOL_MAX', '10'))
+
+if TUTOR_DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('TUTOR_DB_NAME', 'ai_tutor'),
+            'USER': os.getenv('TUTOR_DB_USER', 'ai_tutor'),
+            'PASSWORD': os.getenv('TUTOR_DB_PASSWORD', ''),
+            'HOST': os.getenv('TUTOR_DB_HOST', '127.0.0.1'),
+            'PORT': os.getenv('TUTOR_DB_PORT', '5432'),
+            # A pool replaces persistent connections; Django rejects both at once
+            'CONN_MAX_AGE': 0 if TUTOR_DB_POOL else TUTOR_DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': TUTOR_DB_POOL_MIN,
+                    'max_size': TUTOR_DB_POOL_MAX,
+                    'timeout': 10,
+                },
+            } if TUTOR_DB_POOL else {},
+        }
+    }
+elif TUTOR_DB_PROFILE == 'sqlite_wal':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': TUTOR_DB_SQLITE_PATH,
+            'CONN_MAX_AGE': TUTOR_DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f'PRAGMA mmap_size={TUTOR_DB_MMAP_SIZE};'
+                    f'PRAGMA busy_timeout={TUTOR_DB_BUSY_TIMEOUT};'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': TUTOR_DB_SQLITE_PATH,
+        }
     }
-}
 
 
 # Password validation
@@ -147,6 +212,132 @@ REST_FRAMEWORK = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# AI Tutor
+# Serve chat, history and subjects through async views (run under ai_tutor/asgi.py)
+TUTOR_ASYNC_VIEWS = os.getenv('TUTOR_ASYNC_VIEWS', 'False') == 'True'
+
+# Fine-tuned RAG model servers, comma separated, each optionally suffixed with
+# "*<weight>" (e.g. "http://10.0.0.5:5002/generate*2"). Each backend gets a
+# keep-alive pool of TUTOR_RAG_MAX_CONCURRENCY connections and requests beyond
+# that are refused. Balancing is "least_outstanding" or "round_robin" (weighted).
+TUTOR_RAG_SERVER_URL = os.getenv('TUTOR_RAG_SERVER_URL', 'http://127.0.0.1:5002/generate')
+TUTOR_RAG_MAX_CONCURRENCY = int(os.getenv('TUTOR_RAG_MAX_CONCURRENCY', '8'))
+TUTOR_RAG_BACKENDS = [
+    {
+        'url': url.strip(),
+        'weight': int(weight or 1),
+        'max_concurrency': TUTOR_RAG_MAX_CONCURRENCY,
+    }
+    for url, _, weight in (
+        backend.partition('*') for backend in os.getenv('TUTOR_RAG_BACKENDS', TUTOR_RAG_SERVER_URL).split(',')
+    )
+]
+TUTOR_RAG_BALANCING = os.getenv('TUTOR_RAG_BALANCING', 'least_outstanding')
+
+# A backend's circuit opens after this many consecutive errors/timeouts and
+# its /health is then polled every probe interval (seconds)
+TUTOR_RAG_BREAKER_FAILURES = int(os.getenv('TUTOR_RAG_BREAKER_FAILURES', '3'))
+TUTOR_RAG_BREAKER_PROBE_INTERVAL = float(os.getenv('TUTOR_RAG_BREAKER_PROBE_INTERVAL', '5'))
+
+# Seconds between background refreshes of the list of available Gemini models
+TUTOR_GEMINI_MODELS_TTL = int(os.getenv('TUTOR_GEMINI_MODELS_TTL', '600'))
+
+# Seconds a worker trusts its in-memory chapter catalogue before reloading;
+# edits made in the same process (or visible through a shared CACHES backend)
+# are picked up immediately
+TUTOR_CATALOGUE_TTL = int(os.getenv('TUTOR_CATALOGUE_TTL', '300'))
+
+# Seconds a session trusts its StudentProfile snapshot before reloading it;
+# bounds staleness when the cache that carries profile versions lost the key
+TUTOR_PROFILE_SNAPSHOT_TTL = int(os.getenv('TUTOR_PROFILE_SNAPSHOT_TTL', '300'))
+
+# Answer cache: in-process LRU entries, persistent row TTL (seconds) and row cap.
+# A similarity above 0 (e.g. 0.9) also serves near-duplicate questions.
+TUTOR_ANSWER_CACHE_ENABLED = os.getenv('TUTOR_ANSWER_CACHE_ENABLED', 'True') == 'True'
+TUTOR_ANSWER_CACHE_MEMORY_SIZE = int(os.getenv('TUTOR_ANSWER_CACHE_MEMORY_SIZE', '1024'))
+TUTOR_ANSWER_CACHE_TTL = int(os.getenv('TUTOR_ANSWER_CACHE_TTL', '86400'))
+TUTOR_ANSWER_CACHE_MAX_ROWS = int(os.getenv('TUTOR_ANSWER_CACHE_MAX_ROWS', '10000'))
+TUTOR_ANSWER_CACHE_SIMILARITY = float(os.getenv('TUTOR_ANSWER_CACHE_SIMILARITY', '0'))
+
+# Coalesce concurrent identical questions onto one upstream call; SHARED also
+# coalesces across worker processes through the InflightQuestion table
+TUTOR_SINGLEFLIGHT_ENABLED = os.getenv('TUTOR_SINGLEFLIGHT_ENABLED', 'True') == 'True'
+TUTOR_SINGLEFLIGHT_SHARED = os.getenv('TUTOR_SINGLEFLIGHT_SHARED', 'False') == 'True'
+TUTOR_SINGLEFLIGHT_TIMEOUT = float(os.getenv('TUTOR_SINGLEFLIGHT_TIMEOUT', '150'))
+
+# Conversation context sent with each question: the latest turns (at most
+# MAX_TURNS) that fit in TOKENS estimated tokens, plus a stored summary of older
+# turns of up to SUMMARY_TOKENS, extended once SUMMARY_EVERY turns have aged out.
+# Only follow-up questions (short, or referring back: "explain that again")
+# get context, and they bypass the answer cache and request coalescing.
+TUTOR_CONTEXT_ENABLED = os.getenv('TUTOR_CONTEXT_ENABLED', 'True') == 'True'
+TUTOR_CONTEXT_TOKENS = int(os.getenv('TUTOR_CONTEXT_TOKENS', '1500'))
+TUTOR_CONTEXT_MAX_TURNS = int(os.getenv('TUTOR_CONTEXT_MAX_TURNS', '40'))
+TUTOR_CONTEXT_SUMMARY_TOKENS = int(os.getenv('TUTOR_CONTEXT_SUMMARY_TOKENS', '300'))
+TUTOR_CONTEXT_SUMMARY_EVERY = int(os.getenv('TUTOR_CONTEXT_SUMMARY_EVERY', '6'))
+
+# Write-behind chat persistence: messages are queued and committed in batches
+# of up to BATCH_SIZE every FLUSH_INTERVAL seconds, spilled to SPILL_DIR until then
+TUTOR_WRITE_BEHIND_ENABLED = os.getenv('TUTOR_WRITE_BEHIND_ENABLED', 'False') == 'True'
+TUTOR_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('TUTOR_WRITE_BEHIND_BATCH_SIZE', '100'))
+TUTOR_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('TUTOR_WRITE_BEHIND_FLUSH_INTERVAL', '0.5'))
+TUTOR_WRITE_BEHIND_SPILL_DIR = os.getenv('TUTOR_WRITE_BEHIND_SPILL_DIR', BASE_DIR / 'spill')
+
+# Chat history tiering: `manage.py archive_chat_history` (run it from cron, or
+# with --interval) moves messages older than AFTER_DAYS into compressed
+# segments of up to SEGMENT_SIZE messages; history pages read them transparently
+TUTOR_ARCHIVE_AFTER_DAYS = float(os.getenv('TUTOR_ARCHIVE_AFTER_DAYS', '180'))
+TUTOR_ARCHIVE_SEGMENT_SIZE = int(os.getenv('TUTOR_ARCHIVE_SEGMENT_SIZE', '500'))
+
+# Admission control: per-user and global token buckets (requests per minute,
+# burst size) and a cap on concurrent upstream LLM calls, with at most
+# MAX_QUEUE requests waiting up to QUEUE_TIMEOUT seconds for a slot. Limits are
+# per process unless RATELIMIT_SHARED_DB names an SQLite file all workers share.
+TUTOR_RATELIMIT_ENABLED = os.getenv('TUTOR_RATELIMIT_ENABLED', 'True') == 'True'
+TUTOR_RATELIMIT_USER_PER_MINUTE = float(os.getenv('TUTOR_RATELIMIT_USER_PER_MINUTE', '20'))
+TUTOR_RATELIMIT_USER_BURST = int(os.getenv('TUTOR_RATELIMIT_USER_BURST', '10'))
+TUTOR_RATELIMIT_GLOBAL_PER_MINUTE = float(os.getenv('TUTOR_RATELIMIT_GLOBAL_PER_MINUTE', '600'))
+TUTOR_RATELIMIT_GLOBAL_BURST = int(os.getenv('TUTOR_RATELIMIT_GLOBAL_BURST', '100'))
+TUTOR_RATELIMIT_SHARED_DB = os.getenv('TUTOR_RATELIMIT_SHARED_DB', '')
+TUTOR_LLM_MAX_CONCURRENCY = int(os.getenv('TUTOR_LLM_MAX_CONCURRENCY', '16'))
+TUTOR_LLM_QUEUE_TIMEOUT = float(os.getenv('TUTOR_LLM_QUEUE_TIMEOUT', '2'))
+TUTOR_LLM_MAX_QUEUE = int(os.getenv('TUTOR_LLM_MAX_QUEUE', '32'))
+
+# Hedged requests: start Gemini in parallel once RAG exceeds the deadline,
+# given in seconds ("4") or as an observed RAG latency percentile ("p90")
+TUTOR_HEDGE_ENABLED = os.getenv('TUTOR_HEDGE_ENABLED', 'False') == 'True'
+TUTOR_HEDGE_DEADLINE = os.getenv('TUTOR_HEDGE_DEADLINE', 'p90')
+
+# Per-stage latency histograms and counters, served in Prometheus format on
+# /metrics to staff or to scrapers sending "Authorization: Bearer <TOKEN>".
+# With METRICS_DIR set every worker flushes its totals there each
+# FLUSH_INTERVAL seconds and /metrics sums all of them; clear it on deploy.
+TUTOR_METRICS_ENABLED = os.getenv('TUTOR_METRICS_ENABLED', 'True') == 'True'
+TUTOR_METRICS_DIR = os.getenv('TUTOR_METRICS_DIR', '')
+TUTOR_METRICS_FLUSH_INTERVAL = float(os.getenv('TUTOR_METRICS_FLUSH_INTERVAL', '5'))
+TUTOR_METRICS_TOKEN = os.getenv('TUTOR_METRICS_TOKEN', '')
+
+# Logging pipeline (tutor/log_pipeline.py). With LOG_ASYNC the app's loggers
+# only queue records; a background thread writes them to the console and to
+# debug.log, which rotates at LOG_MAX_BYTES keeping LOG_BACKUP_COUNT old files.
+# LOG_FORMAT 'json' writes the file as one JSON object per line, with the
+# request id that every response also returns in X-Request-ID. LOG_SAMPLE_RATES
+# keeps a share of INFO lines per logger, whole requests at a time, e.g.
+# "tutor.views=0.1,tutor.rag=0.25"; unset, every line is kept, and warnings
+# and errors always are.
+TUTOR_LOG_ASYNC = os.getenv('TUTOR_LOG_ASYNC', 'True') == 'True'
+TUTOR_LOG_FORMAT = os.getenv('TUTOR_LOG_FORMAT', 'verbose')
+TUTOR_LOG_MAX_BYTES = int(os.getenv('TUTOR_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+TUTOR_LOG_BACKUP_COUNT = int(os.getenv('TUTOR_LOG_BACKUP_COUNT', '5'))
+TUTOR_LOG_QUEUE_SIZE = int(os.getenv('TUTOR_LOG_QUEUE_SIZE', '10000'))
+TUTOR_LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, _, rate in (
+        rule.partition('=') for rule in os.getenv('TUTOR_LOG_SAMPLE_RATES', '').split(',') if rule.strip()
+    )
+}
+TUTOR_LOG_HANDLERS = ['queue'] if TUTOR_LOG_ASYNC else ['console', 'file']
+
 # Logging Configuration
 LOGGING = {
     'version': 1,
@@ -160,6 +351,9 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'tutor.log_pipeline.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
@@ -167,17 +361,30 @@ LOGGING = {
             'formatter': 'verbose',
         },
         'file': {
-            'class': 'logging.FileHandler',
+            'class': 'logging.handlers.RotatingFileHandler',
             'filename': BASE_DIR / 'debug.log',
-            'formatter': 'verbose',
+            'maxBytes': TUTOR_LOG_MAX_BYTES,
+            'backupCount': TUTOR_LOG_BACKUP_COUNT,
+            'formatter': 'json' if TUTOR_LOG_FORMAT == 'json' else 'verbose',
+        },
+        'queue': {
+            'class': 'tutor.log_pipeline.QueueingHandler',
+            'writer': 'tutor.log_writer',
+            'queue_size': TUTOR_LOG_QUEUE_SIZE,
+            'sample_rates': TUTOR_LOG_SAMPLE_RATES,
         },
     },
     'loggers': {
-        'tutor.views': {
-            'handlers': ['console', 'file'],
+        'tutor': {
+            'handlers': TUTOR_LOG_HANDLERS,
             'level': 'DEBUG' if DEBUG else 'INFO',
             'propagate': True,
         },
+        # The queue's background thread writes to this logger's handlers
+        'tutor.log_writer': {
+            'handlers': ['console', 'file'],
+            'propagate': False,
+        },
         'django': {
             'handlers': ['console'],
             'level': 'INFO',
@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
+from tutor.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('accounts.urls')),
     path('api/', include('tutor.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,6 +1,6 @@
 #tutor/admin.py
 from django.contrib import admin
-from .models import Subject, Chapter
+from .models import Subject, Chapter, CachedAnswer
 
 @admin.register(Subject)
 class SubjectAdmin(admin.ModelAdmin):
@@ -10,4 +10,10 @@ class SubjectAdmin(admin.ModelAdmin):
 class ChapterAdmin(admin.ModelAdmin):
     list_display = ['title', 'subject', 'standard', 'order', 'created_at']
     list_filter = ['subject', 'standard']
-    ordering = ['subject', 'standard', 'order']
\ No newline at end of file
+    ordering = ['subject', 'standard', 'order']
+
+@admin.register(CachedAnswer)
+class CachedAnswerAdmin(admin.ModelAdmin):
+    list_display = ['chapter_key', 'question', 'source', 'hits', 'created_at']
+    list_filter = ['source']
+    search_fields = ['question']
\ No newline at end of file
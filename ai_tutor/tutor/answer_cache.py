@@ -0,0 +1,314 @@
+# tutor/answer_cache.py
+# Two-tier cache of tutor answers keyed by chapter + normalised question:
+# an in-process LRU in front of the CachedAnswer table (TTL + size eviction),
+# with optional near-duplicate matching over character shingle vectors.
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+import hashlib
+import logging
+import re
+import threading
+import time
+import zlib
+import numpy as np
+from .models import CachedAnswer
+
+logger = logging.getLogger(__name__)
+
+# Words that don't change what is being asked ("what is a redox reaction" == "What is redox reaction?")
+FILLER_WORDS = {'a', 'an', 'the', 'please', 'pls', 'plz'}
+SHINGLE_SIZE = 3
+VECTOR_DIM = 1024
+# Size-based eviction of the persistent tier runs once per this many writes,
+# on a background thread so no request waits for the DELETEs
+EVICT_EVERY = 50
+# Hit counts of table rows are written in one batch per this many hits, on the same thread
+HIT_FLUSH_EVERY = 50
+
+def normalise_question(text):
+    words = re.sub(r'[^\w\s]', ' ', text.lower()).split()
+    return ' '.join(word for word in words if word not in FILLER_WORDS)
+
+def question_hash(normalised):
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+
+def chapter_cache_key(subject_id, chapter_id, standard=None):
+    # Chapter numbers repeat across standards, so answers are kept apart per standard
+    if standard:
+        return f"{subject_id}:{standard}:{chapter_id}"
+    return f"{subject_id}:{chapter_id}"
+
+def shingle_vectors(questions):
+    """L2-normalised hashed character-shingle count vectors, one row per question"""
+    matrix = np.zeros((len(questions), VECTOR_DIM), dtype=np.float32)
+    for row, question in enumerate(questions):
+        padded = f" {question} "
+        buckets = [
+            zlib.crc32(padded[i:i + SHINGLE_SIZE].encode('utf-8')) % VECTOR_DIM
+            for i in range(max(1, len(padded) - SHINGLE_SIZE + 1))
+        ]
+        matrix[row] = np.bincount(buckets, minlength=VECTOR_DIM)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class _SimilarityIndex:
+    """Per-chapter matrix of question vectors for vectorised cosine lookup
+
+    Holds at most `capacity` questions, replacing the oldest when full. Rows
+    are reused in place; the matrix grows by doubling up to capacity, so an
+    insert doesn't copy it.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.matrix = np.zeros((0, VECTOR_DIM), dtype=np.float32)
+        self.questions = []  # question of each row, None once removed
+        self.rows = OrderedDict()  # question -> row, oldest first
+        self.free = []
+
+    def add(self, questions):
+        questions = [q for q in dict.fromkeys(questions) if q not in self.rows]
+        for question, vector in zip(questions, shingle_vectors(questions), strict=True):
+            if len(self.rows) >= self.capacity:
+                self.remove(next(iter(self.rows)))
+            if self.free:
+                row = self.free.pop()
+            else:
+                row = len(self.questions)
+                self.questions.append(None)
+                if row == len(self.matrix):
+                    grown = np.zeros((min(self.capacity, max(16, 2 * row)), VECTOR_DIM), dtype=np.float32)
+                    grown[:row] = self.matrix
+                    self.matrix = grown
+            self.matrix[row] = vector
+            self.questions[row] = question
+            self.rows[question] = row
+
+    def remove(self, question):
+        row = self.rows.pop(question, None)
+        if row is not None:
+            # A zero row scores 0 against every question
+            self.matrix[row] = 0
+            self.questions[row] = None
+            self.free.append(row)
+
+    def best_match(self, question, threshold):
+        if not self.rows:
+            return None
+        scores = self.matrix[:len(self.questions)] @ shingle_vectors([question])[0]
+        best = int(np.argmax(scores))
+        if scores[best] >= threshold:
+            return self.questions[best]
+        return None
+
+class AnswerCache:
+    def __init__(self, memory_size=1024, ttl=86400, max_rows=10000, similarity=0.0):
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.similarity = similarity
+        self._memory = OrderedDict()
+        self._indexes = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._evictor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='answer-cache-evict')
+        self._evict_queued = False
+        self._hits = Counter()
+        self._flush_queued = False
+        self.counters = {'memory_hits': 0, 'db_hits': 0, 'similar_hits': 0, 'misses': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[2] > self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry
+
+    def _memory_set(self, key, response, source, age=0.0):
+        """Keep an answer in memory; age (seconds) counts towards its TTL"""
+        with self._lock:
+            self._memory[key] = (response, source, time.monotonic() - age)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _db_get(self, chapter_key, normalised):
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        row = CachedAnswer.objects.filter(
+            chapter_key=chapter_key,
+            question_hash=question_hash(normalised),
+            created_at__gte=cutoff
+        ).values('id', 'response', 'source', 'created_at').first()
+        if row:
+            with self._lock:
+                self._hits[row['id']] += 1
+                flush = self._hits.total() >= HIT_FLUSH_EVERY and not self._flush_queued
+                if flush:
+                    self._flush_queued = True
+            if flush:
+                self._evictor.submit(self._run_flush_hits)
+        return row
+
+    def _index(self, chapter_key):
+        with self._lock:
+            index = self._indexes.get(chapter_key)
+            if index is not None:
+                return index
+        # Seed the chapter's index from the persistent tier on first use
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        questions = list(
+            CachedAnswer.objects.filter(chapter_key=chapter_key, created_at__gte=cutoff)
+            .order_by('-created_at')
+            .values_list('question', flat=True)[:self.max_rows]
+        )
+        with self._lock:
+            index = self._indexes.setdefault(chapter_key, _SimilarityIndex(max(1, self.max_rows)))
+            # Oldest first, so a full index replaces those first
+            index.add(questions[::-1])
+        return index
+
+    def get(self, chapter_key, question):
+        """Return (response, source) for a cached answer, or None"""
+        normalised = normalise_question(question)
+        if not normalised:
+            return None
+
+        entry = self._memory_get((chapter_key, normalised))
+        if entry:
+            self._count('memory_hits')
+            return entry[0], entry[1]
+
+        row = self._db_get(chapter_key, normalised)
+        if row:
+            self._count('db_hits')
+            # Expires from memory when the row does, not a full TTL from now
+            age = (timezone.now() - row['created_at']).total_seconds()
+            self._memory_set((chapter_key, normalised), row['response'], row['source'], age)
+            return row['response'], row['source']
+
+        if self.similarity:
+            index = self._index(chapter_key)
+            with self._lock:
+                match = index.best_match(normalised, self.similarity)
+            if match:
+                entry = self._memory_get((chapter_key, match))
+                row = entry and {'response': entry[0], 'source': entry[1]} or self._db_get(chapter_key, match)
+                if row:
+                    self._count('similar_hits')
+                    logger.info("Answer cache matched '%s' to '%s'", normalised[:50], match[:50])
+                    return row['response'], row['source']
+                # Evicted or expired since it was indexed
+                with self._lock:
+                    index.remove(match)
+
+        self._count('misses')
+        return None
+
+    def set(self, chapter_key, question, response, source):
+        normalised = normalise_question(question)
+        if not normalised or not response:
+            return
+
+        self._memory_set((chapter_key, normalised), response, source)
+        try:
+            CachedAnswer.objects.update_or_create(
+                chapter_key=chapter_key,
+                question_hash=question_hash(normalised),
+                defaults={'question': normalised, 'response': response, 'source': source, 'created_at': timezone.now()}
+            )
+        except Exception as e:
+            logger.error("Failed to persist cached answer: %s", e)
+            return
+
+        if self.similarity:
+            index = self._index(chapter_key)
+            with self._lock:
+                index.add([normalised])
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0 and not self._evict_queued
+            if evict:
+                self._evict_queued = True
+        if evict:
+            self._evictor.submit(self._run_evict)
+
+    def _run_evict(self):
+        try:
+            self.evict()
+        except Exception as e:
+            logger.error("Answer cache eviction failed: %s", e)
+        finally:
+            with self._lock:
+                self._evict_queued = False
+            connection.close()
+
+    def _run_flush_hits(self):
+        try:
+            self.flush_hits()
+        except Exception as e:
+            logger.error("Answer cache hit count update failed: %s", e)
+        finally:
+            with self._lock:
+                self._flush_queued = False
+            connection.close()
+
+    def flush_hits(self):
+        """Add the table hits counted since the last flush to their rows, one UPDATE per distinct count"""
+        with self._lock:
+            hits, self._hits = self._hits, Counter()
+        by_count = defaultdict(list)
+        for row_id, count in hits.items():
+            by_count[count].append(row_id)
+        for count, ids in by_count.items():
+            CachedAnswer.objects.filter(id__in=ids).update(hits=F('hits') + count)
+
+    def evict(self):
+        """Drop expired rows, then the oldest rows beyond max_rows, and their similarity index entries"""
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        expired = CachedAnswer.objects.filter(created_at__lt=cutoff)
+        removed = list(expired.values_list('chapter_key', 'question'))
+        expired.delete()
+        overflow = CachedAnswer.objects.count() - self.max_rows
+        oldest = []
+        if overflow > 0:
+            oldest = list(CachedAnswer.objects.order_by('created_at').values_list('id', 'chapter_key', 'question')[:overflow])
+            CachedAnswer.objects.filter(id__in=[row_id for row_id, _, _ in oldest]).delete()
+        if removed or oldest:
+            logger.info("Answer cache evicted %s expired and %s overflow rows", len(removed), len(oldest))
+        removed += [(chapter_key, question) for _, chapter_key, question in oldest]
+        with self._lock:
+            for chapter_key, question in removed:
+                index = self._indexes.get(chapter_key)
+                if index is not None:
+                    index.remove(question)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['db_hits'] + stats['similar_hits']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+answer_cache = AnswerCache(
+    memory_size=settings.TUTOR_ANSWER_CACHE_MEMORY_SIZE,
+    ttl=settings.TUTOR_ANSWER_CACHE_TTL,
+    max_rows=settings.TUTOR_ANSWER_CACHE_MAX_ROWS,
+    similarity=settings.TUTOR_ANSWER_CACHE_SIMILARITY,
+)
@@ -0,0 +1,127 @@
+# tutor/archive.py
+# Hot/cold tiering of chat history. archive_chat_history moves messages older
+# than TUTOR_ARCHIVE_AFTER_DAYS out of ChatMessage into ArchivedChatSegment
+# rows: zlib-compressed runs of up to TUTOR_ARCHIVE_SEGMENT_SIZE messages of
+# one conversation, each indexed by its newest message. Segments are only ever
+# added, and a conversation's segments are written and its hot rows deleted in
+# the same transaction, so every message is in exactly one tier. fetch_archived()
+# continues a history page from where the hot table runs out.
+from datetime import datetime
+from itertools import groupby
+from django.db import transaction
+from django.db.models import Q
+import json
+import logging
+import zlib
+from .models import ArchivedChatSegment, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Hot rows deleted per statement; stays under SQLite's bound-variable limit
+DELETE_CHUNK = 500
+
+def pack(rows):
+    """Compress message dicts (oldest first) into a segment's data"""
+    payload = [[row['id'], row['role'], row['message'], row['created_at'].isoformat()] for row in rows]
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 6)
+
+def unpack(data):
+    """Message dicts of a segment, oldest first"""
+    return [
+        {'id': message_id, 'role': role, 'message': message, 'created_at': datetime.fromisoformat(created_at)}
+        for message_id, role, message, created_at in json.loads(zlib.decompress(bytes(data)))
+    ]
+
+def archive_users(user_ids, cutoff, segment_size):
+    """Move the messages older than cutoff of these users to the cold tier, in one transaction
+
+    Returns (conversations, messages) archived.
+    """
+    with transaction.atomic():
+        rows = list(
+            ChatMessage.objects.filter(user_id__in=user_ids, created_at__lt=cutoff)
+            .order_by('user_id', 'subject_id', 'chapter_index', 'created_at', 'id')
+            .values('id', 'user_id', 'subject_id', 'chapter_index', 'role', 'message', 'created_at')
+        )
+        segments, conversations = [], 0
+        for (user_id, subject_id, chapter_index), messages in groupby(
+                rows, key=lambda row: (row['user_id'], row['subject_id'], row['chapter_index'])):
+            messages = list(messages)
+            conversations += 1
+            for i in range(0, len(messages), segment_size):
+                chunk = messages[i:i + segment_size]
+                segments.append(ArchivedChatSegment(
+                    user_id=user_id,
+                    subject_id=subject_id,
+                    chapter_index=chapter_index,
+                    first_created_at=chunk[0]['created_at'],
+                    first_message_id=chunk[0]['id'],
+                    last_created_at=chunk[-1]['created_at'],
+                    last_message_id=chunk[-1]['id'],
+                    message_count=len(chunk),
+                    data=pack(chunk),
+                ))
+        ArchivedChatSegment.objects.bulk_create(segments, batch_size=100)
+        ids = [row['id'] for row in rows]
+        for i in range(0, len(ids), DELETE_CHUNK):
+            ChatMessage.objects.filter(id__in=ids[i:i + DELETE_CHUNK]).delete()
+    return conversations, len(rows)
+
+def archive_old_messages(cutoff, segment_size=500, scan_rows=5000, per_transaction=50, max_users=None):
+    """Archive the messages older than cutoff of every user; yields (users, conversations, messages) per scan"""
+    after_id, done = 0, 0
+    while max_users is None or done < max_users:
+        # Old rows in id order: cheap to find, since archiving removes them from the front
+        scanned = list(
+            ChatMessage.objects.filter(created_at__lt=cutoff, id__gt=after_id)
+            .order_by('id').values_list('id', 'user_id')[:scan_rows]
+        )
+        if not scanned:
+            return
+        after_id = scanned[-1][0]
+        users = list(dict.fromkeys(user_id for _, user_id in scanned))
+        if max_users is not None:
+            users = users[:max_users - done]
+        conversations = messages = 0
+        # Short transactions, so the app's writers never wait long for the lock
+        for i in range(0, len(users), per_transaction):
+            archived = archive_users(users[i:i + per_transaction], cutoff, segment_size)
+            conversations += archived[0]
+            messages += archived[1]
+        done += len(users)
+        logger.info("Archived %d messages of %d conversations older than %s", messages, conversations, cutoff)
+        yield len(users), conversations, messages
+
+def has_archived(user_id, subject_id, chapter_index):
+    return ArchivedChatSegment.objects.filter(
+        user_id=user_id, subject_id=subject_id, chapter_index=chapter_index
+    ).exists()
+
+def fetch_archived(user_id, subject_id, chapter_index, before, count):
+    """Up to count (None: all) archived messages older than before=(created_at, id), newest first"""
+    segments = ArchivedChatSegment.objects.filter(
+        user_id=user_id, subject_id=subject_id, chapter_index=chapter_index
+    )
+    if before is not None:
+        created_at, message_id = before
+        segments = segments.filter(
+            Q(first_created_at__lt=created_at) | Q(first_created_at=created_at, first_message_id__lt=message_id)
+        )
+    # The index alone answers this; data is loaded one segment at a time below
+    index = list(segments.order_by('-last_created_at', '-last_message_id').values_list(
+        'id', 'last_created_at', 'last_message_id'
+    ))
+
+    rows = []
+    for position, (segment_id, _, _) in enumerate(index):
+        data = ArchivedChatSegment.objects.values_list('data', flat=True).get(id=segment_id)
+        rows.extend(
+            row for row in unpack(data)
+            if before is None or (row['created_at'], row['id']) < before
+        )
+        rows.sort(key=lambda row: (row['created_at'], row['id']), reverse=True)
+        # Segments of separate archive runs may overlap; stop once no later one can outrank what we have
+        following = index[position + 1][1:] if position + 1 < len(index) else None
+        if count is not None and len(rows) >= count and (following is None or (rows[count - 1]['created_at'], rows[count - 1]['id']) > following):
+            break
+    return rows if count is None else rows[:count]
@@ -0,0 +1,256 @@
+# tutor/async_views.py
+# Async versions of the chat, history and subjects views. Served through
+# ai_tutor/asgi.py (e.g. `uvicorn ai_tutor.asgi:application`), a single process
+# can hold hundreds of slow RAG / Gemini calls without pinning a worker each.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+import json
+import logging
+import time
+from .models import ChatMessage
+from .answer_cache import answer_cache, chapter_cache_key
+from .catalogue import chapter_catalogue
+from .conditional import conditional, history_etag, subjects_etag
+from .gemini import gemini_registry
+from .hedging import arace_with_hedge, hedge_deadline
+from .history import fetch_history_page, parse_page
+from .metrics import (
+    answer_cache_lookups, chat_answers, chat_seconds, failure_reason, upstream_errors, upstream_seconds,
+)
+from .rag import aget_rag_response, rag_latency
+from .singleflight import single_flight
+from .write_behind import chat_writer
+from .ratelimit import RateLimited, llm_limiter, rate_limiter
+from .views import (
+    HEDGE_SOURCES, build_tutor_prompt, coalescing_key, conversation_context, rag_scope,
+    rate_limited_response, student_standard,
+)
+
+logger = logging.getLogger(__name__)
+
+def async_ajax_login_required(func):
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        return await func(request, *args, **kwargs)
+    return wrapper
+
+async def get_gemini_response(user_message, topic=None, context=None):
+    """Generate response using Gemini's async API"""
+    models, init_error = gemini_registry.candidates()
+    if not models:
+        upstream_errors.inc(upstream='gemini', reason='init')
+        return None, init_error
+
+    full_prompt = build_tutor_prompt(user_message, topic, context)
+    api_error = None
+    for model_name, model in models:
+        started = time.perf_counter()
+        try:
+            response = await model.generate_content_async(full_prompt)
+            if response and hasattr(response, 'text') and response.text:
+                upstream_seconds.observe(time.perf_counter() - started, upstream='gemini', outcome='ok')
+                gemini_registry.mark_working(model_name)
+                return response.text, None
+            upstream_errors.inc(upstream='gemini', reason='empty')
+            return None, "Gemini API returned empty response"
+        except Exception as e:
+            logger.error("Gemini API call failed on %s: %s", model_name, e)
+            upstream_seconds.observe(time.perf_counter() - started, upstream='gemini', outcome='error')
+            upstream_errors.inc(upstream='gemini', reason=failure_reason(e))
+            api_error = f"Gemini API call error: {str(e)}"
+
+    return None, api_error
+
+async def generate_ai_response(user_message, chapter_id=None, topic=None, context=None, subject=None, standard=None):
+    """Answer from RAG, falling back to (or hedging with) Gemini
+
+    Returns (response, source, error).
+    """
+    if settings.TUTOR_HEDGE_ENABLED:
+        # Race Gemini against RAG once RAG is slower than the hedge deadline
+        deadline = hedge_deadline(rag_latency, settings.TUTOR_HEDGE_DEADLINE)
+        (ai_response, ai_error), winner = await arace_with_hedge(
+            lambda: aget_rag_response(user_message, chapter_id, context, subject, standard),
+            lambda: get_gemini_response(user_message, topic, context),
+            deadline
+        )
+        if ai_response:
+            return ai_response, HEDGE_SOURCES[winner], None
+        return None, None, ai_error
+
+    # Primary: Try RAG server first
+    ai_response, rag_error = await aget_rag_response(user_message, chapter_id, context, subject, standard)
+    if ai_response:
+        return ai_response, 'rag_model', None
+
+    # Fallback: Use Gemini when fine-tuned model is not available
+    logger.warning("%s, falling back to Gemini...", rag_error)
+    gemini_response, gemini_error = await get_gemini_response(user_message, topic, context)
+    if gemini_response:
+        return gemini_response, 'gemini_fallback', None
+    return None, None, gemini_error
+
+async def admitted_ai_response(user_message, chapter_id=None, topic=None, context=None, subject=None, standard=None):
+    """generate_ai_response within the outbound LLM concurrency limit"""
+    if not settings.TUTOR_RATELIMIT_ENABLED:
+        return await generate_ai_response(user_message, chapter_id, topic, context, subject, standard)
+    slot = await llm_limiter.aacquire()
+    try:
+        return await generate_ai_response(user_message, chapter_id, topic, context, subject, standard)
+    finally:
+        await slot.arelease()
+
+async def cached_ai_response(user_message, subject_id, chapter_id, standard=None, context=None):
+    """generate_ai_response behind the answer cache and request coalescing"""
+    # The catalogue may reload from the database
+    topic = await sync_to_async(chapter_catalogue.topic)(subject_id, standard, chapter_id)
+    scope = await sync_to_async(rag_scope)(subject_id, standard)
+    if context:
+        # Follow-ups depend on the conversation, so they are neither cached nor coalesced
+        return await admitted_ai_response(user_message, chapter_id, topic, context, **scope)
+
+    cache_key = chapter_cache_key(subject_id, chapter_id, standard)
+    if settings.TUTOR_ANSWER_CACHE_ENABLED:
+        cached = await sync_to_async(answer_cache.get)(cache_key, user_message)
+        answer_cache_lookups.inc(result='hit' if cached else 'miss')
+        if cached:
+            return cached[0], 'cache', None
+
+    coalesced = False
+    if settings.TUTOR_SINGLEFLIGHT_ENABLED:
+        (ai_response, source, ai_error), coalesced = await single_flight.ado(
+            coalescing_key(cache_key, user_message),
+            lambda: admitted_ai_response(user_message, chapter_id, topic, **scope)
+        )
+    else:
+        ai_response, source, ai_error = await admitted_ai_response(user_message, chapter_id, topic, **scope)
+
+    if ai_response and not coalesced and settings.TUTOR_ANSWER_CACHE_ENABLED:
+        await sync_to_async(answer_cache.set)(cache_key, user_message, ai_response, source)
+    return ai_response, source, ai_error
+
+async def save_chat_message(user, subject_id, chapter_id, role, message):
+    """Persist one chat turn, logging instead of failing the request"""
+    if not (subject_id and chapter_id):
+        return
+    try:
+        if settings.TUTOR_WRITE_BEHIND_ENABLED:
+            # Writes the spill file, and the first call replays orphaned ones through the ORM
+            await sync_to_async(chat_writer.enqueue)(user.id, subject_id, chapter_id, role, message, timezone.now())
+            return
+        await ChatMessage.objects.acreate(
+            user=user,
+            subject_id=subject_id,
+            chapter_index=chapter_id,
+            role=role,
+            message=message
+        )
+    except Exception as e:
+        logger.error("Failed to save %s message: %s", role, e)
+
+@async_ajax_login_required
+@conditional(subjects_etag)
+async def subjects_view(request):
+    subjects_data = [
+        {
+            'id': subject_id,
+            'name': name
+        }
+        for subject_id, name in await sync_to_async(chapter_catalogue.subjects)()
+    ]
+    return JsonResponse({'subjects': subjects_data})
+
+@async_ajax_login_required
+@conditional(history_etag)
+async def get_chat_history(request):
+    try:
+        subject_id = request.GET.get('subject_id')
+        chapter_id = request.GET.get('chapter_id')
+
+        if not subject_id or not chapter_id:
+            return JsonResponse({'error': 'Missing subject_id or chapter_id'}, status=400)
+
+        user = await request.auser()
+        try:
+            limit, before = parse_page(request.GET)
+            history, next_cursor = await sync_to_async(fetch_history_page)(
+                user.id, subject_id, chapter_id,
+                limit=limit, before=before
+            )
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse({
+            'history': history,
+            'has_more': next_cursor is not None,
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        logger.error("Error fetching chat history: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@async_ajax_login_required
+async def chat_view(request):
+    started = time.perf_counter()
+    try:
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError as e:
+            logger.error("Invalid JSON in request body: %s", e)
+            return JsonResponse({'error': 'Invalid JSON format'}, status=400)
+
+        user_message = data.get('message', '').strip()
+        chapter_id = data.get('chapter_id')
+        subject_id = data.get('subject_id')
+
+        if not user_message:
+            logger.warning("Empty message received")
+            return JsonResponse({'error': 'Message is required'}, status=400)
+
+        user = await request.auser()
+        if settings.TUTOR_RATELIMIT_ENABLED:
+            # The shared store is an SQLite file with a busy timeout
+            await sync_to_async(rate_limiter.check, thread_sensitive=False)(user.id)
+
+        logger.info("Async chat request from user: %s, chapter_id: %s, subject_id: %s", user, chapter_id, subject_id)
+        context = await sync_to_async(conversation_context)(user, subject_id, chapter_id, user_message)
+
+        standard = await sync_to_async(student_standard)(request)
+        ai_response, source, ai_error = await cached_ai_response(
+            user_message, subject_id, chapter_id, standard, context
+        )
+        # Saved once an upstream call slot was granted; a 429 saves nothing
+        await save_chat_message(user, subject_id, chapter_id, 'user', user_message)
+        chat_answers.inc(source=source or 'error')
+        chat_seconds.observe(time.perf_counter() - started, source=source or 'error')
+        if ai_response:
+            await save_chat_message(user, subject_id, chapter_id, 'ai', ai_response)
+            return JsonResponse({
+                'response': ai_response,
+                'success': True,
+                'source': source
+            })
+
+        logger.error("Both fine-tuned model and Gemini failed. Gemini error: %s", ai_error)
+        return JsonResponse({
+            'error': f'Both fine-tuned model and Gemini failed. Gemini error: {ai_error}',
+            'success': False
+        }, status=500)
+
+    except RateLimited as e:
+        logger.warning("Rejected async chat request: %s", e)
+        return rate_limited_response(e)
+    except Exception as e:
+        logger.error("Unexpected error in async chat_view: %s", e, exc_info=True)
+        return JsonResponse({
+            'error': f'Internal server error: {str(e)}',
+            'success': False
+        }, status=500)
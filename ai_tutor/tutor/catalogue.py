@@ -0,0 +1,116 @@
+# tutor/catalogue.py
+# In-memory index of subjects and chapters, loaded from the database and keyed
+# by (subject, standard, order), so listing chapters and building prompts cost
+# no queries. Chapter/Subject saves and deletes bump a version counter kept in
+# the default cache; every process reloads when it sees a newer version (use a
+# shared CACHES backend for that to reach all workers; TUTOR_CATALOGUE_TTL
+# bounds staleness otherwise).
+from django.conf import settings
+from django.core.cache import cache
+import hashlib
+import logging
+import threading
+import time
+from .models import Chapter, Subject
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'tutor:catalogue:version'
+
+def normalise_standard(standard):
+    """'10', '10th' and ' 10TH ' all name the stored standard '10th'"""
+    standard = str(standard or '').strip().lower()
+    if standard.isdigit():
+        standard += 'th'
+    return standard
+
+class ChapterCatalogue:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._subjects = {}
+        self._chapters = {}
+        self._titles = {}
+        self._digest = ''
+        self._version = None
+        self._loaded_at = 0.0
+
+    def _current(self):
+        version = cache.get(VERSION_KEY, 0)
+        fresh = time.monotonic() - self._loaded_at < self.ttl
+        if self._version == version and fresh:
+            return
+        with self._lock:
+            if self._version == version and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            self._load(version)
+
+    def _load(self, version):
+        subjects = dict(Subject.objects.values_list('id', 'name'))
+        chapters = {}
+        titles = {}
+        rows = Chapter.objects.order_by('subject_id', 'standard', 'order', 'title').values_list(
+            'subject_id', 'standard', 'order', 'title'
+        )
+        for subject_id, standard, order, title in rows:
+            key = (subject_id, normalise_standard(standard))
+            chapters.setdefault(key, []).append((order, title))
+            titles[key + (order,)] = title
+
+        # Content fingerprint: a validator that agrees across processes, unlike the counter
+        digest = hashlib.sha1(repr((sorted(subjects.items()), sorted(titles.items()))).encode('utf-8'))
+
+        self._subjects, self._chapters, self._titles = subjects, chapters, titles
+        self._digest = digest.hexdigest()[:16]
+        self._version = version
+        self._loaded_at = time.monotonic()
+        logger.info("Loaded chapter catalogue v%s: %s subjects, %s chapters", version, len(subjects), len(titles))
+
+    def digest(self):
+        self._current()
+        return self._digest
+
+    def subjects(self):
+        """[(id, name), ...] in id order"""
+        self._current()
+        return sorted(self._subjects.items())
+
+    def subject_name(self, subject_id):
+        self._current()
+        try:
+            return self._subjects.get(int(subject_id))
+        except (TypeError, ValueError):
+            return None
+
+    def chapters(self, subject_id, standard):
+        """[(order, title), ...] for one subject and standard, in order"""
+        self._current()
+        return self._chapters.get((int(subject_id), normalise_standard(standard)), [])
+
+    def chapter_title(self, subject_id, standard, order):
+        self._current()
+        try:
+            return self._titles.get((int(subject_id), normalise_standard(standard), int(order)))
+        except (TypeError, ValueError):
+            return None
+
+    def topic(self, subject_id, standard, order):
+        """Prompt topic for a chapter: its title, else the subject in general"""
+        title = self.chapter_title(subject_id, standard, order)
+        if title:
+            return title
+        name = self.subject_name(subject_id)
+        return f"General {name}" if name else None
+
+    def invalidate(self):
+        """Make every process reload on its next lookup"""
+        cache.add(VERSION_KEY, 0, timeout=None)
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(VERSION_KEY, 1, timeout=None)
+        # Reload here even if the cache backend is unavailable
+        self._loaded_at = 0.0
+
+chapter_catalogue = ChapterCatalogue(ttl=settings.TUTOR_CATALOGUE_TTL)
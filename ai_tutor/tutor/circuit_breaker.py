@@ -0,0 +1,111 @@
+# tutor/circuit_breaker.py
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker shared by every request in the process
+
+    Closed: calls go through, consecutive failures are counted.
+    Open: calls are refused immediately so callers fall back without waiting.
+          A background thread runs `probe` every `probe_interval` seconds.
+    Half-open: the probe saw the backend healthy again; a single trial call
+          is let through and its outcome closes or re-opens the circuit.
+          A trial that never reports back is abandoned after `trial_timeout`.
+    close() stops the probe thread for good.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=3, probe=None, probe_interval=5.0, trial_timeout=120.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.trial_timeout = trial_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._probe_thread = None
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN:
+                now = time.monotonic()
+                if not self._trial_in_flight or now - self._trial_started > self.trial_timeout:
+                    self._trial_in_flight = True
+                    self._trial_started = now
+                    return True
+            return False
+
+    def refusing(self):
+        """Whether allow_request() would refuse now: open, or half-open with its trial in flight"""
+        with self._lock:
+            if self._state == self.OPEN:
+                return True
+            if self._state == self.HALF_OPEN:
+                return self._trial_in_flight and time.monotonic() - self._trial_started <= self.trial_timeout
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit '%s' closed, backend recovered", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Circuit '%s' opened after %s consecutive failures", self.name, self._failures)
+                self._state = self.OPEN
+                self._start_probe()
+
+    def _start_probe(self):
+        # Called with the lock held
+        if self.probe is None or self._closed.is_set() or (self._probe_thread and self._probe_thread.is_alive()):
+            return
+        self._probe_thread = threading.Thread(
+            target=self._probe_loop, name=f'{self.name}-health-probe', daemon=True
+        )
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while not self._closed.wait(self.probe_interval):
+            try:
+                healthy = self.probe()
+            except Exception as e:
+                logger.debug("Circuit '%s' health probe failed: %s", self.name, e)
+                healthy = False
+
+            with self._lock:
+                if self._state != self.OPEN:
+                    return
+                if healthy:
+                    logger.info("Circuit '%s' half-open, backend reports healthy", self.name)
+                    self._state = self.HALF_OPEN
+                    return
+
+    def close(self):
+        """Stop health probing, waiting for a probe in progress to finish"""
+        self._closed.set()
+        thread = self._probe_thread
+        if thread and thread is not threading.current_thread():
+            thread.join()
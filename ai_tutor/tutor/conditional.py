@@ -0,0 +1,94 @@
+# tutor/conditional.py
+# Conditional GET for the read-heavy endpoints. Each resource has a cheap
+# validator (the catalogue fingerprint, or the newest message of a
+# conversation), so a client revalidating with If-None-Match gets a 304
+# before the view queries or serialises anything.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+from functools import wraps
+import hashlib
+import inspect
+from accounts.models import StudentProfile
+from accounts.profile_cache import get_profile
+from .catalogue import chapter_catalogue, normalise_standard
+from .history import decode_cursor, parse_page
+from .models import ChatMessage
+from .write_behind import chat_writer
+
+def _digest(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+
+def subjects_etag(request):
+    return f"subjects-{chapter_catalogue.digest()}"
+
+def chapters_etag(request, subject_id):
+    if chapter_catalogue.subject_name(subject_id) is None:
+        return None
+    try:
+        profile = get_profile(request)
+    except StudentProfile.DoesNotExist:
+        return None
+    # No validator for error responses, so they are never answered with 304
+    if not profile.standard_selected or not profile.standard:
+        return None
+    standard = normalise_standard(profile.standard)
+    return f"chapters-{chapter_catalogue.digest()}-{subject_id}-{standard}"
+
+def history_etag(request):
+    subject_id = request.GET.get('subject_id')
+    chapter_id = request.GET.get('chapter_id')
+    if not subject_id or not chapter_id:
+        return None
+    try:
+        limit, before = parse_page(request.GET)
+        if before:
+            decode_cursor(before)
+        newest = ChatMessage.objects.filter(
+            user_id=request.user.id,
+            subject_id=subject_id,
+            chapter_index=chapter_id
+        ).order_by('-created_at', '-id').values_list('id', 'created_at').first()
+    except ValueError:
+        return None
+
+    # A new message, flushed or not, changes every page of the conversation
+    pending = None
+    if settings.TUTOR_WRITE_BEHIND_ENABLED:
+        queued = chat_writer.pending_for(request.user.id, subject_id, chapter_id)
+        pending = (len(queued), queued[-1]['created_at']) if queued else None
+    return f"history-{_digest(request.user.id, subject_id, chapter_id, limit, before, newest, pending)}"
+
+def conditional(etag_func):
+    """Answer If-None-Match with 304 using etag_func; works on sync and async views
+
+    Responses are marked private/no-cache so browsers store them but
+    revalidate on every use.
+    """
+    def decorator(view):
+        if not inspect.iscoroutinefunction(view):
+            conditional_view = condition(etag_func=etag_func)(view)
+
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                response = conditional_view(request, *args, **kwargs)
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+            return wrapper
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # Validators may query the database, which async code can't do directly
+            etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag else None
+            response = get_conditional_response(request, etag=etag) if etag else None
+            if response is None:
+                response = await view(request, *args, **kwargs)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return async_wrapper
+    return decorator
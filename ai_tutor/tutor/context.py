@@ -0,0 +1,214 @@
+# tutor/context.py
+# Conversation context for follow-up questions: the most recent turns that fit
+# a token budget, plus a rolling summary of everything older. The summary is
+# stored per (user, subject, chapter) and extended in the background once
+# SUMMARY_EVERY turns have dropped out of the window, so neither prompt size
+# nor request latency grows with the length of the conversation.
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from django.conf import settings
+from django.db import connection
+import logging
+import re
+import threading
+from .gemini import gemini_registry
+from .history import fetch_history_page
+from .models import ChatMessage, ConversationSummary
+
+logger = logging.getLogger(__name__)
+
+# Per-turn overhead of role labels and separators
+TURN_OVERHEAD_TOKENS = 4
+# Older turns folded into the summary per background refresh
+SUMMARY_BATCH = 50
+
+SUMMARY_PROMPT = """Summarise this tutoring conversation between a student and an AI tutor
+in at most {words} words. Keep the topics covered, what the student struggled
+with and any definitions or results the tutor gave; drop greetings and filler.
+
+{previous}New turns:
+{turns}
+
+Summary:"""
+
+# Words that point back at earlier turns ("explain that again", "one more example")
+REFERRING_WORDS = {
+    'it', 'its', 'this', 'that', 'these', 'those', 'they', 'them', 'their', 'he', 'she', 'his', 'her',
+    'again', 'more', 'another', 'else', 'also', 'above', 'previous', 'earlier', 'last', 'same', 'your',
+}
+# Openers that continue the previous question ("and for bases?", "what about metals?")
+CONTINUING_OPENERS = ('and', 'but', 'so', 'or', 'then', 'what about', 'how about')
+# Shorter questions rarely stand on their own ("why?", "how come?")
+MIN_STANDALONE_WORDS = 3
+
+def is_follow_up(question):
+    """Whether a question likely needs the conversation to be understood"""
+    words = re.findall(r"[a-z]+", question.lower())
+    if len(words) < MIN_STANDALONE_WORDS:
+        return True
+    text = ' '.join(words)
+    if any(text == opener or text.startswith(opener + ' ') for opener in CONTINUING_OPENERS):
+        return True
+    return any(word in REFERRING_WORDS for word in words)
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), no tokenizer needed"""
+    return len(text) // 4 + 1
+
+def _format_turns(turns):
+    return '\n'.join(
+        f"{'Student' if turn['role'] == 'user' else 'Tutor'}: {turn['message']}" for turn in turns
+    )
+
+def _trim_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * 4].rsplit(' ', 1)[0] + '…'
+
+def extractive_summary(previous, turns, max_tokens):
+    """Fallback when Gemini is unavailable: the student's questions, newest kept"""
+    lines = previous.splitlines() if previous else []
+    lines += [f"- Student asked: {_trim_to_tokens(turn['message'], 40)}" for turn in turns if turn['role'] == 'user']
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return _trim_to_tokens('\n'.join(lines), max_tokens)
+
+def summarise(previous, turns, max_tokens):
+    """Fold turns into the previous summary"""
+    models, init_error = gemini_registry.candidates()
+    if models:
+        prompt = SUMMARY_PROMPT.format(
+            words=max_tokens * 3 // 4,
+            previous=f"Summary so far:\n{previous}\n\n" if previous else '',
+            turns=_format_turns(turns),
+        )
+        for model_name, model in models:
+            try:
+                response = model.generate_content(prompt)
+                if response and response.text:
+                    gemini_registry.mark_working(model_name)
+                    return _trim_to_tokens(response.text.strip(), max_tokens)
+            except Exception as e:
+                logger.warning("Summary generation failed on %s: %s", model_name, e)
+    else:
+        logger.debug("Gemini unavailable for summaries: %s", init_error)
+    return extractive_summary(previous, turns, max_tokens)
+
+class SummaryRefresher:
+    """Extends conversation summaries off the request path, one job per conversation"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='conversation-summary')
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, user_id, subject_id, chapter_index, boundary):
+        key = (user_id, int(subject_id), int(chapter_index))
+        with self._lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+        self._executor.submit(self._run, key, boundary)
+
+    def _run(self, key, boundary):
+        try:
+            self.refresh(*key, boundary)
+        except Exception as e:
+            logger.error("Refreshing conversation summary %s failed: %s", key, e)
+        finally:
+            with self._lock:
+                self._queued.discard(key)
+            connection.close()
+
+    def refresh(self, user_id, subject_id, chapter_index, boundary):
+        """Fold turns older than `boundary` that the summary doesn't cover yet"""
+        row = ConversationSummary.objects.filter(
+            user_id=user_id, subject_id=subject_id, chapter_index=chapter_index
+        ).first()
+        messages = ChatMessage.objects.filter(
+            user_id=user_id, subject_id=subject_id, chapter_index=chapter_index, created_at__lt=boundary
+        )
+        if row:
+            messages = messages.filter(created_at__gt=row.covered_until)
+        turns = list(messages.order_by('created_at', 'id').values('role', 'message', 'created_at')[:SUMMARY_BATCH])
+        if not turns:
+            return
+
+        summary = summarise(row.summary if row else '', turns, settings.TUTOR_CONTEXT_SUMMARY_TOKENS)
+        ConversationSummary.objects.update_or_create(
+            user_id=user_id, subject_id=subject_id, chapter_index=chapter_index,
+            defaults={
+                'summary': summary,
+                'covered_until': turns[-1]['created_at'],
+                'turns_covered': (row.turns_covered if row else 0) + len(turns),
+            }
+        )
+        logger.info("Summarised %s turns of conversation %s:%s:%s", len(turns), user_id, subject_id, chapter_index)
+
+summary_refresher = SummaryRefresher()
+
+def build_context(user_id, subject_id, chapter_index, budget=None):
+    """Context to send upstream with the next question, or None for a new conversation
+
+    Returns {'summary': str or None, 'turns': [{'role', 'message'}, ...]} with
+    turns oldest first and the whole thing within `budget` estimated tokens.
+    """
+    budget = budget or settings.TUTOR_CONTEXT_TOKENS
+    history, older = fetch_history_page(user_id, subject_id, chapter_index, limit=settings.TUTOR_CONTEXT_MAX_TURNS)
+    if not history:
+        return None
+
+    row = ConversationSummary.objects.filter(
+        user_id=user_id, subject_id=subject_id, chapter_index=chapter_index
+    ).values('summary', 'covered_until').first()
+    summary = row['summary'] if row else None
+    remaining = budget - (estimate_tokens(summary) if summary else 0)
+
+    # Newest turns first until the budget runs out
+    recent = []
+    for turn in reversed(history):
+        cost = estimate_tokens(turn['message']) + TURN_OVERHEAD_TOKENS
+        if cost > remaining:
+            break
+        recent.append(turn)
+        remaining -= cost
+    recent.reverse()
+
+    # Turns outside the window are folded into the summary in batches
+    dropped = history[:len(history) - len(recent)]
+    if dropped or older:
+        covered_until = row['covered_until'] if row else None
+        boundary = datetime.fromisoformat(recent[0]['created_at'] if recent else history[-1]['created_at'])
+        if older:
+            # Turns beyond the fetched page too; count them on the conversation index
+            unsummarised = ChatMessage.objects.filter(
+                user_id=user_id, subject_id=subject_id, chapter_index=chapter_index, created_at__lt=boundary
+            )
+            if covered_until:
+                unsummarised = unsummarised.filter(created_at__gt=covered_until)
+            unsummarised = unsummarised.count()
+        else:
+            unsummarised = sum(
+                1 for turn in dropped
+                if covered_until is None or datetime.fromisoformat(turn['created_at']) > covered_until
+            )
+        if unsummarised >= settings.TUTOR_CONTEXT_SUMMARY_EVERY:
+            summary_refresher.schedule(user_id, subject_id, chapter_index, boundary)
+
+    if not summary and not recent:
+        return None
+    return {
+        'summary': summary,
+        'turns': [{'role': turn['role'], 'message': turn['message']} for turn in recent],
+    }
+
+def format_context(context):
+    """Context as prompt text for Gemini"""
+    if not context:
+        return ''
+    parts = []
+    if context['summary']:
+        parts.append(f"Summary of the earlier conversation:\n{context['summary']}")
+    if context['turns']:
+        parts.append(f"Most recent turns:\n{_format_turns(context['turns'])}")
+    return '\n\n'.join(parts)
@@ -0,0 +1,132 @@
+# tutor/gemini.py
+# Process-wide Gemini setup: the SDK is configured once, GenerativeModel
+# instances stay warm between requests and the model that last answered is
+# tried first. The available-model list is refreshed on a background thread
+# every TUTOR_GEMINI_MODELS_TTL seconds, off the hot path.
+from django.conf import settings
+import google.generativeai as genai
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+def list_available_gemini_models():
+    """List available Gemini models for debugging"""
+    try:
+        api_key = os.getenv('GOOGLE_API_KEY')
+        if not api_key:
+            return []
+        genai.configure(api_key=api_key)
+        models = genai.list_models()
+        return [model.name for model in models if 'generateContent' in model.supported_generation_methods]
+    except Exception as e:
+        logger.error("Error listing available models: %s", e)
+        return []
+
+class GeminiRegistry:
+    def __init__(self, model_names, models_ttl=600):
+        self.model_names = list(model_names)
+        self.models_ttl = models_ttl
+        self._api_key = None
+        self._models = {}
+        self._preferred = None
+        self._available = []
+        self._refresher = None
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+
+    def _ensure_configured(self):
+        api_key = os.getenv('GOOGLE_API_KEY')
+        if not api_key:
+            logger.error("GOOGLE_API_KEY environment variable not set")
+            return "Gemini API key not configured"
+
+        with self._lock:
+            # Configure once; again only if the key is rotated
+            if api_key != self._api_key:
+                logger.info("Configuring Gemini...")
+                genai.configure(api_key=api_key)
+                self._api_key = api_key
+                self._models.clear()
+            self._start_refresher()
+        return None
+
+    def candidates(self):
+        """Return ([(name, model), ...], error) with the last working model first"""
+        try:
+            error = self._ensure_configured()
+            if error:
+                return [], error
+
+            names = list(self.model_names)
+            preferred = self._preferred
+            if preferred in names:
+                names.remove(preferred)
+                names.insert(0, preferred)
+
+            models = []
+            for model_name in names:
+                model = self._models.get(model_name)
+                if model is None:
+                    try:
+                        model = genai.GenerativeModel(model_name)
+                        logger.info("Gemini model %s initialized successfully", model_name)
+                    except Exception as e:
+                        logger.warning("Failed to initialize %s: %s", model_name, e)
+                        continue
+                    self._models[model_name] = model
+                models.append((model_name, model))
+        except Exception as config_error:
+            logger.error("Error configuring Gemini: %s", config_error)
+            return [], f"Gemini configuration error: {str(config_error)}"
+
+        if not models:
+            return [], self.describe_failure()
+        return models, None
+
+    def mark_working(self, model_name):
+        if self._preferred != model_name:
+            logger.info("Gemini model %s is now preferred", model_name)
+        self._preferred = model_name
+
+    def describe_failure(self):
+        error_msg = f"Failed to initialize any Gemini model. Tried: {', '.join(self.model_names)}"
+        available_models = self.available_models()
+        if available_models:
+            error_msg += f". Available models: {', '.join(available_models)}"
+        logger.error(error_msg)
+        return error_msg
+
+    def available_models(self):
+        """Available models as of the last background refresh"""
+        with self._lock:
+            return list(self._available)
+
+    def _start_refresher(self):
+        # Called with the lock held, once the SDK has a key to list models with
+        if self._refresher is None and not self._closed.is_set():
+            self._refresher = threading.Thread(target=self._refresh_loop, name='gemini-models-refresh', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        # Every models_ttl seconds, starting straight away so the first failure can name them
+        while True:
+            available = list_available_gemini_models()
+            if available:
+                with self._lock:
+                    self._available = available
+            if self._closed.wait(self.models_ttl):
+                return
+
+    def close(self):
+        """Stop the background refresh"""
+        self._closed.set()
+        if self._refresher:
+            self._refresher.join()
+
+# Order: newest to oldest, most reliable first
+gemini_registry = GeminiRegistry(
+    ['gemini-2.0-flash-exp', 'gemini-2.0-flash', 'gemini-1.5-pro'],
+    models_ttl=settings.TUTOR_GEMINI_MODELS_TTL,
+)
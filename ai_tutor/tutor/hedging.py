@@ -0,0 +1,137 @@
+# tutor/hedging.py
+# Hedged requests: start the backup (Gemini) when the primary (RAG) is slower
+# than its usual latency, and take whichever valid answer arrives first.
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+import asyncio
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Pools for the sync views. Losers can't be interrupted and keep running until
+# their timeout, so backups get a pool of their own: when the primary backend
+# is wedged its calls fill the primary pool, and the hedge still starts on time.
+_primary_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge-primary')
+_backup_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge-backup')
+
+class LatencyTracker:
+    """Rolling window of observed latencies (seconds) with percentile lookup"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+def hedge_deadline(tracker, setting, default=5.0, min_samples=20):
+    """Resolve a deadline setting: seconds ("3.5") or an observed percentile ("p90")
+
+    Malformed settings fall back to the default rather than failing the request.
+    """
+    setting = str(setting).strip().lower()
+    try:
+        if setting.startswith('p'):
+            percentile = float(setting[1:])
+            if not 0 < percentile <= 100:
+                raise ValueError(f"percentile out of range: {setting}")
+            if len(tracker) < min_samples:
+                return default
+            return tracker.percentile(percentile / 100)
+        seconds = float(setting)
+        if not seconds >= 0:
+            raise ValueError(f"negative deadline: {setting}")
+        return seconds
+    except ValueError as e:
+        logger.warning("Invalid hedge deadline %r, using %ss: %s", setting, default, e)
+        return default
+
+def _call(func):
+    try:
+        return func()
+    except Exception as e:
+        return None, str(e)
+
+def race_with_hedge(primary, backup, deadline):
+    """Run primary; past the deadline also run backup, first valid answer wins
+
+    Both callables return (response, error). Returns ((response, error), winner)
+    where winner is 'primary', 'hedge' (backup beat a slow primary) or
+    'fallback' (primary failed before the deadline, backup ran alone).
+    """
+    primary_future = _primary_executor.submit(_call, primary)
+    try:
+        result = primary_future.result(timeout=deadline)
+    except FuturesTimeout:
+        pass
+    else:
+        if result[0]:
+            return result, 'primary'
+        return _call(backup), 'fallback'
+
+    logger.info("Primary exceeded hedge deadline of %.2fs, starting backup request", deadline)
+    backup_future = _backup_executor.submit(_call, backup)
+    pending = {primary_future, backup_future}
+    backup_result = None
+
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result[0]:
+                # A loser still queued never starts; a running one can't be
+                # interrupted mid-request and its result is ignored
+                for loser in pending:
+                    loser.cancel()
+                return result, 'primary' if future is primary_future else 'hedge'
+            if future is backup_future:
+                backup_result = result
+
+    return backup_result, 'hedge'
+
+async def arace_with_hedge(primary, backup, deadline):
+    """Async race_with_hedge; takes coroutine functions and cancels the loser"""
+    async def call(func):
+        try:
+            return await func()
+        except Exception as e:
+            return None, str(e)
+
+    primary_task = asyncio.ensure_future(call(primary))
+    done, _ = await asyncio.wait({primary_task}, timeout=deadline)
+    if done:
+        result = primary_task.result()
+        if result[0]:
+            return result, 'primary'
+        return await call(backup), 'fallback'
+
+    logger.info("Primary exceeded hedge deadline of %.2fs, starting backup request", deadline)
+    backup_task = asyncio.ensure_future(call(backup))
+    pending = {primary_task, backup_task}
+    backup_result = None
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            result = task.result()
+            if result[0]:
+                for loser in pending:
+                    loser.cancel()
+                return result, 'primary' if task is primary_task else 'hedge'
+            if task is backup_task:
+                backup_result = result
+
+    return backup_result, 'hedge'
@@ -0,0 +1,113 @@
+# tutor/history.py
+# Keyset pagination over a conversation: pages are fetched newest-first on
+# (created_at, id) so cost stays flat however long the conversation grows.
+# Once the client scrolls back past the hot table, pages continue into the
+# archived cold tier (tutor/archive.py) with the same cursors. Clients that
+# pass neither limit nor before still get the whole conversation at once.
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+import base64
+from .archive import fetch_archived, has_archived
+from .models import ChatMessage
+from .write_behind import chat_writer
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(created_at, message_id):
+    raw = f"{created_at.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, message_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def parse_limit(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        limit = 0
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, MAX_PAGE_SIZE)
+
+def parse_page(params):
+    """(limit, before) of a history request; limit is None for the full, unpaginated history"""
+    limit, before = params.get('limit'), params.get('before')
+    if limit in (None, '') and not before:
+        return None, None
+    return parse_limit(limit), before or None
+
+def fetch_history_page(user_id, subject_id, chapter_index, limit=DEFAULT_PAGE_SIZE, before=None):
+    """Return (messages, next_cursor) for the `limit` messages older than `before`
+
+    Messages are dicts in chronological order. next_cursor is None when
+    there is nothing older to scroll back to. limit=None returns the whole
+    conversation, archived messages included.
+    """
+    # Snapshot unflushed write-behind messages before querying, so a batch
+    # committed in between shows up twice (deduplicated below) rather than never
+    pending = []
+    if settings.TUTOR_WRITE_BEHIND_ENABLED and not before:
+        pending = chat_writer.pending_for(user_id, subject_id, chapter_index)
+
+    messages = ChatMessage.objects.filter(
+        user_id=user_id,
+        subject_id=subject_id,
+        chapter_index=chapter_index
+    )
+    cursor = None
+    if before:
+        cursor = created_at, message_id = decode_cursor(before)
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+        )
+
+    rows = messages.order_by('-created_at', '-id').values('id', 'role', 'message', 'created_at')
+    rows = list(rows if limit is None else rows[:limit + 1])
+    if pending:
+        stored = {(row['created_at'], row['role']) for row in rows}
+        unflushed = [
+            {'id': 0, 'role': record['role'], 'message': record['message'], 'created_at': record['created_at']}
+            for record in pending if (record['created_at'], record['role']) not in stored
+        ]
+        rows = sorted(rows + unflushed, key=lambda row: (row['created_at'], row['id']), reverse=True)
+
+    oldest = (rows[-1]['created_at'], rows[-1]['id']) if rows else cursor
+    next_cursor = None
+    if limit is None:
+        rows += fetch_archived(user_id, subject_id, chapter_index, oldest, None)
+    elif len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    elif rows and not before:
+        # The newest page ends the hot table; the archive is only read once the client scrolls back
+        if has_archived(user_id, subject_id, chapter_index):
+            next_cursor = encode_cursor(*oldest)
+    else:
+        # Scrolled past the hot table: the rest of the page is older, so archived
+        rows += fetch_archived(user_id, subject_id, chapter_index, oldest, limit + 1 - len(rows))
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+    history = [
+        {
+            'id': row['id'] or None,
+            'role': row['role'],
+            'message': row['message'],
+            'created_at': row['created_at'].isoformat()
+        }
+        for row in reversed(rows)
+    ]
+    return history, next_cursor
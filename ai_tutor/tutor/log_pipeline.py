@@ -0,0 +1,181 @@
+# tutor/log_pipeline.py
+# Logging off the request path. Loggers hand records to QueueingHandler, which
+# only tags them with the request id, samples high-volume INFO lines and puts
+# them on an in-memory queue; a background thread formats them and does the
+# console and file I/O. Messages use %-style arguments, so lines that are
+# sampled out or below the level are never formatted at all.
+from asgiref.sync import iscoroutinefunction
+from contextvars import ContextVar
+from django.utils.decorators import sync_and_async_middleware
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import uuid
+import zlib
+
+# Id of the request being served; ORM and log calls made through sync_to_async see it too
+request_id = ContextVar('tutor_request_id', default='-')
+
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Arguments of these types are safe to format later on the writer thread
+_IMMUTABLE = (str, int, float, bool, type(None))
+
+@sync_and_async_middleware
+def request_id_middleware(get_response):
+    """Tag every request with an id, from X-Request-ID when the proxy sets one"""
+    def start(request):
+        incoming = request.headers.get('X-Request-ID', '')
+        value = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        request.request_id = value
+        return request_id.set(value)
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = start(request)
+            try:
+                response = await get_response(request)
+                response['X-Request-ID'] = request.request_id
+                return response
+            finally:
+                request_id.reset(token)
+    else:
+        def middleware(request):
+            token = start(request)
+            try:
+                response = get_response(request)
+                response['X-Request-ID'] = request.request_id
+                return response
+            finally:
+                request_id.reset(token)
+    return middleware
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the request id of the line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            # Set by QueueingHandler; logged synchronously, this is still the request's thread
+            'request_id': getattr(record, 'request_id', None) or request_id.get(),
+            'process': record.process,
+            'thread': record.threadName,
+            'location': f'{record.module}:{record.lineno}',
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """Queues records for the handlers of the writer logger, which a background thread writes to
+
+    writer names a logger of the same LOGGING config whose handlers are the
+    targets; they are looked up when the first record arrives, by which time
+    the whole config is in place.
+    sample_rates keeps that share of INFO-and-below lines per logger name
+    prefix, chosen per request so a sampled request keeps all of its lines.
+    When the queue is full, INFO-and-below lines are dropped and counted
+    rather than blocking the request.
+    """
+
+    def __init__(self, writer, queue_size=10000, sample_rates=None):
+        super().__init__(queue.Queue(queue_size))
+        self.writer = writer
+        self.sample_rates = sorted((sample_rates or {}).items(), key=lambda item: -len(item[0]))
+        self.dropped = 0
+        self._reported = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked: the parent's writer thread didn't come along, nor should its queued lines
+                self.queue = queue.Queue(self.queue.maxsize)
+            targets = logging.getLogger(self.writer).handlers
+            self._listener = logging.handlers.QueueListener(self.queue, *targets, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def _sampled_out(self, record):
+        if record.levelno > logging.INFO:
+            return False
+        for prefix, rate in self.sample_rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                if rate >= 1:
+                    return False
+                current = request_id.get()
+                if current == '-':
+                    return random.random() >= rate
+                return zlib.crc32(current.encode()) % 10000 >= rate * 10000
+        return False
+
+    def emit(self, record):
+        if self._sampled_out(record):
+            return
+        try:
+            self._ensure_listener()
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        """Keep the message unformatted unless its arguments could change before the writer gets to it"""
+        record.request_id = request_id.get()
+        if record.args and not all(isinstance(arg, _IMMUTABLE) for arg in (
+                record.args.values() if isinstance(record.args, dict) else record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # Tracebacks hold live frames; render them while they're still accurate
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped != self._reported:
+            summary = logging.LogRecord(
+                'tutor.log_pipeline', logging.WARNING, __file__, 0,
+                'Dropped %d log lines: logging queue full', (self.dropped - self._reported,), None,
+            )
+            summary.request_id = '-'
+            try:
+                self.queue.put_nowait(summary)
+                self._reported = self.dropped
+            except queue.Full:
+                pass
+        if record.levelno > logging.INFO:
+            # Warnings and errors wait briefly for room rather than vanish
+            self.queue.put(record, timeout=1)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Wait until the writer thread has handled everything queued so far"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def close(self):
+        self.flush()
+        super().close()
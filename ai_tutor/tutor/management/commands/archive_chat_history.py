@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from tutor.archive import archive_old_messages
+from tutor.models import ArchivedChatSegment, ChatMessage
+
+
+class Command(BaseCommand):
+    help = ('Move chat messages older than TUTOR_ARCHIVE_AFTER_DAYS from ChatMessage into '
+            'compressed ArchivedChatSegment rows. History pages read them transparently. '
+            'Safe to run alongside the app and to interrupt.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float, default=settings.TUTOR_ARCHIVE_AFTER_DAYS,
+                            help='Archive messages older than this many days')
+        parser.add_argument('--segment-size', type=int, default=settings.TUTOR_ARCHIVE_SEGMENT_SIZE,
+                            help='Most messages per compressed segment')
+        parser.add_argument('--max-users', type=int, help="Stop after archiving this many students' messages")
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, archiving again every this many seconds')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] <= 0 or options['segment_size'] < 1:
+            raise CommandError('--older-than-days and --segment-size must be positive')
+        while True:
+            self.archive(options)
+            if not options['interval']:
+                return
+            # Don't hold a connection the database may drop while we sleep
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def archive(self, options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        if options['dry_run']:
+            old = ChatMessage.objects.filter(created_at__lt=cutoff)
+            self.stdout.write(
+                f'{old.count()} messages in '
+                f'{old.values("user_id", "subject_id", "chapter_index").distinct().count()} conversations '
+                f'are older than {cutoff:%Y-%m-%d %H:%M}'
+            )
+            return
+
+        started = time.perf_counter()
+        users = conversations = messages = 0
+        for scanned_users, scanned_conversations, moved in archive_old_messages(
+                cutoff, options['segment_size'], max_users=options['max_users']):
+            users += scanned_users
+            conversations += scanned_conversations
+            messages += moved
+            self.stdout.write(f'  {messages} messages of {conversations} conversations of {users} students archived')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {messages} messages older than {cutoff:%Y-%m-%d %H:%M} from {conversations} conversations '
+            f'in {elapsed:.1f}s; {ChatMessage.objects.count()} hot messages, '
+            f'{ArchivedChatSegment.objects.count()} archived segments'
+        ))
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from tutor.history import fetch_history_page
+from tutor.models import ChatMessage, Subject
+
+BENCH_USER_PREFIX = 'bench_contention_'
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = ('Run concurrent chat writers and history readers against the configured '
+            'database (TUTOR_DB_PROFILE) and report throughput, latency and lock errors. '
+            'Run once per profile to compare them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Threads saving chat messages')
+        parser.add_argument('--readers', type=int, default=8, help='Threads fetching history pages')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+        parser.add_argument('--users', type=int, default=20, help='Synthetic users the traffic is spread over')
+        parser.add_argument('--limit', type=int, default=50, help='History page size')
+        parser.add_argument('--keep', action='store_true', help='Keep the written rows')
+
+    def handle(self, *args, **options):
+        db = settings.DATABASES['default']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Profile {settings.TUTOR_DB_PROFILE}: {db['ENGINE']} {db['NAME']}"
+        ))
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                    cursor.execute(f'PRAGMA {pragma}')
+                    self.stdout.write(f'  {pragma} = {cursor.fetchone()[0]}')
+
+        subject, _ = Subject.objects.get_or_create(name='Benchmark')
+        users = [
+            User.objects.get_or_create(username=f'{BENCH_USER_PREFIX}{i}')[0]
+            for i in range(options['users'])
+        ]
+        connection.close()
+
+        results = {'write': [], 'read': []}
+        errors = {'write': [], 'read': []}
+        deadline = time.monotonic() + options['duration']
+        threads = [
+            threading.Thread(target=self.worker, args=('write', n, users, subject, deadline, options, results, errors))
+            for n in range(options['writers'])
+        ] + [
+            threading.Thread(target=self.worker, args=('read', n, users, subject, deadline, options, results, errors))
+            for n in range(options['readers'])
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        for kind in ('write', 'read'):
+            samples = results[kind]
+            self.stdout.write(
+                f'{kind}s: {len(samples) / elapsed:.0f}/s, '
+                f'p50 {percentile(samples, 0.5):.2f} ms, p99 {percentile(samples, 0.99):.2f} ms, '
+                f'{len(errors[kind])} errors'
+            )
+            if errors[kind]:
+                self.stdout.write(self.style.WARNING(f'  first error: {errors[kind][0]}'))
+
+        if not options['keep']:
+            ChatMessage.objects.filter(user__in=users).delete()
+            User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+            self.stdout.write('Removed benchmark rows')
+
+    def worker(self, kind, n, users, subject, deadline, options, results, errors):
+        samples, failures = [], []
+        i = 0
+        try:
+            while time.monotonic() < deadline:
+                user = users[(n + i) % len(users)]
+                chapter = i % 5 + 1
+                i += 1
+                started = time.perf_counter()
+                try:
+                    if kind == 'write':
+                        # Same shape as save_chat_message: one autocommitted insert per turn
+                        ChatMessage.objects.create(
+                            user=user,
+                            subject=subject,
+                            chapter_index=chapter,
+                            role='user' if i % 2 else 'ai',
+                            message=f'Contention benchmark message {n}-{i}'
+                        )
+                    else:
+                        fetch_history_page(user.id, subject.id, chapter, limit=options['limit'])
+                except OperationalError as e:
+                    failures.append(str(e))
+                    continue
+                samples.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+        results[kind].extend(samples)
+        errors[kind].extend(failures)
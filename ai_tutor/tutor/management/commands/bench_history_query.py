@@ -0,0 +1,121 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from tutor.history import encode_cursor, fetch_history_page
+from tutor.models import ChatMessage, Subject
+
+BENCH_USER_PREFIX = 'bench_history_'
+INDEX_NAME = 'chatmessage_conversation_idx'
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = ('Seed ChatMessage rows and compare the history query plan and latency '
+            'with and without the conversation index. Run against a scratch database: '
+            'the index is dropped and re-created while it runs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Total ChatMessage rows to seed')
+        parser.add_argument('--users', type=int, default=100, help='Synthetic users the rows are spread over')
+        parser.add_argument('--chapters', type=int, default=10, help='Chapters per user the rows are spread over')
+        parser.add_argument('--samples', type=int, default=200, help='Timed queries per scenario')
+        parser.add_argument('--limit', type=int, default=50, help='History page size')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows for later runs')
+
+    def handle(self, *args, **options):
+        subject, _ = Subject.objects.get_or_create(name='Benchmark')
+        users = self.seed(subject, options)
+        target = users[0]
+
+        # A cursor halfway through the target conversation exercises scroll-back
+        middle = (
+            ChatMessage.objects.filter(user=target, subject=subject, chapter_index=1)
+            .order_by('-created_at', '-id').values('id', 'created_at')
+        )
+        middle = middle[middle.count() // 2] if middle.exists() else None
+        cursor = encode_cursor(middle['created_at'], middle['id']) if middle else None
+
+        index = next(i for i in ChatMessage._meta.indexes if i.name == INDEX_NAME)
+        try:
+            with connection.schema_editor() as editor:
+                editor.remove_index(ChatMessage, index)
+            before = self.measure('without index', target, subject, cursor, options)
+        finally:
+            with connection.schema_editor() as editor:
+                editor.add_index(ChatMessage, index)
+        after = self.measure('with index', target, subject, cursor, options)
+
+        for scenario in ('first_page', 'scroll_back'):
+            speedup = before[scenario]['p50'] / after[scenario]['p50'] if after[scenario]['p50'] else 0
+            self.stdout.write(self.style.SUCCESS(f'{scenario}: p50 speedup {speedup:.1f}x'))
+
+        if not options['keep']:
+            ChatMessage.objects.filter(user__in=users).delete()
+            User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+            self.stdout.write('Removed seeded rows')
+
+    def seed(self, subject, options):
+        users = []
+        for i in range(options['users']):
+            user, _ = User.objects.get_or_create(username=f'{BENCH_USER_PREFIX}{i}')
+            users.append(user)
+
+        existing = ChatMessage.objects.filter(user__in=users).count()
+        missing = options['rows'] - existing
+        if missing <= 0:
+            self.stdout.write(f'Reusing {existing} seeded rows')
+            return users
+
+        started = time.perf_counter()
+        conversations = [(user, chapter) for chapter in range(1, options['chapters'] + 1) for user in users]
+        batch = []
+        for n in range(missing):
+            user, chapter = conversations[n % len(conversations)]
+            batch.append(ChatMessage(
+                user=user,
+                subject=subject,
+                chapter_index=chapter,
+                role='user' if n % 2 == 0 else 'ai',
+                message=f'Benchmark message {existing + n}'
+            ))
+            if len(batch) >= options['batch_size']:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create(batch)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Seeded {missing} rows in {elapsed:.1f}s ({missing / elapsed:.0f} rows/s)')
+        return users
+
+    def measure(self, label, user, subject, cursor, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'History query {label}'))
+        plan = (
+            ChatMessage.objects.filter(user_id=user.id, subject_id=subject.id, chapter_index=1)
+            .order_by('-created_at', '-id').values('id', 'role', 'message', 'created_at')[:options['limit'] + 1]
+            .explain()
+        )
+        self.stdout.write(plan)
+
+        results = {}
+        for scenario, before in (('first_page', None), ('scroll_back', cursor)):
+            samples = []
+            for _ in range(options['samples']):
+                started = time.perf_counter()
+                fetch_history_page(user.id, subject.id, 1, limit=options['limit'], before=before)
+                samples.append((time.perf_counter() - started) * 1000)
+            results[scenario] = {'p50': percentile(samples, 0.5), 'p99': percentile(samples, 0.99)}
+            self.stdout.write(
+                f"  {scenario}: p50 {results[scenario]['p50']:.3f} ms, p99 {results[scenario]['p99']:.3f} ms"
+            )
+        return results
@@ -1,4 +1,6 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from tutor.catalogue import chapter_catalogue
 from tutor.models import Subject, Chapter
 
 
@@ -18,12 +20,14 @@ class Command(BaseCommand):
             'Computer Science'
         ]
 
-        subjects = {}
-        for subject_name in subjects_data:
-            subject, created = Subject.objects.get_or_create(name=subject_name)
-            subjects[subject_name] = subject
-            if created:
-                self.stdout.write(f'Created subject: {subject_name}')
+        # One query for what exists and one insert for the rest, not a round trip per row
+        existing = set(Subject.objects.filter(name__in=subjects_data).values_list('name', flat=True))
+        missing = [Subject(name=name) for name in subjects_data if name not in existing]
+        Subject.objects.bulk_create(missing)
+        for subject in missing:
+            self.stdout.write(f'Created subject: {subject.name}')
+        subjects_created = bool(missing)
+        subjects = {subject.name: subject for subject in Subject.objects.filter(name__in=subjects_data)}
 
         # Create chapters for each subject and standard
         chapters_data = {
@@ -176,20 +180,15 @@ class Command(BaseCommand):
             }
         }
 
+        # (subject, title, standard, order) of every chapter to have
+        wanted = []
+
         # Create chapters for main subjects
         for subject_name, standards in chapters_data.items():
             if subject_name in subjects:
-                subject = subjects[subject_name]
                 for standard, chapter_titles in standards.items():
                     for i, chapter_title in enumerate(chapter_titles, 1):
-                        chapter, created = Chapter.objects.get_or_create(
-                            subject=subject,
-                            title=chapter_title,
-                            standard=standard,
-                            defaults={'order': i}
-                        )
-                        if created:
-                            self.stdout.write(f'Created chapter: {chapter_title} for {subject_name} - {standard}')
+                        wanted.append((subject_name, chapter_title, standard, i))
 
         # Create basic chapters for other subjects
         other_subjects = ['Hindi', 'Gujarati', 'Social Science', 'Sanskrit', 'Computer Science']
@@ -203,16 +202,26 @@ class Command(BaseCommand):
 
         for subject_name in other_subjects:
             if subject_name in subjects:
-                subject = subjects[subject_name]
                 for standard in ['8th', '9th', '10th']:
                     for i, chapter_title in enumerate(basic_chapters[subject_name], 1):
-                        chapter, created = Chapter.objects.get_or_create(
-                            subject=subject,
-                            title=f'{chapter_title} - Class {standard}',
-                            standard=standard,
-                            defaults={'order': i}
-                        )
-                        if created:
-                            self.stdout.write(f'Created chapter: {chapter_title} for {subject_name} - {standard}')
+                        wanted.append((subject_name, f'{chapter_title} - Class {standard}', standard, i))
+
+        existing = set(
+            Chapter.objects.filter(subject__in=subjects.values())
+            .values_list('subject__name', 'title', 'standard')
+        )
+        missing = [
+            Chapter(subject=subjects[subject_name], title=title, standard=standard, order=order)
+            for subject_name, title, standard, order in wanted
+            if (subject_name, title, standard) not in existing
+        ]
+        with transaction.atomic():
+            Chapter.objects.bulk_create(missing, batch_size=500)
+        for chapter in missing:
+            self.stdout.write(f'Created chapter: {chapter.title} for {chapter.subject.name} - {chapter.standard}')
+
+        if missing or subjects_created:
+            # bulk_create sends no post_save, so tell the catalogue here
+            chapter_catalogue.invalidate()
 
         self.stdout.write(self.style.SUCCESS('Successfully populated dummy data'))
\ No newline at end of file
@@ -0,0 +1,261 @@
+import io
+import multiprocessing
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from accounts.models import StudentProfile
+from tutor.catalogue import normalise_standard
+from tutor.models import Chapter, ChatMessage
+
+SEED_USER_PREFIX = 'seed_student_'
+STANDARDS = ['8th', '9th', '10th']
+# Rows per INSERT statement; SQLite lowers this to fit its variable limit
+STATEMENT_ROWS = 1000
+
+QUESTIONS = [
+    'What is {topic}?',
+    'Can you explain {topic} in simple words?',
+    'Why is {topic} important?',
+    'Give me an example of {topic}.',
+    'How is {topic} different from what we studied earlier?',
+    'I did not understand {topic}. Can you explain it again?',
+    'What are the key points of {topic} for the exam?',
+    'Can you give me a practice question on {topic}?',
+    'How do I remember {topic}?',
+    'Where is {topic} used in real life?',
+]
+FOLLOW_UPS = [
+    'Can you explain that step again?',
+    'Why does that work?',
+    'Can you give one more example?',
+    'So is my answer {answer} correct?',
+    'What happens if we change the numbers?',
+    'Thanks! What should I study next?',
+    'Can you make it shorter?',
+    'I still do not get the last part.',
+]
+SENTENCES = [
+    '{Topic} is one of the central ideas of this chapter.',
+    'Start by recalling the definition of {topic}.',
+    'A simple way to see this is with an everyday example.',
+    'Notice how each step follows from the one before it.',
+    'In the exam, write the definition first and then give an example.',
+    'Many students mix this up, so read the question carefully.',
+    'Try the practice question at the end of the chapter to check your understanding.',
+    'The key point is that the same rule applies in every case.',
+    'You can draw a small diagram to remember this.',
+    'Let us work through it together, one step at a time.',
+    'Good question! This connects to what you learnt in the previous chapter.',
+    'Remember to include units in your final answer.',
+]
+
+class Loader:
+    """Generates and inserts the students numbered [first, first + chunk) and their data"""
+
+    def __init__(self, options, chapters, password):
+        self.options = options
+        self.chapters = chapters
+        self.password = password
+        self.batch_size = options['batch_size']
+
+    def load_chunk(self, first):
+        """Returns ({table: rows}, {table: seconds}) of the chunk starting at first"""
+        self.rows = {'users': 0, 'profiles': 0, 'messages': 0}
+        self.seconds = {'users': 0.0, 'profiles': 0.0, 'messages': 0.0}
+        numbers = range(first, min(first + self.options['users_per_chunk'], self.options['users']))
+        rng = random.Random(self.options['seed'] * 1000003 + first)
+        user_ids = self.load_users(numbers)
+        self.load_profiles(numbers, user_ids, rng)
+        self.load_messages(numbers, user_ids, rng)
+        return self.rows, self.seconds
+
+    def insert(self, table, model, objects):
+        """bulk_create objects, none of which exist yet, in transactions of --batch-size rows"""
+        started = time.perf_counter()
+        for i in range(0, len(objects), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(objects[i:i + self.batch_size], batch_size=STATEMENT_ROWS)
+        self.rows[table] += len(objects)
+        self.seconds[table] += time.perf_counter() - started
+
+    def load_users(self, numbers):
+        """Insert the missing students of numbers; returns {number: user id}"""
+        names = [f"{self.options['prefix']}{n:08d}" for n in numbers]
+        # Zero-padded names make the chunk one range scan of the username index
+        chunk = User.objects.filter(username__gte=names[0], username__lte=names[-1])
+        existing = set(chunk.values_list('username', flat=True))
+        joined = timezone.now()
+        self.insert('users', User, [
+            User(username=name, email=f'{name}@example.com', password=self.password, date_joined=joined)
+            for name in names if name not in existing
+        ])
+        ids = dict(chunk.values_list('username', 'id'))
+        return {n: ids[name] for n, name in zip(numbers, names, strict=True)}
+
+    def load_profiles(self, numbers, user_ids, rng):
+        """Profiles for the students of numbers that have none yet"""
+        ids = list(user_ids.values())
+        profiled = set(
+            StudentProfile.objects.filter(user_id__gte=min(ids), user_id__lte=max(ids))
+            .values_list('user_id', flat=True)
+        )
+        self.insert('profiles', StudentProfile, [
+            StudentProfile(
+                user_id=user_ids[n],
+                standard=STANDARDS[n % len(STANDARDS)],
+                standard_selected=True,
+                language=rng.choices(['en', 'hi', 'gu'], weights=[6, 3, 1])[0],
+            )
+            for n in numbers if user_ids[n] not in profiled
+        ])
+
+    def load_messages(self, numbers, user_ids, rng):
+        """Conversations for the students of numbers that have no messages yet"""
+        ids = list(user_ids.values())
+        chatted = set(
+            ChatMessage.objects.filter(user_id__gte=min(ids), user_id__lte=max(ids))
+            .values_list('user_id', flat=True).distinct()
+        )
+        now = timezone.now()
+        conversations, turns, days = self.options['conversations'], self.options['turns'], self.options['days']
+        messages = []
+        for n in numbers:
+            user_id = user_ids[n]
+            if user_id in chatted:
+                continue
+            available = self.chapters[STANDARDS[n % len(STANDARDS)]]
+            count = min(len(available), rng.randint(1, round(2 * conversations) - 1))
+            for subject_id, order, title in rng.sample(available, count):
+                sent = now - timedelta(seconds=rng.uniform(0, days * 86400))
+                messages.extend(conversation(rng, user_id, subject_id, order, title, sent, turns, now))
+        self.insert('messages', ChatMessage, messages)
+
+# The worker processes' loader, inherited from the parent when the pool forks
+_loader = None
+
+def _load_chunk(first):
+    return _loader.load_chunk(first)
+
+class Command(BaseCommand):
+    help = ('Bulk-load synthetic students, profiles and multi-turn chat conversations '
+            'for benchmarking history, admin and analytics queries, and report rows/s. '
+            'Re-running with the same options only adds what is missing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic students to have')
+        parser.add_argument('--conversations', type=float, default=4, help='Mean conversations (chapters chatted about) per student')
+        parser.add_argument('--turns', type=float, default=6, help='Mean questions per conversation; each adds a question and an answer')
+        parser.add_argument('--days', type=int, default=180, help='Spread conversations over this many past days')
+        parser.add_argument('--batch-size', type=int, default=20000, help='Rows per transaction')
+        parser.add_argument('--users-per-chunk', type=int, default=2000, help='Students generated and loaded at a time')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes loading chunks in parallel (PostgreSQL only)')
+        parser.add_argument('--prefix', default=SEED_USER_PREFIX, help='Username prefix of the synthetic students')
+        parser.add_argument('--password', default='seed-password', help='Password of every synthetic student')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clear', action='store_true', help='Delete the students with --prefix and their data first')
+
+    def handle(self, *args, **options):
+        global _loader
+        if options['users'] < 0 or options['conversations'] < 1 or options['turns'] < 1:
+            raise CommandError('--users must be >= 0, --conversations and --turns >= 1')
+
+        if options['workers'] > 1 and connection.vendor == 'sqlite':
+            # bulk_create builds each statement inside the transaction, so SQLite's
+            # single write lock would serialise the workers and time them out
+            self.stdout.write(self.style.WARNING('SQLite has a single writer; ignoring --workers'))
+            options['workers'] = 1
+
+        if options['clear']:
+            self.clear(options['prefix'])
+
+        # Conversations need subjects and chapters to refer to
+        call_command('populate_dummy_data', stdout=io.StringIO())
+        _loader = Loader(options, self.load_chapters(), make_password(options['password']))
+
+        rows = {'users': 0, 'profiles': 0, 'messages': 0}
+        seconds = {'users': 0.0, 'profiles': 0.0, 'messages': 0.0}
+        firsts = range(0, options['users'], options['users_per_chunk'])
+        started = time.perf_counter()
+        if options['workers'] > 1:
+            # Forked children must not share the parent's database connection
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(options['workers'])
+            results = pool.imap_unordered(_load_chunk, firsts)
+        else:
+            pool = None
+            results = map(_load_chunk, firsts)
+        try:
+            for done, (chunk_rows, chunk_seconds) in enumerate(results, 1):
+                for table in rows:
+                    rows[table] += chunk_rows[table]
+                    seconds[table] += chunk_seconds[table]
+                total = sum(rows.values())
+                self.stdout.write(
+                    f'{done}/{len(firsts)} chunks, {total} rows, '
+                    f'{total / (time.perf_counter() - started):.0f} rows/s'
+                )
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        elapsed = time.perf_counter() - started
+        for table, count in rows.items():
+            # Summed over workers, so this is the rate of one of them
+            self.stdout.write(f'{table}: {count} rows in {seconds[table]:.1f}s ({count / seconds[table] if seconds[table] else 0:.0f} rows/s)')
+        total = sum(rows.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+
+    def clear(self, prefix):
+        users = User.objects.filter(username__startswith=prefix)
+        # Children first, each as one DELETE, so the user delete has nothing left to collect
+        messages = ChatMessage.objects.filter(user__in=users).delete()[0]
+        StudentProfile.objects.filter(user__in=users).delete()
+        deleted = users.delete()[0]
+        self.stdout.write(f'Removed {deleted} rows of students with prefix {prefix!r}, including {messages} chat messages')
+
+    def load_chapters(self):
+        """{standard: [(subject_id, chapter order, title), ...]}"""
+        chapters = {standard: [] for standard in STANDARDS}
+        for subject_id, standard, order, title in Chapter.objects.values_list('subject_id', 'standard', 'order', 'title'):
+            chapters.setdefault(normalise_standard(standard), []).append((subject_id, order, title))
+        if not all(chapters[standard] for standard in STANDARDS):
+            raise CommandError('Every standard needs chapters; run populate_dummy_data')
+        return chapters
+
+def conversation(rng, user_id, subject_id, order, title, sent, mean_turns, now):
+    """Alternating question and answer messages about one chapter, starting at sent"""
+    topic = title.split(' - Class ')[0].lower()
+    messages = []
+    for turn in range(rng.randint(1, round(2 * mean_turns) - 1)):
+        if turn == 0:
+            question = rng.choice(QUESTIONS).format(topic=topic)
+        else:
+            question = rng.choice(FOLLOW_UPS).format(answer=rng.randint(2, 99))
+        answer = ' '.join(
+            sentence.format(topic=topic, Topic=topic.capitalize())
+            for sentence in rng.sample(SENTENCES, rng.randint(2, 6))
+        )
+        answered = sent + timedelta(seconds=rng.uniform(2, 15))
+        if answered > now:
+            break
+        messages.append(ChatMessage(
+            user_id=user_id, subject_id=subject_id, chapter_index=order,
+            role='user', message=question, created_at=sent,
+        ))
+        messages.append(ChatMessage(
+            user_id=user_id, subject_id=subject_id, chapter_index=order,
+            role='ai', message=answer, created_at=answered,
+        ))
+        sent = answered + timedelta(seconds=rng.uniform(20, 600))
+    return messages
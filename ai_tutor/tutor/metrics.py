@@ -0,0 +1,347 @@
+# tutor/metrics.py
+# In-process counters and latency histograms for the chat pipeline, served in
+# Prometheus text format on /metrics. With TUTOR_METRICS_DIR set, each worker
+# process writes its totals there every few seconds and /metrics sums every
+# worker's file, so scraping any one worker reports the whole deployment.
+# Totals are cumulative since the directory was last cleared.
+from asgiref.sync import iscoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key, strict=True)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped, strict=True)) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            self.registry.check_fork()
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    def render(self, samples):
+        for key, value in sorted(samples.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            self.registry.check_fork()
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        return [[list(key), list(counts), total] for key, (counts, total) in self.values.items()]
+
+    def render(self, samples):
+        for key, (counts, total) in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts, strict=True):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", str(bound))])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {round(total, 6)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}'
+
+class Registry:
+    """Metrics of this process, plus the shared directory other workers flush to"""
+
+    def __init__(self, directory='', flush_interval=5.0, enabled=True):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self._pid = os.getpid()
+        self._file = None
+        self._flusher = None
+
+    def counter(self, name, help_text, labelnames=()):
+        self.metrics[name] = Counter(self, name, help_text, labelnames)
+        return self.metrics[name]
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.metrics[name] = Histogram(self, name, help_text, labelnames, buckets)
+        return self.metrics[name]
+
+    def check_fork(self):
+        """Called with the lock held before every update"""
+        if self._pid != os.getpid():
+            # A forked worker must not report its parent's totals a second time
+            for metric in self.metrics.values():
+                metric.values = {}
+            self._pid = os.getpid()
+            self._file = None
+            self._flusher = None
+        if self.directory and self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def flush(self):
+        """Write this process's totals to its file in the shared directory"""
+        if not self.directory:
+            return
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            # Unique per process lifetime, so a recycled pid can't overwrite a dead worker's totals
+            self._file = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        temporary = self._file + '.tmp'
+        with open(temporary, 'w') as out:
+            json.dump(self.snapshot(), out)
+        os.replace(temporary, self._file)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Failed to flush metrics: %s", e)
+
+    def _snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as snapshot:
+                    snapshots.append(json.load(snapshot))
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping unreadable metrics file %s: %s", name, e)
+        return snapshots
+
+    def render(self):
+        """Prometheus text exposition of all workers' metrics"""
+        merged = {name: {} for name in self.metrics}
+        for snapshot in self._snapshots():
+            for name, samples in snapshot.items():
+                if name not in merged:
+                    continue
+                for sample in samples:
+                    key = tuple(sample[0])
+                    if len(sample) == 2:
+                        merged[name][key] = merged[name].get(key, 0) + sample[1]
+                    else:
+                        counts, total = merged[name].get(key) or ([0] * len(sample[1]), 0.0)
+                        merged[name][key] = ([a + b for a, b in zip(counts, sample[1], strict=True)], total + sample[2])
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.render(merged[name]))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry(
+    directory=settings.TUTOR_METRICS_DIR,
+    flush_interval=settings.TUTOR_METRICS_FLUSH_INTERVAL,
+    enabled=settings.TUTOR_METRICS_ENABLED,
+)
+
+request_seconds = registry.histogram(
+    'tutor_request_seconds', 'Time to produce a response, by view and status', ('view', 'status'))
+stage_seconds = registry.histogram(
+    'tutor_stage_seconds', 'Time spent in each stage of a view', ('view', 'stage'))
+db_queries = registry.histogram(
+    'tutor_db_queries', 'Database queries per request', ('view',), buckets=QUERY_BUCKETS)
+db_seconds = registry.histogram(
+    'tutor_db_seconds', 'Database time per request', ('view',))
+chat_answers = registry.counter(
+    'tutor_chat_answers_total', 'Chat answers by source (rag_model, gemini_fallback, gemini_hedge, cache, error)', ('source',))
+chat_seconds = registry.histogram(
+    'tutor_chat_seconds', 'Time to answer a chat request, by answer source', ('source',))
+answer_cache_lookups = registry.counter(
+    'tutor_answer_cache_lookups_total', 'Answer cache lookups by result', ('result',))
+upstream_seconds = registry.histogram(
+    'tutor_upstream_seconds', 'Latency of RAG and Gemini calls by outcome', ('upstream', 'outcome'))
+upstream_errors = registry.counter(
+    'tutor_upstream_errors_total', 'Failed RAG and Gemini calls by reason (timeout, unavailable, ...)', ('upstream', 'reason'))
+
+def failure_reason(error):
+    """Coarse class of an upstream exception for upstream_errors"""
+    text = str(error).lower()
+    if isinstance(error, TimeoutError) or 'timeout' in text or 'timed out' in text or 'deadline' in text:
+        return 'timeout'
+    return 'error'
+
+@contextmanager
+def timed(view, stage):
+    """Record the duration of the block as one stage of view"""
+    with stage_seconds.time(view=view, stage=stage):
+        yield
+
+# Query counter of the request being served; visible to ORM calls made through sync_to_async too
+_queries = ContextVar('tutor_metrics_queries', default=None)
+
+def _count_query(execute, sql, params, many, context):
+    counter = _queries.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter[0] += 1
+        counter[1] += time.perf_counter() - started
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+connection_created.connect(_install_query_counter)
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match and match.url_name else 'unresolved'
+
+def _record_request(request, status, started, counter):
+    view = _view_name(request)
+    request_seconds.observe(time.perf_counter() - started, view=view, status=status)
+    db_queries.observe(counter[0], view=view)
+    db_seconds.observe(counter[1], view=view)
+
+def _streamed(content, record, counter):
+    """Yield from content, counting its queries, and record the request once it ends"""
+    iterator = iter(content)
+    try:
+        while True:
+            # Each step, since the server resumes the stream outside the middleware's context
+            token = _queries.set(counter)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _queries.reset(token)
+            yield chunk
+    finally:
+        record()
+
+async def _astreamed(content, record, counter):
+    iterator = aiter(content)
+    try:
+        while True:
+            token = _queries.set(counter)
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            finally:
+                _queries.reset(token)
+            yield chunk
+    finally:
+        record()
+
+def _record_when_done(request, response, started, counter):
+    """Record the request now, or for a streaming response once its body is sent; returns response"""
+    def record():
+        _record_request(request, str(response.status_code), started, counter)
+
+    if not response.streaming:
+        record()
+    elif response.is_async:
+        response.streaming_content = _astreamed(response.streaming_content, record, counter)
+    else:
+        response.streaming_content = _streamed(response.streaming_content, record, counter)
+    return response
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Latency, status and database queries of every request, per view
+
+    Streaming responses are timed until their last chunk, not their headers.
+    """
+    if not registry.enabled:
+        raise MiddlewareNotUsed()
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started, counter = time.perf_counter(), [0, 0.0]
+            token = _queries.set(counter)
+            try:
+                response = await get_response(request)
+            except BaseException:
+                _record_request(request, '500', started, counter)
+                raise
+            finally:
+                _queries.reset(token)
+            return _record_when_done(request, response, started, counter)
+    else:
+        def middleware(request):
+            started, counter = time.perf_counter(), [0, 0.0]
+            token = _queries.set(counter)
+            try:
+                response = get_response(request)
+            except BaseException:
+                _record_request(request, '500', started, counter)
+                raise
+            finally:
+                _queries.reset(token)
+            return _record_when_done(request, response, started, counter)
+    return middleware
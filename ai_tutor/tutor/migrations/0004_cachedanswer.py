@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutor', '0003_remove_chatmessage_chapter_chatmessage_chapter_index_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chapter_key', models.CharField(max_length=50)),
+                ('question_hash', models.CharField(max_length=64)),
+                ('question', models.TextField()),
+                ('response', models.TextField()),
+                ('source', models.CharField(max_length=20)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='tutor_cache_created_429785_idx')],
+                'unique_together': {('chapter_key', 'question_hash')},
+            },
+        ),
+    ]
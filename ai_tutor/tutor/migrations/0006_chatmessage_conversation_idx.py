@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutor', '0005_inflightquestion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['user', 'subject', 'chapter_index', 'created_at', 'id'], name='chatmessage_conversation_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutor', '0008_conversationsummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedChatSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chapter_index', models.IntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('first_message_id', models.BigIntegerField()),
+                ('last_created_at', models.DateTimeField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('message_count', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('subject', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_chat_segments', to='tutor.subject')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_chat_segments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'subject', 'chapter_index', 'last_created_at', 'last_message_id'], name='chatarchive_conversation_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Chat history used to number 10th-standard chapters of every "science"
+# subject by a hard-coded list of 13 titles; chapters now come from the Chapter
+# table, whose 10th Science list has 15 (Periodic Classification of Elements
+# sits at 5). Renumber the stored chapter indexes of 10th-standard students from
+# the old list to the order of the same chapter in the table. Indexes whose
+# title has no counterpart, and other standards' rows, are left alone.
+import re
+
+from django.db import migrations
+from django.db.models import F, Max
+
+# The list applied to students of this standard, however it was written
+TENTH = ('10', '10th')
+OLD_10TH_SCIENCE = [
+    'Chemical Reactions and Equations',
+    'Acids, Bases and Salts',
+    'Metals and Non-metals',
+    'Carbon and its Compounds',
+    'Life Processes',
+    'Control and Coordination',
+    'How do Organisms Reproduce?',
+    'Heredity',
+    'Light – Reflection and Refraction',
+    'The Human Eye and the Colourful World',
+    'Electricity',
+    'Magnetic Effects of Electric Current',
+    'Our Environment',
+]
+# Old titles that the table spells differently beyond punctuation and articles
+ALIASES = {'heredity': 'heredity and evolution'}
+
+
+def title_key(title):
+    words = re.sub(r'[^\w\s]', ' ', title.lower()).split()
+    key = ' '.join(word for word in words if word not in ('the', 'a', 'an'))
+    return ALIASES.get(key, key)
+
+
+def renumberings(apps):
+    """{subject_id: {old index: new index}} for the subjects the old list applied to"""
+    Subject = apps.get_model('tutor', 'Subject')
+    Chapter = apps.get_model('tutor', 'Chapter')
+    result = {}
+    for subject_id, name in Subject.objects.values_list('id', 'name'):
+        if 'science' not in name.replace(' ', '').lower():
+            continue
+        orders = {
+            title_key(title): order
+            for title, standard, order in Chapter.objects.filter(subject_id=subject_id)
+            .values_list('title', 'standard', 'order')
+            if str(standard).strip().lower() in TENTH
+        }
+        mapping = {
+            index: orders[title_key(title)]
+            for index, title in enumerate(OLD_10TH_SCIENCE, 1)
+            if title_key(title) in orders and orders[title_key(title)] != index
+        }
+        if mapping:
+            result[subject_id] = mapping
+    return result
+
+
+def renumber(apps, reverse):
+    models = [apps.get_model('tutor', name) for name in ('ChatMessage', 'ArchivedChatSegment', 'ConversationSummary')]
+    CachedAnswer = apps.get_model('tutor', 'CachedAnswer')
+    StudentProfile = apps.get_model('accounts', 'StudentProfile')
+    # Messages don't record a standard; the list was shown to students of the 10th
+    tenth_graders = StudentProfile.objects.filter(standard__in=TENTH).values('user_id')
+    for subject_id, mapping in renumberings(apps).items():
+        if reverse:
+            mapping = {new: old for old, new in mapping.items()}
+        for model in models:
+            rows = model.objects.filter(subject_id=subject_id, user_id__in=tenth_graders)
+            top = rows.aggregate(top=Max('chapter_index'))['top']
+            if top is None:
+                continue
+            # Through values above every stored and mapped index, so 5 -> 6
+            # doesn't collide with 6 -> 7, no row is moved twice and only the
+            # rows moved here come back down
+            offset = max(top, *mapping) + 1
+            for old, new in mapping.items():
+                rows.filter(chapter_index=old).update(chapter_index=new + offset)
+            rows.filter(chapter_index__gt=top).update(chapter_index=F('chapter_index') - offset)
+        # Cached answers are keyed by standard and chapter number; let them refill
+        for standard in TENTH:
+            CachedAnswer.objects.filter(chapter_key__startswith=f'{subject_id}:{standard}:').delete()
+
+
+def forwards(apps, schema_editor):
+    renumber(apps, reverse=False)
+
+
+def backwards(apps, schema_editor):
+    renumber(apps, reverse=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_studentprofile_language_and_more'),
+        ('tutor', '0009_archivedchatsegment'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
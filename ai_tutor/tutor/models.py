@@ -1,5 +1,6 @@
 # tutor/models.py
 from django.db import models
+from django.utils import timezone
 
 class Subject(models.Model):
     name = models.CharField(max_length=100)
@@ -32,10 +33,97 @@ class ChatMessage(models.Model):
     chapter_index = models.IntegerField(default=0)
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     message = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind batches keep the time the message was sent
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Matches the history access pattern: one conversation, keyset-ordered
+            models.Index(
+                fields=['user', 'subject', 'chapter_index', 'created_at', 'id'],
+                name='chatmessage_conversation_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.subject.name if self.subject else 'Unknown'} Ch{self.chapter_index} - {self.role}"
+
+class CachedAnswer(models.Model):
+    """Persistent tier of the answer cache, keyed by chapter and normalised question"""
+    chapter_key = models.CharField(max_length=50)
+    question_hash = models.CharField(max_length=64)
+    question = models.TextField()
+    response = models.TextField()
+    source = models.CharField(max_length=20)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('chapter_key', 'question_hash')]
+        indexes = [models.Index(fields=['created_at'])]
+
+    def __str__(self):
+        return f"{self.chapter_key} - {self.question[:50]}"
+
+
+class InflightQuestion(models.Model):
+    """Cross-process single-flight row: one upstream call per chapter + question"""
+    key = models.CharField(max_length=64, unique=True)
+    response = models.TextField(null=True, blank=True)
+    source = models.CharField(max_length=20, blank=True)
+    error = models.TextField(blank=True)
+    completed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} ({'done' if self.completed else 'in flight'})"
+
+
+class ConversationSummary(models.Model):
+    """Rolling summary of the turns of one conversation up to covered_until"""
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='conversation_summaries')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='conversation_summaries')
+    chapter_index = models.IntegerField()
+    summary = models.TextField()
+    covered_until = models.DateTimeField()
+    turns_covered = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('user', 'subject', 'chapter_index')]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.subject.name} Ch{self.chapter_index} ({self.turns_covered} turns)"
+
+
+class ArchivedChatSegment(models.Model):
+    """Cold tier of chat history: a compressed run of old messages of one conversation
+
+    Written by archive_chat_history and never updated; the messages keep
+    their ids and timestamps, so history cursors work across both tiers.
+    """
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='archived_chat_segments')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='archived_chat_segments', null=True)
+    chapter_index = models.IntegerField()
+    first_created_at = models.DateTimeField()
+    first_message_id = models.BigIntegerField()
+    last_created_at = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.IntegerField()
+    # zlib-compressed JSON list of [id, role, message, created_at], oldest first
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Newest-first walk of one conversation's segments, like the hot table's index
+            models.Index(
+                fields=['user', 'subject', 'chapter_index', 'last_created_at', 'last_message_id'],
+                name='chatarchive_conversation_idx',
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.subject.name if self.subject else 'Unknown'} Ch{self.chapter_index} - {self.role}"
\ No newline at end of file
+        return f"{self.user_id} - {self.subject_id} Ch{self.chapter_index} ({self.message_count} messages)"
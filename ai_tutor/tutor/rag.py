@@ -0,0 +1,319 @@
+# tutor/rag.py
+# Client for the fine-tuned RAG model servers. Requests are load-balanced over
+# the configured backends, each with a keep-alive connection pool, a concurrency
+# limit and its own circuit breaker, so an outage costs callers milliseconds.
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+import asyncio
+import json
+import httpx
+import requests
+import logging
+import threading
+import time
+from .circuit_breaker import CircuitBreaker
+from .hedging import LatencyTracker
+from .metrics import upstream_errors, upstream_seconds
+
+logger = logging.getLogger(__name__)
+
+RAG_TIMEOUT = 120  # Wait 2 minutes before falling back to Gemini
+
+# Latency of successful replies, used to pick the hedging deadline
+rag_latency = LatencyTracker()
+
+class RagBackend:
+    """One model server: pooled sessions, concurrency limit and circuit breaker"""
+
+    def __init__(self, url, weight=1, max_concurrency=8):
+        self.url = url
+        self.health_url = url.rsplit('/', 1)[0] + '/health'
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.current_weight = 0
+        self.breaker = CircuitBreaker(
+            f'rag_server {url}',
+            failure_threshold=settings.TUTOR_RAG_BREAKER_FAILURES,
+            probe=self.healthy,
+            probe_interval=settings.TUTOR_RAG_BREAKER_PROBE_INTERVAL,
+            trial_timeout=RAG_TIMEOUT,
+        )
+
+        # Persistent connections, one per concurrent request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # httpx clients are bound to the event loop that created them, so one per loop
+        self._async_clients = {}
+        self._clients_lock = threading.Lock()
+
+    def healthy(self):
+        """Health probe used while this backend's circuit is open"""
+        response = self.session.get(self.health_url, timeout=2)
+        return response.status_code == 200 and response.json().get('status') == 'healthy'
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                # Clients of loops that have since closed can neither be used nor awaited
+                # to close; dropping them lets their connections be collected
+                for closed in [other for other in self._async_clients if other.is_closed()]:
+                    del self._async_clients[closed]
+                client = self._async_clients[loop] = httpx.AsyncClient(
+                    timeout=RAG_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency
+                    )
+                )
+        return client
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+class RagPool:
+    """Picks a backend by least outstanding requests or smooth weighted round-robin"""
+
+    def __init__(self, backends, strategy='least_outstanding', queue_timeout=2.0):
+        self.backends = backends
+        self.strategy = strategy
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    def _pick(self, candidates):
+        if self.strategy == 'round_robin':
+            total = sum(backend.weight for backend in candidates)
+            for backend in candidates:
+                backend.current_weight += backend.weight
+            chosen = max(candidates, key=lambda backend: backend.current_weight)
+            chosen.current_weight -= total
+            return chosen
+        return min(candidates, key=lambda backend: backend.outstanding / backend.weight)
+
+    def try_acquire(self):
+        """Return (backend, None) or (None, reason) without waiting"""
+        with self._cond:
+            # Waiting can't help while every breaker refuses, so callers fall back at once
+            candidates = [b for b in self.backends if not b.breaker.refusing()]
+            if not candidates:
+                return None, "RAG circuit open"
+            candidates = [b for b in candidates if b.outstanding < b.max_concurrency]
+            while candidates:
+                backend = self._pick(candidates)
+                # A half-open backend admits a single trial request
+                if backend.breaker.allow_request():
+                    backend.outstanding += 1
+                    return backend, None
+                candidates.remove(backend)
+            return None, "RAG backends saturated"
+
+    def acquire(self):
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            while True:
+                backend, reason = self.try_acquire()
+                remaining = deadline - time.monotonic()
+                if backend or reason == "RAG circuit open" or remaining <= 0:
+                    return backend, reason
+                self._cond.wait(remaining)
+
+    async def aacquire(self):
+        deadline = time.monotonic() + self.queue_timeout
+        loop = asyncio.get_running_loop()
+        while True:
+            # Registered before trying, so a release in between wakes us
+            waiter = (loop, loop.create_future())
+            with self._cond:
+                self._async_waiters.add(waiter)
+            try:
+                backend, reason = self.try_acquire()
+                remaining = deadline - time.monotonic()
+                if backend or reason == "RAG circuit open" or remaining <= 0:
+                    return backend, reason
+                try:
+                    await asyncio.wait_for(waiter[1], remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._cond:
+                    self._async_waiters.discard(waiter)
+
+    def release(self, backend):
+        with self._cond:
+            backend.outstanding -= 1
+            self._cond.notify()
+            waiters = list(self._async_waiters)
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+rag_pool = RagPool(
+    [RagBackend(**backend) for backend in settings.TUTOR_RAG_BACKENDS],
+    strategy=settings.TUTOR_RAG_BALANCING,
+)
+
+def _no_backend(reason):
+    upstream_errors.inc(upstream='rag', reason='circuit_open' if reason == "RAG circuit open" else 'saturated')
+    return None, reason
+
+def _record_rag_call(started, ai_response, reason=None):
+    outcome = 'ok' if ai_response else 'error'
+    upstream_seconds.observe(time.monotonic() - started, upstream='rag', outcome=outcome)
+    if not ai_response:
+        upstream_errors.inc(upstream='rag', reason=reason or 'bad_reply')
+
+def _parse_rag_reply(backend, status_code, data_loader):
+    """Turn a RAG server reply into (response, error), recording breaker outcome"""
+    if status_code >= 500:
+        backend.breaker.record_failure()
+        return None, f"RAG server error: {status_code}"
+
+    # Any non-5xx reply proves the server is up, even if it declined the question
+    backend.breaker.record_success()
+    if status_code != 200:
+        return None, f"RAG server error: {status_code}"
+
+    try:
+        data = data_loader()
+        success = data.get('success')
+    except (ValueError, AttributeError):
+        # Not JSON, or JSON but not an object
+        return None, "RAG server returned invalid JSON"
+    if not success:
+        return None, f"RAG server returned error: {data.get('error')}"
+    return data.get('response'), None
+
+def _payload(user_message, chapter_id, context, subject, standard):
+    """Request body; subject and standard keep retrieval to the student's syllabus"""
+    payload = {
+        'message': user_message,
+        'chapter_id': chapter_id
+    }
+    if subject:
+        payload['subject'] = subject
+    if standard:
+        payload['standard'] = standard
+    if context:
+        payload['context'] = context
+    return payload
+
+def get_rag_response(user_message, chapter_id=None, context=None, subject=None, standard=None):
+    """Ask a RAG server for a complete reply, returning (response, error)"""
+    backend, reason = rag_pool.acquire()
+    if not backend:
+        return _no_backend(reason)
+
+    payload = _payload(user_message, chapter_id, context, subject, standard)
+
+    started = time.monotonic()
+    try:
+        logger.info("Attempting connection to RAG server %s...", backend.url)
+        response = backend.session.post(backend.url, json=payload, timeout=RAG_TIMEOUT)
+    except requests.exceptions.ConnectionError:
+        backend.breaker.record_failure()
+        _record_rag_call(started, None, 'unavailable')
+        return None, "RAG server not available"
+    except requests.exceptions.Timeout:
+        backend.breaker.record_failure()
+        _record_rag_call(started, None, 'timeout')
+        return None, "RAG server timed out"
+    except Exception as e:
+        backend.breaker.record_failure()
+        _record_rag_call(started, None, 'error')
+        return None, f"RAG server error: {str(e)}"
+    finally:
+        rag_pool.release(backend)
+
+    logger.info("RAG server response status: %s", response.status_code)
+    ai_response, error = _parse_rag_reply(backend, response.status_code, response.json)
+    _record_rag_call(started, ai_response)
+    if ai_response:
+        rag_latency.record(time.monotonic() - started)
+    return ai_response, error
+
+async def aget_rag_response(user_message, chapter_id=None, context=None, subject=None, standard=None):
+    """Ask a RAG server without blocking the event loop"""
+    backend, reason = await rag_pool.aacquire()
+    if not backend:
+        return _no_backend(reason)
+
+    payload = _payload(user_message, chapter_id, context, subject, standard)
+
+    started = time.monotonic()
+    try:
+        response = await backend.async_client().post(backend.url, json=payload)
+    except httpx.ConnectError:
+        backend.breaker.record_failure()
+        _record_rag_call(started, None, 'unavailable')
+        return None, "RAG server not available"
+    except httpx.TimeoutException:
+        backend.breaker.record_failure()
+        _record_rag_call(started, None, 'timeout')
+        return None, "RAG server timed out"
+    except Exception as e:
+        backend.breaker.record_failure()
+        _record_rag_call(started, None, 'error')
+        return None, f"RAG server error: {str(e)}"
+    finally:
+        rag_pool.release(backend)
+
+    logger.info("RAG server response status: %s", response.status_code)
+    ai_response, error = _parse_rag_reply(backend, response.status_code, response.json)
+    _record_rag_call(started, ai_response)
+    if ai_response:
+        rag_latency.record(time.monotonic() - started)
+    return ai_response, error
+
+def stream_rag_response(user_message, chapter_id=None, context=None, subject=None, standard=None):
+    """Yield RAG server response text chunks as they arrive
+
+    The RAG server streams NDJSON lines of the form {"delta": "..."} when
+    asked with "stream": true. Servers that don't support streaming reply
+    with the usual single JSON object, which is yielded as one chunk.
+    """
+    backend, reason = rag_pool.acquire()
+    if not backend:
+        _no_backend(reason)
+        raise RuntimeError(reason)
+
+    payload = _payload(user_message, chapter_id, context, subject, standard)
+    payload['stream'] = True
+
+    try:
+        try:
+            response = backend.session.post(backend.url, json=payload, timeout=RAG_TIMEOUT, stream=True)
+        except Exception as e:
+            backend.breaker.record_failure()
+            upstream_errors.inc(upstream='rag', reason='timeout' if isinstance(e, requests.exceptions.Timeout) else 'unavailable')
+            raise
+
+        with response:
+            content_type = response.headers.get('Content-Type', '')
+            if response.status_code != 200 or 'ndjson' not in content_type:
+                ai_response, error = _parse_rag_reply(backend, response.status_code, response.json)
+                if error:
+                    raise RuntimeError(error)
+                if ai_response:
+                    yield ai_response
+                return
+
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event.get('error'):
+                        raise RuntimeError(f"RAG server returned error: {event.get('error')}")
+                    if event.get('delta'):
+                        yield event['delta']
+            except requests.exceptions.RequestException:
+                backend.breaker.record_failure()
+                raise
+            backend.breaker.record_success()
+    finally:
+        rag_pool.release(backend)
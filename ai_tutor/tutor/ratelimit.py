@@ -0,0 +1,318 @@
+# tutor/ratelimit.py
+# Admission control for chat: token buckets per user and globally, and a cap
+# on concurrent upstream LLM calls with a short, bounded wait queue. Requests
+# over either limit fail fast with RateLimited (429 + Retry-After) instead of
+# queueing behind everyone else. State lives in-process by default, or in a
+# small SQLite file shared by every worker on the host.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def _refill(tokens, updated, rate, burst, now):
+    return min(burst, tokens + (now - updated) * rate)
+
+class LocalStore:
+    """Buckets and call slots of this process only"""
+
+    # Every release happens in this process, so waiters are woken by it
+    shared = False
+
+    def __init__(self):
+        self._buckets = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets, now):
+        """Take one token from every (key, rate, burst) bucket, or none; returns seconds to wait"""
+        with self._lock:
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                levels.append(_refill(tokens, updated, rate, burst, now))
+            wait = max(((1 - level) / rate for level, (_, rate, _) in zip(levels, buckets, strict=True) if level < 1), default=0)
+            if not wait:
+                for level, (key, _, _) in zip(levels, buckets, strict=True):
+                    self._buckets[key] = (level - 1, now)
+            return wait
+
+    def try_acquire_slot(self, holder, limit, lease, now):
+        with self._lock:
+            # Expire slots whose holder never released them (e.g. an unread stream)
+            for stale in [h for h, acquired in self._slots.items() if acquired < now - lease]:
+                del self._slots[stale]
+            if len(self._slots) >= limit:
+                return False
+            self._slots[holder] = now
+            return True
+
+    def release_slot(self, holder):
+        with self._lock:
+            self._slots.pop(holder, None)
+
+    def active_slots(self, now, lease):
+        with self._lock:
+            return len(self._slots)
+
+class SqliteStore:
+    """Buckets and call slots shared by all workers through one SQLite file
+
+    Slots are leases so a crashed worker's calls expire instead of leaking.
+    """
+
+    # Other workers release slots too, which waiters only notice by polling
+    shared = True
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS slots (holder TEXT PRIMARY KEY, acquired REAL)')
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return _Transaction(db)
+
+    def take(self, buckets, now):
+        with self._connect() as db:
+            levels = []
+            for key, rate, burst in buckets:
+                row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated = row if row else (burst, now)
+                levels.append(_refill(tokens, updated, rate, burst, now))
+            wait = max(((1 - level) / rate for level, (_, rate, _) in zip(levels, buckets, strict=True) if level < 1), default=0)
+            if not wait:
+                db.executemany(
+                    'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                    [(key, level - 1, now) for level, (key, _, _) in zip(levels, buckets, strict=True)]
+                )
+            return wait
+
+    def try_acquire_slot(self, holder, limit, lease, now):
+        with self._connect() as db:
+            db.execute('DELETE FROM slots WHERE acquired < ?', (now - lease,))
+            (active,) = db.execute('SELECT COUNT(*) FROM slots').fetchone()
+            if active >= limit:
+                return False
+            db.execute('INSERT INTO slots (holder, acquired) VALUES (?, ?)', (holder, now))
+            return True
+
+    def release_slot(self, holder):
+        with self._connect() as db:
+            db.execute('DELETE FROM slots WHERE holder = ?', (holder,))
+
+    def active_slots(self, now, lease):
+        with self._connect() as db:
+            (active,) = db.execute('SELECT COUNT(*) FROM slots WHERE acquired >= ?', (now - lease,)).fetchone()
+            return active
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so read-modify-write is atomic across processes"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+class RateLimiter:
+    """Token buckets: `rate` requests per minute with bursts of `burst`"""
+
+    def __init__(self, store, user_rate, user_burst, global_rate, global_burst):
+        self.store = store
+        self.user_rate = user_rate / 60
+        self.user_burst = user_burst
+        self.global_rate = global_rate / 60
+        self.global_burst = global_burst
+
+    def check(self, user_id):
+        """Admit one request of user_id or raise RateLimited"""
+        buckets = [
+            (f'user:{user_id}', self.user_rate, self.user_burst),
+            ('global', self.global_rate, self.global_burst),
+        ]
+        try:
+            wait = self.store.take(buckets, time.time())
+        except sqlite3.Error as e:
+            # Fail open: the limiter must not take chat down with it
+            logger.error("Rate limit store unavailable, admitting request: %s", e)
+            return
+        if wait:
+            raise RateLimited("Too many requests, please slow down", wait)
+
+class _Slot:
+    def __init__(self, limiter, holder):
+        self.limiter = limiter
+        self.holder = holder
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter.store.release_slot(self.holder)
+            self.limiter._wake_waiters()
+
+    async def arelease(self):
+        if self.limiter.store.shared:
+            await sync_to_async(self.release, thread_sensitive=False)()
+        else:
+            self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+class ConcurrencyLimiter:
+    """At most `limit` upstream calls at once; others wait up to queue_timeout
+
+    Waiters sleep until a slot of this process is released; with a shared
+    store they also recheck every poll_interval for slots released elsewhere.
+    """
+
+    def __init__(self, store, limit, queue_timeout, max_queue, lease=300.0, poll_interval=0.1):
+        self.store = store
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition()
+        self._generation = 0
+        self._async_waiters = set()
+
+    def _try(self, holder):
+        try:
+            return self.store.try_acquire_slot(holder, self.limit, self.lease, time.time())
+        except sqlite3.Error as e:
+            logger.error("Concurrency store unavailable, admitting call: %s", e)
+            return True
+
+    async def _atry(self, holder):
+        if self.store.shared:
+            # SQLite I/O with a busy timeout; keep it off the event loop
+            return await sync_to_async(self._try, thread_sensitive=False)(holder)
+        return self._try(holder)
+
+    def _wait_time(self, deadline):
+        remaining = deadline - time.monotonic()
+        return min(remaining, self.poll_interval) if self.store.shared else remaining
+
+    def _wake_waiters(self):
+        with self._released:
+            self._generation += 1
+            self._released.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _enqueue(self):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise RateLimited("Tutor is busy, please retry shortly", self.queue_timeout)
+            self._waiting += 1
+
+    def _dequeue(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self):
+        """Wait briefly for a call slot; use as `with limiter.acquire():`"""
+        holder = f'{os.getpid()}:{uuid.uuid4().hex}'
+        if self._try(holder):
+            return _Slot(self, holder)
+        self._enqueue()
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            while time.monotonic() < deadline:
+                # Read before trying, so a release in between isn't slept through
+                with self._released:
+                    generation = self._generation
+                if self._try(holder):
+                    return _Slot(self, holder)
+                with self._released:
+                    if self._generation == generation:
+                        self._released.wait(max(0, self._wait_time(deadline)))
+        finally:
+            self._dequeue()
+        raise RateLimited("Tutor is busy, please retry shortly", self.queue_timeout)
+
+    async def aacquire(self):
+        holder = f'{os.getpid()}:{uuid.uuid4().hex}'
+        if await self._atry(holder):
+            return _Slot(self, holder)
+        self._enqueue()
+        loop = asyncio.get_running_loop()
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            while time.monotonic() < deadline:
+                # Registered before trying, so a release in between wakes us
+                waiter = (loop, loop.create_future())
+                with self._released:
+                    self._async_waiters.add(waiter)
+                try:
+                    if await self._atry(holder):
+                        return _Slot(self, holder)
+                    await asyncio.wait_for(waiter[1], max(0, self._wait_time(deadline)))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._released:
+                        self._async_waiters.discard(waiter)
+        finally:
+            self._dequeue()
+        raise RateLimited("Tutor is busy, please retry shortly", self.queue_timeout)
+
+    def stats(self):
+        return {
+            'active': self.store.active_slots(time.time(), self.lease),
+            'waiting': self._waiting,
+            'limit': self.limit,
+        }
+
+_store = SqliteStore(settings.TUTOR_RATELIMIT_SHARED_DB) if settings.TUTOR_RATELIMIT_SHARED_DB else LocalStore()
+
+rate_limiter = RateLimiter(
+    _store,
+    user_rate=settings.TUTOR_RATELIMIT_USER_PER_MINUTE,
+    user_burst=settings.TUTOR_RATELIMIT_USER_BURST,
+    global_rate=settings.TUTOR_RATELIMIT_GLOBAL_PER_MINUTE,
+    global_burst=settings.TUTOR_RATELIMIT_GLOBAL_BURST,
+)
+
+llm_limiter = ConcurrencyLimiter(
+    _store,
+    limit=settings.TUTOR_LLM_MAX_CONCURRENCY,
+    queue_timeout=settings.TUTOR_LLM_QUEUE_TIMEOUT,
+    max_queue=settings.TUTOR_LLM_MAX_QUEUE,
+)
@@ -0,0 +1,10 @@
+# tutor/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .catalogue import chapter_catalogue
+from .models import Chapter, Subject
+
+@receiver([post_save, post_delete], sender=Subject)
+@receiver([post_save, post_delete], sender=Chapter)
+def invalidate_chapter_catalogue(sender, **kwargs):
+    chapter_catalogue.invalidate()
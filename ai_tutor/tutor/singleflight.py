@@ -0,0 +1,158 @@
+# tutor/singleflight.py
+# Request coalescing: concurrent identical questions (same chapter, same
+# normalised text) share one upstream RAG / Gemini call. Works across threads
+# in-process and, optionally, across worker processes via the InflightQuestion table.
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+import asyncio
+import logging
+import threading
+import time
+from .models import InflightQuestion
+
+logger = logging.getLogger(__name__)
+
+# What an async leader leaves its followers when it is cancelled mid-call
+_ABANDONED = object()
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, shared=False, timeout=150.0, linger=5.0, poll_interval=0.2):
+        self.shared = shared
+        self.timeout = timeout
+        self.linger = linger
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.counters = {'leaders': 0, 'coalesced': 0, 'shared_coalesced': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def do(self, key, func):
+        """Run func once per key among concurrent callers; returns (result, coalesced)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._count('coalesced')
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            if self.shared:
+                call.result, coalesced = self._do_shared(key, func)
+                if coalesced:
+                    return call.result, True
+            else:
+                call.result = func()
+            self._count('leaders')
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _do_shared(self, key, func):
+        """Cross-process leg: the process that inserts the lock row makes the call"""
+        now = timezone.now()
+        InflightQuestion.objects.filter(
+            Q(created_at__lt=now - timedelta(seconds=self.timeout)) |
+            Q(completed=True, updated_at__lt=now - timedelta(seconds=self.linger))
+        ).delete()
+
+        try:
+            with transaction.atomic():
+                InflightQuestion.objects.create(key=key)
+        except IntegrityError:
+            result = self._wait_shared(key)
+            if result is not None:
+                self._count('shared_coalesced')
+                return result, True
+            # The other process gave up; answer this request ourselves
+            return func(), False
+
+        try:
+            result = func()
+        except Exception:
+            InflightQuestion.objects.filter(key=key).delete()
+            raise
+
+        response, source, error = result
+        InflightQuestion.objects.filter(key=key).update(
+            response=response, source=source or '', error=error or '', completed=True
+        )
+        return result, False
+
+    def _wait_shared(self, key):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            row = InflightQuestion.objects.filter(key=key).values(
+                'response', 'source', 'error', 'completed'
+            ).first()
+            if row is None:
+                return None
+            if row['completed']:
+                return row['response'], row['source'] or None, row['error'] or None
+            time.sleep(self.poll_interval)
+        return None
+
+    async def ado(self, key, coro_func):
+        """Async do() for the event loop; in-process only"""
+        loop_key = (id(asyncio.get_running_loop()), key)
+        future = self._async_calls.get(loop_key)
+        while future is not None:
+            self._count('coalesced')
+            result = await asyncio.shield(future)
+            if result is not _ABANDONED:
+                return result, True
+            # The leader was cancelled; the first follower to wake takes over
+            future = self._async_calls.get(loop_key)
+
+        future = self._async_calls[loop_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coro_func()
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so followers-less failures don't warn at shutdown
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled: followers retry rather than wait on a future nobody resolves
+            future.set_result(_ABANDONED)
+            raise
+        else:
+            future.set_result(result)
+            self._count('leaders')
+            return result, False
+        finally:
+            del self._async_calls[loop_key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self._calls) + len(self._async_calls)
+        return stats
+
+single_flight = SingleFlight(
+    shared=settings.TUTOR_SINGLEFLIGHT_SHARED,
+    timeout=settings.TUTOR_SINGLEFLIGHT_TIMEOUT,
+)
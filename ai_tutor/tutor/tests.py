@@ -1,3 +1,950 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+
+from accounts.models import StudentProfile
+
+from . import async_views, gemini, history, metrics, rag, views
+from .answer_cache import EVICT_EVERY, HIT_FLUSH_EVERY, AnswerCache, _SimilarityIndex
+from .archive import archive_users
+from .circuit_breaker import CircuitBreaker
+from .context import is_follow_up
+from .gemini import GeminiRegistry
+from .hedging import LatencyTracker, hedge_deadline, race_with_hedge
+from .metrics import Registry, metrics_middleware
+from .models import CachedAnswer, Chapter, ChatMessage, Subject
+from .rag import RagBackend, RagPool, get_rag_response
+from .ratelimit import ConcurrencyLimiter, LocalStore, RateLimited, RateLimiter
+from .singleflight import SingleFlight
+from .write_behind import ChatMessageWriter
+
+
+# The async views, which the project only routes to with TUTOR_ASYNC_VIEWS
+urlpatterns = [
+    path('api/subjects/', async_views.subjects_view),
+    path('api/chat/', async_views.chat_view),
+    path('api/chat/history/', async_views.get_chat_history),
+]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.005)
+
+
+def busy_llm_limiter(test):
+    """A limiter whose only upstream call slot is taken and that lets nobody queue"""
+    limiter = ConcurrencyLimiter(LocalStore(), limit=1, queue_timeout=0.1, max_queue=0)
+    test.addCleanup(limiter.acquire().release)
+    return limiter
+
+
+def reply(status_code, body=None):
+    return mock.Mock(status_code=status_code, json=mock.Mock(return_value=body or {}))
+
+
+def streamed_reply(events=None, body=None):
+    """A streaming RAG reply: NDJSON events, or the single JSON body of a server that doesn't stream"""
+    content_type = 'application/json' if events is None else 'application/x-ndjson'
+    response = mock.MagicMock(status_code=200, headers={'Content-Type': content_type})
+    response.iter_lines.return_value = [json.dumps(event) for event in events or ()]
+    response.json.return_value = body or {}
+    return response
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def breaker(self, **kwargs):
+        breaker = CircuitBreaker('test', **kwargs)
+        # Probe threads would otherwise keep probing for the rest of the run
+        self.addCleanup(breaker.close)
+        return breaker
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = self.breaker(failure_threshold=3)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_healthy_probe_admits_one_trial(self):
+        healthy = mock.Mock(return_value=True)
+        breaker = self.breaker(failure_threshold=1, probe=healthy, probe_interval=0.01)
+        breaker.record_failure()
+        wait_for(lambda: breaker.state == CircuitBreaker.HALF_OPEN)
+
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+    def test_failed_trial_reopens(self):
+        breaker = self.breaker(failure_threshold=3, probe=lambda: True, probe_interval=0.01)
+        for _ in range(3):
+            breaker.record_failure()
+        wait_for(lambda: breaker.state == CircuitBreaker.HALF_OPEN)
+        breaker.probe = None
+
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_failing_probe_keeps_circuit_open(self):
+        probe = mock.Mock(side_effect=requests.ConnectionError)
+        breaker = self.breaker(failure_threshold=1, probe=probe, probe_interval=0.01)
+        breaker.record_failure()
+        wait_for(lambda: probe.call_count >= 3)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        breaker.close()
+        probes = probe.call_count
+        time.sleep(0.05)
+        self.assertEqual(probe.call_count, probes)
+
+
+class RagPoolTests(SimpleTestCase):
+    def backend(self, name, weight=1, max_concurrency=8):
+        backend = RagBackend(f'http://{name}:5002/generate', weight=weight, max_concurrency=max_concurrency)
+        # No health probe threads reaching for these hosts
+        backend.breaker.probe = None
+        self.addCleanup(backend.breaker.close)
+        return backend
+
+    def test_least_outstanding(self):
+        first, second = self.backend('a'), self.backend('b')
+        pool = RagPool([first, second])
+        self.assertIs(pool.try_acquire()[0], first)
+        self.assertIs(pool.try_acquire()[0], second)
+        pool.release(first)
+        self.assertIs(pool.try_acquire()[0], first)
+
+    def test_weighted_round_robin(self):
+        heavy, light = self.backend('a', weight=2), self.backend('b')
+        pool = RagPool([heavy, light], strategy='round_robin')
+        picks = []
+        for _ in range(6):
+            backend, _ = pool.try_acquire()
+            picks.append(backend)
+            pool.release(backend)
+        self.assertEqual(picks, [heavy, light, heavy] * 2)
+
+    def test_skips_open_and_saturated_backends(self):
+        broken, busy = self.backend('a'), self.backend('b', max_concurrency=1)
+        pool = RagPool([broken, busy], queue_timeout=0)
+        for _ in range(3):
+            broken.breaker.record_failure()
+
+        self.assertEqual(pool.try_acquire(), (busy, None))
+        self.assertEqual(pool.acquire(), (None, "RAG backends saturated"))
+        for _ in range(3):
+            busy.breaker.record_failure()
+        self.assertEqual(pool.acquire(), (None, "RAG circuit open"))
+
+    def test_half_open_trial_in_flight_fails_fast(self):
+        backend = self.backend('a')
+        backend.breaker.probe = lambda: True
+        backend.breaker.probe_interval = 0.01
+        for _ in range(3):
+            backend.breaker.record_failure()
+        wait_for(lambda: backend.breaker.state == CircuitBreaker.HALF_OPEN)
+        pool = RagPool([backend], queue_timeout=2)
+
+        self.assertEqual(pool.try_acquire(), (backend, None))
+        started = time.monotonic()
+        self.assertEqual(pool.acquire(), (None, "RAG circuit open"))
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_async_waiter_takes_a_released_slot(self):
+        backend = self.backend('a', max_concurrency=1)
+        pool = RagPool([backend], queue_timeout=2)
+        pool.try_acquire()
+
+        async def acquire():
+            started = time.monotonic()
+            return await pool.aacquire(), time.monotonic() - started
+
+        threading.Timer(0.05, pool.release, [backend]).start()
+        acquired, waited = asyncio.run(acquire())
+        self.assertEqual(acquired, (backend, None))
+        self.assertLess(waited, 1)
+
+        pool.queue_timeout = 0.1
+        acquired, waited = asyncio.run(acquire())
+        self.assertEqual(acquired, (None, "RAG backends saturated"))
+        self.assertGreaterEqual(waited, 0.1)
+
+    def test_one_async_client_per_loop(self):
+        backend = self.backend('a')
+
+        async def clients():
+            return backend.async_client(), backend.async_client()
+
+        first, again = asyncio.run(clients())
+        self.assertIs(first, again)
+        second, _ = asyncio.run(clients())
+        self.assertIsNot(second, first)
+        # The first loop has closed, so its client was let go
+        self.assertEqual(list(backend._async_clients.values()), [second])
+
+
+class RagClientTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = RagBackend('http://rag:5002/generate')
+        self.backend.breaker.probe = None
+        self.addCleanup(self.backend.breaker.close)
+        self.backend.session.post = mock.Mock()
+        patcher = mock.patch.object(rag, 'rag_pool', RagPool([self.backend]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_server_errors_trip_the_breaker(self):
+        self.backend.session.post.return_value = reply(503)
+        for _ in range(3):
+            self.assertEqual(get_rag_response('What is an acid?', 2), (None, "RAG server error: 503"))
+        self.assertEqual(self.backend.breaker.state, CircuitBreaker.OPEN)
+
+        # Refused without reaching the server
+        self.assertEqual(get_rag_response('What is an acid?', 2), (None, "RAG circuit open"))
+        self.assertEqual(self.backend.session.post.call_count, 3)
+
+    def test_connection_errors_trip_the_breaker(self):
+        self.backend.session.post.side_effect = requests.ConnectionError
+        for _ in range(3):
+            self.assertEqual(get_rag_response('What is an acid?', 2), (None, "RAG server not available"))
+        self.assertEqual(self.backend.breaker.state, CircuitBreaker.OPEN)
+
+    def test_client_errors_and_answers_keep_it_closed(self):
+        self.backend.session.post.return_value = reply(400)
+        for _ in range(5):
+            self.assertEqual(get_rag_response('', 2), (None, "RAG server error: 400"))
+        self.assertEqual(self.backend.breaker.state, CircuitBreaker.CLOSED)
+
+        self.backend.session.post.return_value = reply(200, {'success': True, 'response': 'An acid donates protons.'})
+        self.assertEqual(get_rag_response('What is an acid?', 2), ('An acid donates protons.', None))
+        self.assertEqual(self.backend.outstanding, 0)
+
+    def test_invalid_json_reply(self):
+        self.backend.session.post.return_value = reply(200)
+        self.backend.session.post.return_value.json.side_effect = requests.JSONDecodeError('Expecting value', '<html>', 0)
+        self.assertEqual(get_rag_response('What is an acid?', 2), (None, "RAG server returned invalid JSON"))
+
+        self.backend.session.post.return_value = reply(200, ['An acid donates protons.'])
+        self.assertEqual(get_rag_response('What is an acid?', 2), (None, "RAG server returned invalid JSON"))
+        self.assertEqual(self.backend.outstanding, 0)
+
+    def test_payload_narrows_retrieval_to_the_syllabus(self):
+        self.backend.session.post.return_value = reply(200, {'success': True, 'response': 'An acid donates protons.'})
+        get_rag_response('What is an acid?', 2, subject='Science', standard='10th')
+        self.assertEqual(self.backend.session.post.call_args.kwargs['json'], {
+            'message': 'What is an acid?', 'chapter_id': 2, 'subject': 'Science', 'standard': '10th',
+        })
+
+
+class HedgingTests(SimpleTestCase):
+    def test_deadline_settings(self):
+        tracker = LatencyTracker()
+        for ms in range(1, 101):
+            tracker.record(ms / 1000)
+        self.assertEqual(hedge_deadline(tracker, '2.5'), 2.5)
+        self.assertAlmostEqual(hedge_deadline(tracker, 'p90'), 0.091)
+        self.assertEqual(hedge_deadline(LatencyTracker(), 'p90'), 5.0)
+        # Malformed settings fall back to the default instead of raising
+        for setting in ('p', 'p0', 'p150', 'soon', '-1'):
+            self.assertEqual(hedge_deadline(tracker, setting), 5.0)
+
+    def test_backup_beats_a_slow_primary(self):
+        def slow():
+            time.sleep(0.5)
+            return 'primary', None
+
+        result, winner = race_with_hedge(slow, lambda: ('backup', None), deadline=0.05)
+        self.assertEqual((result, winner), (('backup', None), 'hedge'))
+
+    def test_failed_primary_falls_back(self):
+        result, winner = race_with_hedge(lambda: (None, "RAG server error: 503"), lambda: ('backup', None), deadline=1)
+        self.assertEqual((result, winner), (('backup', None), 'fallback'))
+
+
+class GeminiRegistryTests(SimpleTestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.dict(os.environ, {'GOOGLE_API_KEY': 'test-key'}),
+            mock.patch.object(gemini, 'genai'),
+            mock.patch.object(gemini, 'list_available_gemini_models', return_value=['models/first', 'models/second']),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        gemini.genai.GenerativeModel.side_effect = lambda name: mock.Mock(model_name=name)
+
+    def registry(self, models_ttl=600):
+        registry = GeminiRegistry(['first', 'second', 'third'], models_ttl=models_ttl)
+        self.addCleanup(registry.close)
+        return registry
+
+    def test_last_working_model_goes_first(self):
+        registry = self.registry()
+        models, _ = registry.candidates()
+        self.assertEqual([name for name, _ in models], ['first', 'second', 'third'])
+
+        registry.mark_working('second')
+        again, _ = registry.candidates()
+        self.assertEqual([name for name, _ in again], ['second', 'first', 'third'])
+        # Configured and built once, then kept warm
+        self.assertIs(dict(again)['first'], dict(models)['first'])
+        self.assertEqual(gemini.genai.configure.call_count, 1)
+        self.assertEqual(gemini.genai.GenerativeModel.call_count, 3)
+
+    def test_falls_back_down_the_chain(self):
+        registry = self.registry()
+        models, _ = registry.candidates()
+        dict(models)['first'].generate_content.side_effect = RuntimeError('quota exceeded')
+        dict(models)['second'].generate_content.return_value = mock.Mock(text='An acid donates protons.')
+
+        with mock.patch.object(views, 'gemini_registry', registry):
+            self.assertEqual(views.get_gemini_response('What is an acid?'), ('An acid donates protons.', None))
+            self.assertEqual(dict(models)['first'].generate_content.call_count, 1)
+            # The model that answered is tried first next time
+            views.get_gemini_response('What is a base?')
+        self.assertEqual(dict(models)['first'].generate_content.call_count, 1)
+        self.assertEqual(dict(models)['second'].generate_content.call_count, 2)
+
+    def test_available_models_refresh_in_the_background(self):
+        registry = self.registry(models_ttl=0.05)
+        self.assertEqual(registry.available_models(), [])
+        registry.candidates()
+        wait_for(lambda: registry.available_models() == ['models/first', 'models/second'])
+
+        gemini.list_available_gemini_models.return_value = ['models/second']
+        wait_for(lambda: registry.available_models() == ['models/second'])
+
+        gemini.genai.GenerativeModel.side_effect = ValueError('unknown model')
+        registry._models.clear()
+        self.assertEqual(registry.candidates(), (
+            [], "Failed to initialize any Gemini model. Tried: first, second, third. Available models: models/second"
+        ))
+
+
+class AnswerCacheTests(TestCase):
+    def test_hits_and_misses(self):
+        cache = AnswerCache(ttl=3600)
+        self.assertIsNone(cache.get('1:10th:2', 'What is an acid?'))
+        cache.set('1:10th:2', 'What is an acid?', 'An acid donates protons.', 'rag')
+
+        # Same question after normalisation, from memory and then from the table
+        self.assertEqual(cache.get('1:10th:2', 'what is an ACID'), ('An acid donates protons.', 'rag'))
+        self.assertEqual(AnswerCache(ttl=3600).get('1:10th:2', 'What is acid?'), ('An acid donates protons.', 'rag'))
+        self.assertIsNone(cache.get('1:10th:3', 'What is an acid?'))
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_evicts_expired_then_oldest_rows(self):
+        cache = AnswerCache(ttl=3600, max_rows=2)
+        for n in range(4):
+            cache.set('1:2', f'question {n}', f'answer {n}', 'rag')
+        CachedAnswer.objects.filter(question='question 0').update(created_at=timezone.now() - timedelta(hours=2))
+        CachedAnswer.objects.filter(question='question 1').update(created_at=timezone.now() - timedelta(minutes=5))
+
+        cache.evict()
+        self.assertEqual(
+            sorted(CachedAnswer.objects.values_list('question', flat=True)), ['question 2', 'question 3']
+        )
+        self.assertIsNone(AnswerCache(ttl=3600).get('1:2', 'question 0'))
+
+    def test_eviction_runs_off_the_request_thread(self):
+        cache = AnswerCache()
+        threads = []
+        with mock.patch.object(cache, 'evict', side_effect=lambda: threads.append(threading.current_thread())):
+            for n in range(EVICT_EVERY):
+                cache.set('1:2', f'question {n}', 'answer', 'rag')
+            wait_for(lambda: threads)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_table_hit_keeps_the_rows_expiry(self):
+        AnswerCache(ttl=3600).set('1:2', 'What is an acid?', 'An acid donates protons.', 'rag')
+        CachedAnswer.objects.update(created_at=timezone.now() - timedelta(minutes=59))
+        cache = AnswerCache(ttl=3600)
+        self.assertEqual(cache.get('1:2', 'What is an acid?'), ('An acid donates protons.', 'rag'))
+
+        # Two minutes on, the row has expired and so has its copy in memory
+        self.assertIsNotNone(cache._memory_get(('1:2', 'what is acid')))
+        later = time.monotonic() + 120
+        with mock.patch('tutor.answer_cache.time', mock.Mock(monotonic=lambda: later)):
+            self.assertIsNone(cache._memory_get(('1:2', 'what is acid')))
+
+    def test_hit_counts_are_written_in_batches(self):
+        AnswerCache(ttl=3600).set('1:2', 'What is an acid?', 'An acid donates protons.', 'rag')
+        # No memory tier, so every hit comes from the table
+        cache = AnswerCache(ttl=3600, memory_size=0)
+        with mock.patch.object(cache, '_run_flush_hits') as flush:
+            for _ in range(HIT_FLUSH_EVERY - 1):
+                with self.assertNumQueries(1):
+                    cache.get('1:2', 'What is an acid?')
+            flush.assert_not_called()
+            cache.get('1:2', 'What is an acid?')
+            wait_for(lambda: flush.called)
+
+        cache.flush_hits()
+        self.assertEqual(CachedAnswer.objects.get().hits, HIT_FLUSH_EVERY)
+
+    def test_similarity_index_is_bounded(self):
+        index = _SimilarityIndex(capacity=3)
+        index.add([f'what is chapter {n} about' for n in range(5)])
+        self.assertEqual(list(index.rows), ['what is chapter 2 about', 'what is chapter 3 about', 'what is chapter 4 about'])
+        self.assertEqual(len(index.matrix), 3)
+
+        index.remove('what is chapter 3 about')
+        self.assertEqual(index.best_match('what is chapter 3 about', 0.99), None)
+        index.add(['what is photosynthesis'])
+        # The removed question's row is reused rather than the matrix grown
+        self.assertEqual(len(index.matrix), 3)
+        self.assertEqual(index.best_match('what is photosynthesis', 0.99), 'what is photosynthesis')
+        self.assertEqual(index.best_match('what is chapter 4 about', 0.99), 'what is chapter 4 about')
+
+    def test_eviction_drops_similarity_entries(self):
+        cache = AnswerCache(ttl=3600, similarity=0.8)
+        cache.set('1:2', 'What is an acid?', 'An acid donates protons.', 'rag')
+        cache.set('1:2', 'What is a base?', 'A base accepts protons.', 'rag')
+        CachedAnswer.objects.filter(question='what is acid').update(created_at=timezone.now() - timedelta(hours=2))
+
+        cache.evict()
+        self.assertEqual(list(cache._indexes['1:2'].rows), ['what is base'])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight, release, calls = SingleFlight(), threading.Event(), []
+
+        def answer():
+            calls.append(1)
+            release.wait(2)
+            return 'An acid donates protons.'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('q', answer))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: flight.stats()['coalesced'] == 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(coalesced for _, coalesced in results), [False] + [True] * 4)
+        self.assertEqual({result for result, _ in results}, {'An acid donates protons.'})
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+    def test_leader_error_reaches_followers(self):
+        flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('RAG down')
+
+        async def main():
+            return await asyncio.gather(*(flight.ado('q', failing) for _ in range(3)), return_exceptions=True)
+
+        errors = asyncio.run(main())
+        self.assertEqual([str(error) for error in errors], ['RAG down'] * 3)
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+    def test_cancelled_leader_hands_over_to_a_follower(self):
+        flight, calls = SingleFlight(), []
+
+        async def answer():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'An acid donates protons.'
+
+        async def main():
+            leader = asyncio.create_task(flight.ado('q', answer))
+            await asyncio.sleep(0.01)
+            followers = [asyncio.create_task(flight.ado('q', answer)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.wait_for(asyncio.gather(*followers), timeout=2), leader.cancelled()
+
+        results, leader_cancelled = asyncio.run(main())
+        self.assertTrue(leader_cancelled)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(coalesced for _, coalesced in results), [False, True])
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'password')
+        self.subject = Subject.objects.create(name='Science')
+        now = timezone.now()
+        self.messages = [
+            ChatMessage.objects.create(
+                user=self.user, subject=self.subject, chapter_index=2,
+                role='user' if n % 2 == 0 else 'ai', message=f'message {n}', created_at=now - timedelta(days=10 - n),
+            ).message
+            for n in range(7)
+        ]
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        response = self.client.get('/api/chat/history/', {'subject_id': self.subject.id, 'chapter_id': 2, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, limit):
+        pages, body = [], self.get(limit=limit)
+        pages.append([message['message'] for message in body['history']])
+        while body['has_more']:
+            body = self.get(limit=limit, before=body['next_cursor'])
+            pages.append([message['message'] for message in body['history']])
+        return pages
+
+    def test_whole_conversation_without_paging(self):
+        body = self.get()
+        self.assertEqual([message['message'] for message in body['history']], self.messages)
+        self.assertFalse(body['has_more'])
+
+    def test_cursor_pages_newest_first(self):
+        pages = self.walk(limit=3)
+        self.assertEqual(pages, [self.messages[4:], self.messages[1:4], self.messages[:1]])
+
+    def test_bad_cursor_or_limit(self):
+        for params in ({'before': 'not-a-cursor'}, {'limit': '0'}, {'limit': 'ten'}):
+            response = self.client.get('/api/chat/history/', {'subject_id': self.subject.id, 'chapter_id': 2, **params})
+            self.assertEqual(response.status_code, 400)
+
+    def test_first_page_leaves_the_archive_alone(self):
+        archive_users([self.user.id], timezone.now() - timedelta(days=6, hours=12), segment_size=2)
+        self.assertEqual(ChatMessage.objects.count(), 3)
+
+        with mock.patch.object(history, 'fetch_archived', wraps=history.fetch_archived) as fetch_archived:
+            body = self.get(limit=5)
+            fetch_archived.assert_not_called()
+            self.assertEqual([message['message'] for message in body['history']], self.messages[4:])
+            self.assertTrue(body['has_more'])
+
+            body = self.get(limit=5, before=body['next_cursor'])
+            fetch_archived.assert_called_once()
+            self.assertEqual([message['message'] for message in body['history']], self.messages[:4])
+            self.assertFalse(body['has_more'])
+
+    def test_archive_round_trip(self):
+        before = self.get()['history']
+        # Two runs, so the history comes back from segments of different sizes
+        archive_users([self.user.id], timezone.now() - timedelta(days=7, hours=12), segment_size=2)
+        archive_users([self.user.id], timezone.now(), segment_size=3)
+        self.assertFalse(ChatMessage.objects.exists())
+
+        body = self.get()
+        self.assertEqual(body['history'], before)
+        self.assertFalse(body['has_more'])
+        self.assertEqual(self.walk(limit=2), [self.messages[5:], self.messages[3:5], self.messages[1:3], self.messages[:1]])
+
+
+# Foreign keys are checked at commit, which TestCase's wrapping transaction never reaches
+class WriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'password')
+        self.subject = Subject.objects.create(name='Science')
+        self.spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spill_dir, ignore_errors=True)
+        self.sent = timezone.now()
+
+    def writer(self):
+        writer = ChatMessageWriter(self.spill_dir, batch_size=1000, flush_interval=60)
+        self.addCleanup(writer.stop)
+        return writer
+
+    def record(self, n, subject_id=None):
+        return {
+            'user_id': self.user.id, 'subject_id': subject_id or self.subject.id, 'chapter_index': 2,
+            'role': 'user', 'message': f'message {n}', 'created_at': (self.sent + timedelta(seconds=n)).isoformat(),
+        }
+
+    def dead_letters(self):
+        path = os.path.join(self.spill_dir, f'dead-{os.getpid()}.jsonl')
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as dead:
+            return [json.loads(line)['message'] for line in dead]
+
+    def test_flush_commits_and_removes_the_spill(self):
+        writer = self.writer()
+        for n in range(3):
+            writer.enqueue(self.user.id, self.subject.id, 2, 'user', f'message {n}', self.sent + timedelta(seconds=n))
+        self.assertEqual(len(writer.pending_for(self.user.id, self.subject.id, 2)), 3)
+
+        writer.flush()
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(writer.pending_for(self.user.id, self.subject.id, 2), [])
+        self.assertEqual(os.listdir(self.spill_dir), [f'chat-{os.getpid()}.jsonl'])
+
+    def test_unknown_subject_is_refused(self):
+        with self.assertRaises(ValueError):
+            self.writer().enqueue(self.user.id, 9999, 2, 'user', 'message', self.sent)
+
+    def test_rejected_row_is_dead_lettered(self):
+        writer = self.writer()
+        writer.enqueue(self.user.id, self.subject.id, 2, 'user', 'message 0', self.sent)
+        with writer._cond:
+            # Got past enqueue, then its subject went away
+            writer._pending.append(dict(self.record(1, subject_id=9999), created_at=self.sent + timedelta(seconds=1)))
+        writer.enqueue(self.user.id, self.subject.id, 2, 'user', 'message 2', self.sent + timedelta(seconds=2))
+
+        writer.flush()
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['message 0', 'message 2'])
+        self.assertEqual(self.dead_letters(), ['message 1'])
+        self.assertEqual(writer.pending_for(self.user.id, self.subject.id, 2), [])
+
+    def test_orphaned_spill_is_replayed(self):
+        ChatMessage.objects.create(
+            user=self.user, subject=self.subject, chapter_index=2, role='user', message='message 0', created_at=self.sent
+        )
+        # Left behind by a process that died before flushing; 99999999 is never a live pid
+        with open(os.path.join(self.spill_dir, 'chat-99999999.jsonl'), 'w', encoding='utf-8') as spill:
+            for record in (self.record(0), self.record(1, subject_id=9999), self.record(2)):
+                spill.write(json.dumps(record) + '\n')
+
+        self.writer().start()
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['message 0', 'message 2'])
+        self.assertEqual(self.dead_letters(), ['message 1'])
+        self.assertNotIn('chat-99999999.jsonl', os.listdir(self.spill_dir))
+
+
+@override_settings(TUTOR_ANSWER_CACHE_ENABLED=False, TUTOR_RATELIMIT_ENABLED=False)
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'password')
+        StudentProfile.objects.create(user=self.user, standard='10th', standard_selected=True)
+        self.subject = Subject.objects.create(name='Science')
+        self.client.force_login(self.user)
+        self.backend = RagBackend('http://rag:5002/generate')
+        self.backend.breaker.probe = None
+        self.addCleanup(self.backend.breaker.close)
+        self.backend.session.post = mock.Mock()
+        patcher = mock.patch.object(rag, 'rag_pool', RagPool([self.backend]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, message='What is an acid?'):
+        response = self.client.post('/api/chat/stream/', {
+            'message': message, 'subject_id': self.subject.id, 'chapter_id': 2,
+        }, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def saved_answers(self):
+        return list(ChatMessage.objects.filter(role='ai').values_list('message', flat=True))
+
+    def test_ndjson_deltas(self):
+        self.backend.session.post.return_value = streamed_reply([{'delta': 'An acid '}, {'delta': 'donates protons.'}])
+        self.assertEqual(self.stream(), [
+            {'type': 'delta', 'text': 'An acid '},
+            {'type': 'delta', 'text': 'donates protons.'},
+            {'type': 'done', 'success': True, 'source': 'rag_model'},
+        ])
+        self.assertEqual(self.saved_answers(), ['An acid donates protons.'])
+
+    def test_single_json_reply(self):
+        self.backend.session.post.return_value = streamed_reply(body={'success': True, 'response': 'An acid donates protons.'})
+        self.assertEqual(self.stream(), [
+            {'type': 'delta', 'text': 'An acid donates protons.'},
+            {'type': 'done', 'success': True, 'source': 'rag_model'},
+        ])
+        self.assertEqual(self.saved_answers(), ['An acid donates protons.'])
+
+    def test_empty_answer_falls_back_to_gemini(self):
+        self.backend.session.post.return_value = streamed_reply(body={'success': True, 'response': ''})
+        with mock.patch.object(views, 'stream_gemini_response', return_value=iter(['An acid donates protons.'])):
+            events = self.stream()
+        self.assertEqual(events, [
+            {'type': 'delta', 'text': 'An acid donates protons.'},
+            {'type': 'done', 'success': True, 'source': 'gemini_fallback'},
+        ])
+        self.assertEqual(self.saved_answers(), ['An acid donates protons.'])
+
+
+@override_settings(ROOT_URLCONF='tutor.tests', TUTOR_ANSWER_CACHE_ENABLED=False, TUTOR_RATELIMIT_ENABLED=False)
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'password')
+        StudentProfile.objects.create(user=self.user, standard='10th', standard_selected=True)
+        self.subject = Subject.objects.create(name='Science')
+        self.async_client.force_login(self.user)
+
+    async def ask(self, message='What is an acid?'):
+        return await self.async_client.post('/api/chat/', {
+            'message': message, 'subject_id': self.subject.id, 'chapter_id': 2,
+        }, content_type='application/json')
+
+    async def saved(self):
+        return [message async for message in ChatMessage.objects.order_by('id').values_list('role', 'message')]
+
+    async def test_chat_answers_and_saves_both_turns(self):
+        with mock.patch.object(async_views, 'aget_rag_response', mock.AsyncMock(return_value=('An acid donates protons.', None))):
+            response = await self.ask()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'response': 'An acid donates protons.', 'success': True, 'source': 'rag_model'})
+        self.assertEqual(await self.saved(), [('user', 'What is an acid?'), ('ai', 'An acid donates protons.')])
+
+    async def test_rag_failure_falls_back_to_gemini(self):
+        with mock.patch.object(async_views, 'aget_rag_response', mock.AsyncMock(return_value=(None, "RAG server not available"))), \
+                mock.patch.object(async_views, 'get_gemini_response', mock.AsyncMock(return_value=('An acid donates protons.', None))):
+            response = await self.ask()
+        self.assertEqual(response.json()['source'], 'gemini_fallback')
+        self.assertEqual(await self.saved(), [('user', 'What is an acid?'), ('ai', 'An acid donates protons.')])
+
+    @override_settings(TUTOR_RATELIMIT_ENABLED=True)
+    async def test_refused_question_is_not_saved(self):
+        with mock.patch.object(async_views, 'llm_limiter', busy_llm_limiter(self)):
+            response = await self.ask()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(await self.saved(), [])
+
+    async def test_history_and_subjects(self):
+        await ChatMessage.objects.acreate(user=self.user, subject=self.subject, chapter_index=2, role='user', message='What is an acid?')
+        response = await self.async_client.get('/api/chat/history/', {'subject_id': self.subject.id, 'chapter_id': 2})
+        self.assertEqual([message['message'] for message in response.json()['history']], ['What is an acid?'])
+
+        response = await self.async_client.get('/api/subjects/')
+        self.assertEqual(response.json(), {'subjects': [{'id': self.subject.id, 'name': 'Science'}]})
+
+
+class ChaptersViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'password')
+        StudentProfile.objects.create(user=self.user, standard='9th', standard_selected=True)
+        self.client.force_login(self.user)
+
+    def test_chapter_listing_costs_no_queries(self):
+        subject = Subject.objects.create(name='Science')
+        Chapter.objects.create(subject=subject, title='Matter in Our Surroundings', standard='9th', order=1)
+        Chapter.objects.create(subject=subject, title='Is Matter Around Us Pure?', standard='9th', order=2)
+        Chapter.objects.create(subject=subject, title='Chemical Reactions and Equations', standard='10th', order=1)
+
+        self.client.get(f'/api/chapters/{subject.id}/')
+        # session + user; profile and chapters come from the session snapshot and the catalogue
+        with self.assertNumQueries(2):
+            chapters = self.client.get(f'/api/chapters/{subject.id}/').json()
+        self.assertEqual([chapter['title'] for chapter in chapters], [
+            'Chapter 1 Matter in Our Surroundings',
+            'Chapter 2 Is Matter Around Us Pure?',
+        ])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'password')
+        StudentProfile.objects.create(user=self.user, standard='9th', standard_selected=True)
+        self.subject = Subject.objects.create(name='Science')
+        Chapter.objects.create(subject=self.subject, title='Matter in Our Surroundings', standard='9th', order=1)
+        ChatMessage.objects.create(user=self.user, subject=self.subject, chapter_index=1, role='user', message='What is matter?')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        self.history = {'subject_id': self.subject.id, 'chapter_id': 1}
+
+    def revalidate(self, path, params=None):
+        """The ETag of a first GET, after checking that sending it back gets a 304"""
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(path, params, headers={'if-none-match': etag}).status_code, 304)
+        return etag
+
+    def test_sync_views_answer_304(self):
+        self.revalidate('/api/subjects/')
+        self.revalidate(f'/api/chapters/{self.subject.id}/')
+        self.revalidate('/api/chat/history/', self.history)
+
+    @override_settings(ROOT_URLCONF='tutor.tests')
+    async def test_async_views_answer_304(self):
+        for url, params in (('/api/subjects/', None), ('/api/chat/history/', self.history)):
+            response = await self.async_client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            revalidated = await self.async_client.get(url, params, headers={'if-none-match': response.headers['ETag']})
+            self.assertEqual(revalidated.status_code, 304)
+
+    def test_etags_change_with_new_data(self):
+        subjects = self.revalidate('/api/subjects/')
+        chapters = self.revalidate(f'/api/chapters/{self.subject.id}/')
+        history = self.revalidate('/api/chat/history/', self.history)
+
+        Chapter.objects.create(subject=self.subject, title='Is Matter Around Us Pure?', standard='9th', order=2)
+        ChatMessage.objects.create(user=self.user, subject=self.subject, chapter_index=1, role='ai', message='Anything with mass.')
+
+        self.assertNotEqual(self.revalidate('/api/subjects/'), subjects)
+        self.assertNotEqual(self.revalidate(f'/api/chapters/{self.subject.id}/'), chapters)
+        self.assertNotEqual(self.revalidate('/api/chat/history/', self.history), history)
+
+
+class FollowUpTests(SimpleTestCase):
+    def test_standalone_questions(self):
+        for question in ('What is a redox reaction?', 'Explain Ohm\'s law with an example', 'Why is the sky blue?'):
+            self.assertFalse(is_follow_up(question), question)
+
+    def test_follow_ups(self):
+        for question in ('Why?', 'Explain that again', 'Can you give one more example?',
+                         'And for bases?', 'What about metals and non-metals?', 'Is it always true?'):
+            self.assertTrue(is_follow_up(question), question)
+
+
+class RateLimitTests(TestCase):
+    def test_429_with_retry_after(self):
+        user = User.objects.create_user('student', 'student@example.com', 'password')
+        StudentProfile.objects.create(user=user, standard='10th', standard_selected=True)
+        self.client.force_login(user)
+        # Two questions a minute: a token comes back every 30 seconds
+        limiter = RateLimiter(LocalStore(), user_rate=2, user_burst=1, global_rate=600, global_burst=100)
+        answer = mock.Mock(return_value=('An acid donates protons.', 'rag_model', None))
+
+        with mock.patch.object(views, 'rate_limiter', limiter), mock.patch.object(views, 'cached_ai_response', answer):
+            first = self.client.post('/api/chat/', {'message': 'What is an acid?'}, content_type='application/json')
+            second = self.client.post('/api/chat/', {'message': 'What is a base?'}, content_type='application/json')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second['Retry-After'], '30')
+        self.assertEqual(answer.call_count, 1)
+
+    @override_settings(TUTOR_ANSWER_CACHE_ENABLED=False)
+    def test_refused_question_is_not_saved(self):
+        user = User.objects.create_user('student', 'student@example.com', 'password')
+        StudentProfile.objects.create(user=user, standard='10th', standard_selected=True)
+        subject = Subject.objects.create(name='Science')
+        self.client.force_login(user)
+        limiter = busy_llm_limiter(self)
+
+        with mock.patch.object(views, 'llm_limiter', limiter):
+            for url in ('/api/chat/', '/api/chat/stream/'):
+                response = self.client.post(url, {
+                    'message': 'What is an acid?', 'subject_id': subject.id, 'chapter_id': 2,
+                }, content_type='application/json')
+                self.assertEqual(response.status_code, 429, url)
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_queue_timeout(self):
+        limiter = ConcurrencyLimiter(LocalStore(), limit=1, queue_timeout=0.1, max_queue=1)
+        with limiter.acquire():
+            started = time.monotonic()
+            with self.assertRaises(RateLimited) as raised:
+                limiter.acquire()
+            self.assertGreaterEqual(time.monotonic() - started, 0.1)
+            self.assertEqual(raised.exception.retry_after, 1)
+        # Released: the next caller gets the slot straight away
+        limiter.acquire().release()
+
+    def test_waiter_takes_a_released_slot(self):
+        limiter = ConcurrencyLimiter(LocalStore(), limit=1, queue_timeout=2, max_queue=1)
+        slot = limiter.acquire()
+        threading.Timer(0.05, slot.release).start()
+        started = time.monotonic()
+        limiter.acquire().release()
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_full_queue_fails_fast(self):
+        limiter = ConcurrencyLimiter(LocalStore(), limit=1, queue_timeout=2, max_queue=0)
+        with limiter.acquire():
+            started = time.monotonic()
+            with self.assertRaises(RateLimited):
+                limiter.acquire()
+            self.assertLess(time.monotonic() - started, 0.5)
+
+
+class MetricsTests(SimpleTestCase):
+    def registry(self, directory=''):
+        registry = Registry(directory=directory)
+        answers = registry.counter('answers_total', 'Answers by source', ('source',))
+        seconds = registry.histogram('answer_seconds', 'Answer time', buckets=(0.1, 1))
+        return registry, answers, seconds
+
+    def test_render(self):
+        registry, answers, seconds = self.registry()
+        answers.inc(source='cache')
+        answers.inc(2, source='rag_model')
+        seconds.observe(0.05)
+        seconds.observe(0.5)
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP answers_total Answers by source',
+            '# TYPE answers_total counter',
+            'answers_total{source="cache"} 1',
+            'answers_total{source="rag_model"} 2',
+            '# HELP answer_seconds Answer time',
+            '# TYPE answer_seconds histogram',
+            'answer_seconds_bucket{le="0.1"} 1',
+            'answer_seconds_bucket{le="1"} 2',
+            'answer_seconds_bucket{le="+Inf"} 2',
+            'answer_seconds_sum 0.55',
+            'answer_seconds_count 2',
+        ]) + '\n')
+
+    def test_label_escaping(self):
+        registry, answers, _ = self.registry()
+        # A quote, a backslash and a newline
+        answers.inc(source='say "hi"\\\n')
+        self.assertIn(r'answers_total{source="say \"hi\"\\\n"} 1', registry.render())
+
+    def test_sums_every_workers_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        # Other workers' flushed totals; updating a registry with a directory would start its flusher
+        for worker, source in enumerate(('cache', 'rag_model')):
+            registry, answers, seconds = self.registry()
+            answers.inc(source='cache')
+            answers.inc(source=source)
+            seconds.observe(0.5)
+            with open(os.path.join(directory, f'{worker}.json'), 'w') as out:
+                json.dump(registry.snapshot(), out)
+
+        rendered = self.registry(directory)[0].render().splitlines()
+        self.assertIn('answers_total{source="cache"} 3', rendered)
+        self.assertIn('answers_total{source="rag_model"} 1', rendered)
+        self.assertIn('answer_seconds_bucket{le="1"} 2', rendered)
+        self.assertIn('answer_seconds_sum 1.0', rendered)
+
+    def observed(self):
+        counts, _ = metrics.request_seconds.values.get(('unresolved', '200'), ([0], 0.0))
+        return sum(counts)
+
+    def test_stream_is_timed_to_its_end(self):
+        before = self.observed()
+        response = metrics_middleware(lambda request: StreamingHttpResponse(iter(['a', 'b'])))(RequestFactory().get('/'))
+        self.assertEqual(self.observed(), before)
+        self.assertEqual(b''.join(response.streaming_content), b'ab')
+        self.assertEqual(self.observed(), before + 1)
+
+    async def test_async_stream_is_timed_to_its_end(self):
+        async def chunks():
+            yield 'a'
+            yield 'b'
+
+        async def view(request):
+            return StreamingHttpResponse(chunks())
+
+        before = self.observed()
+        response = await metrics_middleware(view)(RequestFactory().get('/'))
+        self.assertEqual(self.observed(), before)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'ab')
+        self.assertEqual(self.observed(), before + 1)
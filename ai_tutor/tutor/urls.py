@@ -1,10 +1,19 @@
 # tutor/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
+chat_views = views
+if settings.TUTOR_ASYNC_VIEWS:
+    # Non-blocking chat, history and subjects views for ASGI deployments
+    from . import async_views as chat_views
+
 urlpatterns = [
-    path('subjects/', views.subjects_view, name='subjects'),
+    path('subjects/', chat_views.subjects_view, name='subjects'),
     path('chapters/<int:subject_id>/', views.chapters_view, name='chapters'),
-    path('chat/', views.chat_view, name='chat'),
-    path('chat/history/', views.get_chat_history, name='chat_history'),
+    path('chat/', chat_views.chat_view, name='chat'),
+    path('chat/stream/', views.chat_stream_view, name='chat_stream'),
+    path('chat/history/', chat_views.get_chat_history, name='chat_history'),
+    path('chat/cache-stats/', views.answer_cache_stats_view, name='answer_cache_stats'),
+    path('chat/coalescing-stats/', views.coalescing_stats_view, name='coalescing_stats'),
 ]
\ No newline at end of file
@@ -1,29 +1,41 @@
 # tutor/views.py
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_GET, require_http_methods
+import hmac
 import json
-import requests
-import google.generativeai as genai
-import os
 import logging
-from .models import Subject, ChatMessage
+import time
+from accounts.models import StudentProfile
+from accounts.profile_cache import get_profile
+from .models import ChatMessage
+from .answer_cache import answer_cache, chapter_cache_key, normalise_question, question_hash
+from .catalogue import chapter_catalogue, normalise_standard
+from .context import build_context, format_context, is_follow_up
+from .conditional import chapters_etag, conditional, history_etag, subjects_etag
+from .gemini import gemini_registry
+from .hedging import hedge_deadline, race_with_hedge
+from .history import fetch_history_page, parse_page
+from .metrics import (
+    answer_cache_lookups, chat_answers, chat_seconds, failure_reason, registry, timed,
+    upstream_errors, upstream_seconds,
+)
+from .ratelimit import RateLimited, llm_limiter, rate_limiter
+from .rag import get_rag_response, rag_latency, stream_rag_response
+from .singleflight import single_flight
+from .write_behind import chat_writer
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def list_available_gemini_models():
-    """List available Gemini models for debugging"""
-    try:
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
-            return []
-        genai.configure(api_key=api_key)
-        models = genai.list_models()
-        return [model.name for model in models if 'generateContent' in model.supported_generation_methods]
-    except Exception as e:
-        logger.error(f"Error listing available models: {str(e)}")
-        return []
+# Response `source` for each outcome of a hedged RAG / Gemini race
+HEDGE_SOURCES = {
+    'primary': 'rag_model',
+    'hedge': 'gemini_hedge',
+    'fallback': 'gemini_fallback',
+}
 
 def ajax_login_required(func):
     def wrapper(request, *args, **kwargs):
@@ -32,366 +44,535 @@ def ajax_login_required(func):
         return func(request, *args, **kwargs)
     return wrapper
 
-def get_gemini_response(user_message, chapter_id=None):
+def build_tutor_prompt(user_message, topic=None, context=None):
+    """Build the educational prompt sent to Gemini"""
+    # Create context-aware prompt for educational content
+    system_prompt = """You are an AI tutor helping students with their studies.
+    Provide clear, educational explanations appropriate for high school students.
+    Focus on helping students understand concepts rather than just giving answers.
+    If asked about specific chapters, relate your response to standard curriculum topics."""
+
+    # Add chapter context if available
+    chapter_context = ""
+    if topic:
+        logger.info("Adding chapter context: %s", topic)
+        chapter_context = f"This question is related to the chapter: {topic}. "
+
+    # Earlier turns, so follow-up questions can be understood
+    conversation = format_context(context)
+    if conversation:
+        conversation += "\n\n"
+
+    return f"{system_prompt}\n\n{chapter_context}{conversation}Student question: {user_message}"
+
+def student_standard(request):
+    """The standard the student selected, or None"""
+    try:
+        return get_profile(request).standard
+    except StudentProfile.DoesNotExist:
+        return None
+
+def get_gemini_response(user_message, topic=None, context=None):
     """Generate response using Gemini API"""
     try:
-        logger.info(f"Starting Gemini API request for message: {user_message[:50]}...")
+        logger.info("Starting Gemini API request for message: %s...", user_message[:50])
 
-        # Configure Gemini (you'll need to set GOOGLE_API_KEY environment variable)
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
-            logger.error("GOOGLE_API_KEY environment variable not set")
-            return None, "Gemini API key not configured"
+        with timed('gemini', 'init'):
+            models, init_error = gemini_registry.candidates()
+        if not models:
+            upstream_errors.inc(upstream='gemini', reason='init')
+            return None, init_error
 
-        logger.info("API key found, configuring Gemini...")
-        genai.configure(api_key=api_key)
+        with timed('gemini', 'prompt'):
+            full_prompt = build_tutor_prompt(user_message, topic, context)
+        logger.info("Sending request to Gemini API...")
 
-        try:
-            # Try latest models, fallback to alternatives if needed
-            # Order: newest to oldest, most reliable first
-            model_names = ['gemini-2.0-flash-exp', 'gemini-2.0-flash', 'gemini-1.5-pro']
-            model = None
-            model_name = None
+        api_error = None
+        for model_name, model in models:
+            started = time.perf_counter()
+            try:
+                with timed('gemini', 'generate'):
+                    response = model.generate_content(full_prompt)
+                if response and hasattr(response, 'text') and response.text:
+                    logger.info("Gemini API response received successfully from %s", model_name)
+                    upstream_seconds.observe(time.perf_counter() - started, upstream='gemini', outcome='ok')
+                    gemini_registry.mark_working(model_name)
+                    return response.text, None
+                else:
+                    logger.error("Gemini API returned empty or invalid response")
+                    upstream_errors.inc(upstream='gemini', reason='empty')
+                    return None, "Gemini API returned empty response"
+            except Exception as e:
+                # Try the next model in the chain
+                logger.error("Gemini API call failed on %s: %s", model_name, e)
+                upstream_seconds.observe(time.perf_counter() - started, upstream='gemini', outcome='error')
+                upstream_errors.inc(upstream='gemini', reason=failure_reason(e))
+                api_error = f"Gemini API call error: {str(e)}"
 
-            for model_name in model_names:
-                try:
-                    model = genai.GenerativeModel(model_name)
-                    logger.info(f"Gemini model {model_name} initialized successfully")
-                    break
-                except Exception as e:
-                    logger.warning(f"Failed to initialize {model_name}: {str(e)}")
-                    continue
+        return None, api_error
 
-            if not model:
-                # List available models for debugging
-                available_models = list_available_gemini_models()
-                error_msg = f"Failed to initialize any Gemini model. Tried: {', '.join(model_names)}"
-                if available_models:
-                    error_msg += f". Available models: {', '.join(available_models)}"
-                logger.error(error_msg)
-                return None, error_msg
-        except Exception as config_error:
-            logger.error(f"Error configuring Gemini: {str(config_error)}")
-            return None, f"Gemini configuration error: {str(config_error)}"
-
-        # Create context-aware prompt for educational content
-        system_prompt = """You are an AI tutor helping students with their studies.
-        Provide clear, educational explanations appropriate for high school students.
-        Focus on helping students understand concepts rather than just giving answers.
-        If asked about specific chapters, relate your response to standard curriculum topics."""
-
-        # Add chapter context if available
-        chapter_context = ""
-        if chapter_id:
-            logger.info(f"Adding chapter context for chapter_id: {chapter_id}")
-            # Map chapter IDs to topics (based on the science chapters from the view)
-            science_chapters = {
-                1: 'Chemical Reactions and Equations',
-                2: 'Acids, Bases and Salts',
-                3: 'Metals and Non-metals',
-                4: 'Carbon and its Compounds',
-                5: 'Life Processes',
-                6: 'Control and Coordination',
-                7: 'How do Organisms Reproduce?',
-                8: 'Heredity',
-                9: 'Light – Reflection and Refraction',
-                10: 'The Human Eye and the Colourful World',
-                11: 'Electricity',
-                12: 'Magnetic Effects of Electric Current',
-                13: 'Our Environment'
-            }
-
-            chapter_topic = science_chapters.get(chapter_id, "General Science")
-            chapter_context = f"This question is related to the chapter: {chapter_topic}. "
-
-        full_prompt = f"{system_prompt}\n\n{chapter_context}Student question: {user_message}"
-        logger.info("Sending request to Gemini API...")
+    except Exception as e:
+        logger.error("Unexpected error in get_gemini_response: %s", e)
+        return None, f"Gemini error: {str(e)}"
 
-        try:
-            response = model.generate_content(full_prompt)
-            if response and hasattr(response, 'text') and response.text:
-                logger.info("Gemini API response received successfully")
-                return response.text, None
-            else:
-                logger.error("Gemini API returned empty or invalid response")
-                return None, "Gemini API returned empty response"
-        except Exception as api_error:
-            logger.error(f"Gemini API call failed: {str(api_error)}")
-            return None, f"Gemini API call error: {str(api_error)}"
+def stream_gemini_response(user_message, topic=None, context=None):
+    """Yield Gemini response text chunks as they are generated"""
+    logger.info("Starting Gemini streaming request for message: %s...", user_message[:50])
+
+    models, init_error = gemini_registry.candidates()
+    if not models:
+        raise RuntimeError(init_error)
 
+    full_prompt = build_tutor_prompt(user_message, topic, context)
+    api_error = None
+    for model_name, model in models:
+        started = False
+        try:
+            for chunk in model.generate_content(full_prompt, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. safety metadata) carry nothing to show
+                    continue
+                if text:
+                    started = True
+                    yield text
+        except Exception as e:
+            if started:
+                raise
+            logger.error("Gemini streaming call failed on %s: %s", model_name, e)
+            api_error = e
+            continue
+        gemini_registry.mark_working(model_name)
+        return
+
+    raise RuntimeError(f"Gemini API call error: {str(api_error)}")
+
+def save_chat_message(user, subject_id, chapter_id, role, message):
+    """Persist one chat turn, logging instead of failing the request"""
+    if not (subject_id and chapter_id):
+        return
+    try:
+        if settings.TUTOR_WRITE_BEHIND_ENABLED:
+            chat_writer.enqueue(user.id, subject_id, chapter_id, role, message, timezone.now())
+            return
+        ChatMessage.objects.create(
+            user=user,
+            subject_id=subject_id,
+            chapter_index=chapter_id,
+            role=role,
+            message=message
+        )
     except Exception as e:
-        logger.error(f"Unexpected error in get_gemini_response: {str(e)}")
-        return None, f"Gemini error: {str(e)}"
+        logger.error("Failed to save %s message: %s", role, e)
+
+def generate_ai_response(user_message, chapter_id=None, topic=None, context=None, subject=None, standard=None):
+    """Answer from RAG, falling back to (or hedging with) Gemini
+
+    Returns (response, source, error).
+    """
+    if settings.TUTOR_HEDGE_ENABLED:
+        # Race Gemini against RAG once RAG is slower than the hedge deadline
+        deadline = hedge_deadline(rag_latency, settings.TUTOR_HEDGE_DEADLINE)
+        (ai_response, ai_error), winner = race_with_hedge(
+            lambda: get_rag_response(user_message, chapter_id, context, subject, standard),
+            lambda: get_gemini_response(user_message, topic, context),
+            deadline
+        )
+        if ai_response:
+            logger.info("Hedged request answered by %s", HEDGE_SOURCES[winner])
+            return ai_response, HEDGE_SOURCES[winner], None
+        return None, None, ai_error
+
+    # Primary: Try RAG server first (skipped instantly while its circuit is open)
+    ai_response, rag_error = get_rag_response(user_message, chapter_id, context, subject, standard)
+    if ai_response:
+        logger.info("Successfully received response from RAG server")
+        return ai_response, 'rag_model', None
+
+    logger.warning("%s, falling back to Gemini...", rag_error)
+
+    # Fallback: Use Gemini when fine-tuned model is not available
+    logger.info("Using Gemini as fallback...")
+    gemini_response, gemini_error = get_gemini_response(user_message, topic, context)
+    if gemini_response:
+        logger.info("Successfully generated response using Gemini fallback")
+        return gemini_response, 'gemini_fallback', None
+
+    return None, None, gemini_error
+
+def admitted_ai_response(user_message, chapter_id=None, topic=None, context=None, subject=None, standard=None):
+    """generate_ai_response within the outbound LLM concurrency limit"""
+    if not settings.TUTOR_RATELIMIT_ENABLED:
+        return generate_ai_response(user_message, chapter_id, topic, context, subject, standard)
+    with llm_limiter.acquire():
+        return generate_ai_response(user_message, chapter_id, topic, context, subject, standard)
+
+def rate_limited_response(error):
+    response = JsonResponse({'error': str(error), 'success': False}, status=429)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+def conversation_context(user, subject_id, chapter_id, user_message):
+    """Recent turns and summary to send with a follow-up question, or None
+
+    Standalone questions go without context, so they can be answered from
+    the answer cache and coalesced with other students' identical questions.
+    """
+    if not (settings.TUTOR_CONTEXT_ENABLED and subject_id and chapter_id):
+        return None
+    if not is_follow_up(user_message):
+        return None
+    try:
+        return build_context(user.id, subject_id, chapter_id)
+    except Exception as e:
+        logger.error("Failed to build conversation context: %s", e)
+        return None
+
+def rag_scope(subject_id, standard):
+    """subject and standard keyword arguments of the RAG calls"""
+    return {
+        'subject': chapter_catalogue.subject_name(subject_id),
+        'standard': normalise_standard(standard) or None,
+    }
+
+def coalescing_key(cache_key, user_message):
+    return question_hash(f"{cache_key}|{normalise_question(user_message)}")
+
+def cached_ai_response(user_message, subject_id, chapter_id, standard=None, context=None):
+    """generate_ai_response behind the answer cache and request coalescing
+
+    Cached answers have source 'cache'. Concurrent identical questions about
+    the same chapter share one upstream call.
+    """
+    topic = chapter_catalogue.topic(subject_id, standard, chapter_id)
+    # Lets RAG search only the student's own syllabus
+    scope = rag_scope(subject_id, standard)
+    if context:
+        # Follow-ups depend on the conversation, so they are neither cached nor coalesced
+        return admitted_ai_response(user_message, chapter_id, topic, context, **scope)
+
+    cache_key = chapter_cache_key(subject_id, chapter_id, standard)
+    if settings.TUTOR_ANSWER_CACHE_ENABLED:
+        with timed('chat', 'cache_lookup'):
+            cached = answer_cache.get(cache_key, user_message)
+        answer_cache_lookups.inc(result='hit' if cached else 'miss')
+        if cached:
+            logger.info("Answer cache hit for chapter %s", cache_key)
+            return cached[0], 'cache', None
+
+    coalesced = False
+    if settings.TUTOR_SINGLEFLIGHT_ENABLED:
+        (ai_response, source, ai_error), coalesced = single_flight.do(
+            coalescing_key(cache_key, user_message),
+            lambda: admitted_ai_response(user_message, chapter_id, topic, **scope)
+        )
+        if coalesced:
+            logger.info("Coalesced chat request onto in-flight call for chapter %s", cache_key)
+    else:
+        ai_response, source, ai_error = admitted_ai_response(user_message, chapter_id, topic, **scope)
+
+    # Only the caller that made the upstream request fills the cache
+    if ai_response and not coalesced and settings.TUTOR_ANSWER_CACHE_ENABLED:
+        answer_cache.set(cache_key, user_message, ai_response, source)
+    return ai_response, source, ai_error
 
 @ajax_login_required
+@conditional(subjects_etag)
 def subjects_view(request):
-    subjects = Subject.objects.all()
     subjects_data = [
         {
-            'id': subject.id,
-            'name': subject.name
+            'id': subject_id,
+            'name': name
         }
-        for subject in subjects
+        for subject_id, name in chapter_catalogue.subjects()
     ]
     return JsonResponse({'subjects': subjects_data})
 
 @ajax_login_required
+@conditional(chapters_etag)
 def chapters_view(request, subject_id):
     try:
-        from accounts.models import StudentProfile
-        profile = StudentProfile.objects.get(user=request.user)
-        # Identify subject
-        subject = Subject.objects.get(id=subject_id)
+        with timed('chapters', 'profile'):
+            profile = get_profile(request)
 
         if not profile.standard_selected:
             return JsonResponse({'error': 'Standard not selected'}, status=400)
 
         standard = profile.standard
-
-        # Add debug logging
-        logger.info(f"chapters_view - subject_id: {subject_id}, subject.name: {subject.name}, standard: {standard}, standard_selected: {profile.standard_selected}")
-
         if not standard or not str(standard).strip():
-            logger.warning(f"chapters_view - standard is None or empty for user: {request.user}")
+            logger.warning("chapters_view - standard is None or empty for user: %s", request.user)
             return JsonResponse({'error': 'Standard not set'}, status=400)
 
-        # Hard-coded 10th Science chapters; accept minor naming variants
-        normalized_subject = subject.name.replace(' ', '').lower()
-        is_science = 'science' in normalized_subject
-
-        # Check if standard is 10th - handle both '10th' and '10' formats
-        standard_str = str(standard).strip().lower()
-        is_10th = standard_str.startswith('10')
-
-        logger.info(f"chapters_view - normalized_subject: {normalized_subject}, is_science: {is_science}, standard_str: {standard_str}, is_10th: {is_10th}")
-
-        if is_science and is_10th:
-            science_chapters = [
-                'Chemical Reactions and Equations',
-                'Acids, Bases and Salts',
-                'Metals and Non-metals',
-                'Carbon and its Compounds',
-                'Life Processes',
-                'Control and Coordination',
-                'How do Organisms Reproduce?',
-                'Heredity',
-                'Light – Reflection and Refraction',
-                'The Human Eye and the Colourful World',
-                'Electricity',
-                'Magnetic Effects of Electric Current',
-                'Our Environment'
-            ]
+        # Served from the in-memory catalogue: no queries per listing
+        with timed('chapters', 'catalogue'):
+            if chapter_catalogue.subject_name(subject_id) is None:
+                return JsonResponse({'error': 'Subject not found'}, status=404)
+            chapters = chapter_catalogue.chapters(subject_id, standard)
 
+        with timed('chapters', 'serialise'):
             chapters_data = [
                 {
-                    'id': index + 1,  # synthetic id
-                    'title': f"Chapter {index + 1} {title}",
-                    'order': index + 1,
+                    'id': order,  # chat messages refer to chapters by order
+                    'title': f"Chapter {order} {title}",
+                    'order': order,
                     'subject_id': subject_id
                 }
-                for index, title in enumerate(science_chapters)
+                for order, title in chapters
             ]
             return JsonResponse(chapters_data, safe=False)
 
-        # For any other subject or standard, return empty list for now
-        return JsonResponse([], safe=False)
-
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 @ajax_login_required
+@conditional(history_etag)
 def get_chat_history(request):
-    try:
-        subject_id = request.GET.get('subject_id')
-        chapter_id = request.GET.get('chapter_id')
-        
-        if not subject_id or not chapter_id:
-            return JsonResponse({'error': 'Missing subject_id or chapter_id'}, status=400)
-            
-        messages = ChatMessage.objects.filter(
-            user=request.user,
-            subject_id=subject_id,
-            chapter_index=chapter_id
-        ).order_by('created_at')
-        
-        history = [
-            {
-                'role': msg.role,
-                'message': msg.message,
-                'created_at': msg.created_at.isoformat()
-            }
-            for msg in messages
-        ]
-        
-        return JsonResponse({'history': history})
-    except Exception as e:
-        logger.error(f"Error fetching chat history: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=500)
+    """A conversation's messages, oldest first
 
-@csrf_exempt
-@require_http_methods(["POST"])
-@ajax_login_required
-def chat_view(request):
+    The whole conversation unless ?limit= or ?before= is given: then one page
+    of the newest `limit` messages, and ?before=<next_cursor> scrolls further back.
+    """
     try:
         subject_id = request.GET.get('subject_id')
         chapter_id = request.GET.get('chapter_id')
         
         if not subject_id or not chapter_id:
             return JsonResponse({'error': 'Missing subject_id or chapter_id'}, status=400)
-            
-        messages = ChatMessage.objects.filter(
-            user=request.user,
-            subject_id=subject_id,
-            chapter_index=chapter_id
-        ).order_by('created_at')
-        
-        history = [
-            {
-                'role': msg.role,
-                'message': msg.message,
-                'created_at': msg.created_at.isoformat()
-            }
-            for msg in messages
-        ]
-        
-        return JsonResponse({'history': history})
+
+        try:
+            limit, before = parse_page(request.GET)
+            with timed('history', 'query'):
+                history, next_cursor = fetch_history_page(
+                    request.user.id, subject_id, chapter_id,
+                    limit=limit, before=before
+                )
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        with timed('history', 'serialise'):
+            return JsonResponse({
+                'history': history,
+                'has_more': next_cursor is not None,
+                'next_cursor': next_cursor
+            })
     except Exception as e:
-        logger.error(f"Error fetching chat history: {str(e)}")
+        logger.error("Error fetching chat history: %s", e)
         return JsonResponse({'error': str(e)}, status=500)
 
 @csrf_exempt
 @require_http_methods(["POST"])
 @ajax_login_required
 def chat_view(request):
+    started = time.perf_counter()
     try:
-        logger.info(f"Chat request received from user: {request.user}")
+        logger.info("Chat request received from user: %s", request.user)
 
         # Parse request body
         try:
-            data = json.loads(request.body)
+            with timed('chat', 'parse'):
+                data = json.loads(request.body)
         except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON in request body: {str(e)}")
+            logger.error("Invalid JSON in request body: %s", e)
             return JsonResponse({'error': 'Invalid JSON format'}, status=400)
 
         user_message = data.get('message', '').strip()
         chapter_id = data.get('chapter_id')
         subject_id = data.get('subject_id') # New field
 
-        logger.info(f"Processing message: {user_message[:50]}..., chapter_id: {chapter_id}, subject_id: {subject_id}")
+        logger.info("Processing message: %s..., chapter_id: %s, subject_id: %s", user_message[:50], chapter_id, subject_id)
 
         if not user_message:
             logger.warning("Empty message received")
             return JsonResponse({'error': 'Message is required'}, status=400)
 
-        # Save User Message
-        if subject_id and chapter_id:
-            try:
-                ChatMessage.objects.create(
-                    user=request.user,
-                    subject_id=subject_id,
-                    chapter_index=chapter_id,
-                    role='user',
-                    message=user_message
-                )
-            except Exception as e:
-                logger.error(f"Failed to save user message: {e}")
+        if settings.TUTOR_RATELIMIT_ENABLED:
+            with timed('chat', 'ratelimit'):
+                rate_limiter.check(request.user.id)
 
-        # Primary: Try RAG server first
-        rag_server_url = "http://127.0.0.1:5002/generate"
+        # Context is read before this question joins the history
+        with timed('chat', 'context'):
+            context = conversation_context(request.user, subject_id, chapter_id, user_message)
 
-        try:
-            # Prepare payload for RAG server
-            payload = {
-                'message': user_message,
-                'chapter_id': chapter_id
-            }
-
-            logger.info("Attempting connection to RAG server...")
-
-            # Send POST request to RAG server
-            response = requests.post(
-                rag_server_url,
-                json=payload,
-                timeout=120  # Wait 2 minutes before falling back to Gemini
+        with timed('chat', 'answer'):
+            ai_response, source, ai_error = cached_ai_response(
+                user_message, subject_id, chapter_id, student_standard(request), context
             )
 
-            logger.info(f"RAG server response status: {response.status_code}")
-
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('success'):
-                    ai_response = data.get('response')
-                    logger.info("Successfully received response from RAG server")
-                    
-                    # Save AI Response
-                    if subject_id and chapter_id:
-                        try:
-                            ChatMessage.objects.create(
-                                user=request.user,
-                                subject_id=subject_id,
-                                chapter_index=chapter_id,
-                                role='ai',
-                                message=ai_response
-                            )
-                        except Exception as e:
-                            logger.error(f"Failed to save AI message: {e}")
-
-                    return JsonResponse({
-                        'response': ai_response,
-                        'success': True,
-                        'source': 'rag_model'
-                    })
-                else:
-                    logger.warning(f"RAG server returned error: {data.get('error')}")
-                    # Fallback to Gemini
-                    pass
-            else:
-                logger.warning(f'RAG server error: {response.status_code}')
-                # Fallback to Gemini
-                pass
-
-        except requests.exceptions.ConnectionError:
-            logger.warning("RAG server not available, falling back to Gemini...")
-        except requests.exceptions.Timeout:
-            logger.warning("RAG server timed out, falling back to Gemini...")
-        except Exception as model_error:
-            logger.warning(f"RAG server error: {str(model_error)}, falling back to Gemini...")
-
-        # Fallback: Use Gemini when fine-tuned model is not available
-        logger.info("Using Gemini as fallback...")
-        gemini_response, gemini_error = get_gemini_response(user_message, chapter_id)
-
-        if gemini_response:
-            logger.info("Successfully generated response using Gemini fallback")
-            
-            # Save AI Response (Gemini)
-            if subject_id and chapter_id:
-                try:
-                    ChatMessage.objects.create(
-                        user=request.user,
-                        subject_id=subject_id,
-                        chapter_index=chapter_id,
-                        role='ai',
-                        message=gemini_response
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to save AI message: {e}")
-
-            return JsonResponse({
-                'response': gemini_response,
-                'success': True,
-                'source': 'gemini_fallback'
-            })
+        # Save User Message, once an upstream call slot was granted; a 429 saves nothing
+        with timed('chat', 'save_user'):
+            save_chat_message(request.user, subject_id, chapter_id, 'user', user_message)
+        chat_answers.inc(source=source or 'error')
+        chat_seconds.observe(time.perf_counter() - started, source=source or 'error')
+
+        if ai_response:
+            # Save AI Response
+            with timed('chat', 'save_ai'):
+                save_chat_message(request.user, subject_id, chapter_id, 'ai', ai_response)
+
+            with timed('chat', 'serialise'):
+                return JsonResponse({
+                    'response': ai_response,
+                    'success': True,
+                    'source': source
+                })
         else:
-            logger.error(f"Both fine-tuned model and Gemini failed. Gemini error: {gemini_error}")
+            logger.error("Both fine-tuned model and Gemini failed. Gemini error: %s", ai_error)
             return JsonResponse({
-                'error': f'Both fine-tuned model and Gemini failed. Gemini error: {gemini_error}',
+                'error': f'Both fine-tuned model and Gemini failed. Gemini error: {ai_error}',
                 'success': False
             }, status=500)
 
+    except RateLimited as e:
+        logger.warning("Rejected chat request from user %s: %s", request.user, e)
+        return rate_limited_response(e)
     except Exception as e:
-        logger.error(f"Unexpected error in chat_view: {str(e)}", exc_info=True)
+        logger.error("Unexpected error in chat_view: %s", e, exc_info=True)
         return JsonResponse({
             'error': f'Internal server error: {str(e)}',
             'success': False
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+def _ndjson(event):
+    return json.dumps(event) + '\n'
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@ajax_login_required
+def chat_stream_view(request):
+    """Stream the tutor reply as NDJSON events instead of one JSON body
+
+    Emits {"type": "delta", "text": ...} for each chunk, then a final
+    {"type": "done", "source": ...} or {"type": "error", "error": ...}.
+    The AI message is saved once the stream has completed.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON in request body: %s", e)
+        return JsonResponse({'error': 'Invalid JSON format'}, status=400)
+
+    user_message = data.get('message', '').strip()
+    chapter_id = data.get('chapter_id')
+    subject_id = data.get('subject_id')
+
+    if not user_message:
+        logger.warning("Empty message received")
+        return JsonResponse({'error': 'Message is required'}, status=400)
+
+    if settings.TUTOR_RATELIMIT_ENABLED:
+        try:
+            rate_limiter.check(request.user.id)
+        except RateLimited as e:
+            return rate_limited_response(e)
+
+    logger.info("Streaming chat request from user: %s, chapter_id: %s, subject_id: %s", request.user, chapter_id, subject_id)
+    context = conversation_context(request.user, subject_id, chapter_id, user_message)
+    user = request.user
+
+    standard = student_standard(request)
+    topic = chapter_catalogue.topic(subject_id, standard, chapter_id)
+    scope = rag_scope(subject_id, standard)
+    cache_key = chapter_cache_key(subject_id, chapter_id, standard)
+    use_cache = settings.TUTOR_ANSWER_CACHE_ENABLED and not context
+    cached = use_cache and answer_cache.get(cache_key, user_message)
+    if use_cache:
+        answer_cache_lookups.inc(result='hit' if cached else 'miss')
+
+    # Hold an upstream call slot for the whole stream; an unread stream's slot lapses with its lease
+    slot = None
+    if not cached and settings.TUTOR_RATELIMIT_ENABLED:
+        try:
+            slot = llm_limiter.acquire()
+        except RateLimited as e:
+            return rate_limited_response(e)
+    # Only an admitted question joins the history, so a retry after a 429 isn't saved twice
+    save_chat_message(user, subject_id, chapter_id, 'user', user_message)
+
+    def event_stream():
+        try:
+            yield from stream_events()
+        finally:
+            if slot:
+                slot.release()
+
+    def stream_events():
+        if cached:
+            save_chat_message(user, subject_id, chapter_id, 'ai', cached[0])
+            yield _ndjson({'type': 'delta', 'text': cached[0]})
+            yield _ndjson({'type': 'done', 'success': True, 'source': 'cache'})
+            return
+
+        sources = [
+            ('rag_model', lambda: stream_rag_response(user_message, chapter_id, context, **scope)),
+            ('gemini_fallback', lambda: stream_gemini_response(user_message, topic, context)),
+        ]
+        last_error = None
+
+        for source, stream in sources:
+            parts = []
+            try:
+                for text in stream():
+                    if not text:
+                        continue
+                    parts.append(text)
+                    yield _ndjson({'type': 'delta', 'text': text})
+            except Exception as e:
+                last_error = str(e)
+                if parts:
+                    # Text already reached the client, so switching source would garble the reply
+                    logger.error("%s stream failed mid-response: %s", source, last_error)
+                    yield _ndjson({'type': 'error', 'error': last_error, 'success': False})
+                    return
+                logger.warning("%s stream unavailable: %s, trying next source...", source, last_error)
+                continue
+
+            ai_response = ''.join(parts)
+            if not ai_response:
+                last_error = f"{source} returned empty response"
+                logger.warning(last_error)
+                continue
+
+            save_chat_message(user, subject_id, chapter_id, 'ai', ai_response)
+            if use_cache:
+                answer_cache.set(cache_key, user_message, ai_response, source)
+            logger.info("Streamed response from %s in %s chunks", source, len(parts))
+            yield _ndjson({'type': 'done', 'success': True, 'source': source})
+            return
+
+        logger.error("Both fine-tuned model and Gemini failed. Last error: %s", last_error)
+        yield _ndjson({
+            'type': 'error',
+            'error': f'Both fine-tuned model and Gemini failed. Last error: {last_error}',
+            'success': False
+        })
+
+    response = StreamingHttpResponse(event_stream(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies (nginx) from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@ajax_login_required
+def answer_cache_stats_view(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+    return JsonResponse(answer_cache.stats())
+
+@ajax_login_required
+def coalescing_stats_view(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+    return JsonResponse(single_flight.stats())
+
+@require_GET
+def metrics_view(request):
+    """Prometheus scrape endpoint for staff, or for TUTOR_METRICS_TOKEN bearers"""
+    token = settings.TUTOR_METRICS_TOKEN
+    bearer = request.headers.get('Authorization', '')
+    authorised = request.user.is_authenticated and request.user.is_staff
+    if token and hmac.compare_digest(bearer, f'Bearer {token}'):
+        authorised = True
+    if not authorised:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
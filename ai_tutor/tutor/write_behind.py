@@ -0,0 +1,241 @@
+# tutor/write_behind.py
+# Write-behind persistence for ChatMessage: requests enqueue messages and a
+# background thread commits them in bulk_create batches, so chat turns don't
+# wait on (or contend for) the database writer lock.
+#
+# Every queued message is also appended to a per-process spill file. Batches
+# rotate the file before committing and delete it afterwards, so messages left
+# behind by a crashed process are replayed on the next start (at-least-once,
+# with duplicates filtered on replay). A batch the database rejects is retried
+# row by row, and rows that still fail go to a dead-letter file
+# (dead-<pid>.jsonl) instead of blocking the messages queued behind them.
+from datetime import datetime
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from .catalogue import chapter_catalogue
+from .models import ChatMessage, Subject
+
+logger = logging.getLogger(__name__)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ChatMessageWriter:
+    def __init__(self, spill_dir, batch_size=100, flush_interval=0.5):
+        self.spill_dir = str(spill_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._flushing = []
+        self._unconfirmed_files = []
+        self._spill = None
+        self._spill_path = None
+        self._rotation = 0
+        self._thread = None
+        self._stopping = False
+        self._cond = threading.Condition()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._replay_orphans()
+            self._open_spill()
+            self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def enqueue(self, user_id, subject_id, chapter_index, role, message, created_at):
+        """Queue one message; raises ValueError for a subject that doesn't exist"""
+        if chapter_catalogue.subject_name(subject_id) is None and not Subject.objects.filter(id=subject_id).exists():
+            raise ValueError(f"Unknown subject: {subject_id}")
+        record = {
+            'user_id': user_id,
+            'subject_id': int(subject_id),
+            'chapter_index': int(chapter_index),
+            'role': role,
+            'message': message,
+            'created_at': created_at,
+        }
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            self._spill.write(json.dumps(dict(record, created_at=created_at.isoformat())) + '\n')
+            self._spill.flush()
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def pending_for(self, user_id, subject_id, chapter_index):
+        """Queued or in-flight messages of one conversation, oldest first"""
+        with self._cond:
+            records = self._flushing + self._pending
+        return [
+            record for record in records
+            if record['user_id'] == user_id
+            and record['subject_id'] == int(subject_id)
+            and record['chapter_index'] == int(chapter_index)
+        ]
+
+    def _open_spill(self):
+        self._spill_path = os.path.join(self.spill_dir, f'chat-{os.getpid()}.jsonl')
+        self._spill = open(self._spill_path, 'a', encoding='utf-8')
+
+    def _rotate_spill(self):
+        # Called with the lock held; returns the file holding the batch being flushed
+        self._spill.close()
+        self._rotation += 1
+        rotated = os.path.join(self.spill_dir, f'chat-{os.getpid()}.{self._rotation}.flushing')
+        os.replace(self._spill_path, rotated)
+        self._open_spill()
+        return rotated
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    if not self._stopping and len(self._pending) < self.batch_size:
+                        self._cond.wait(self.flush_interval)
+                    stopping = self._stopping
+                self.flush()
+                if stopping:
+                    return
+        finally:
+            connection.close()
+
+    def flush(self):
+        with self._cond:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self._flushing = batch
+            self._unconfirmed_files.append(self._rotate_spill())
+
+        try:
+            retry = self._insert(batch)
+        except Exception as e:
+            retry = batch
+            logger.error("Write-behind flush of %s messages failed, will retry: %s", len(batch), e)
+        if retry:
+            with self._cond:
+                self._pending = retry + self._pending
+                self._flushing = []
+            time.sleep(self.flush_interval)
+            return
+
+        with self._cond:
+            self._flushing = []
+            files, self._unconfirmed_files = self._unconfirmed_files, []
+        for path in files:
+            os.remove(path)
+        logger.debug("Write-behind flushed %s messages", len(batch))
+
+    def _insert(self, records):
+        """Commit records; returns the ones to retry later
+
+        Raises if the database can't be written at all. A batch it rejects is
+        committed one row at a time, dead-lettering the rows that fail.
+        """
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create([ChatMessage(**record) for record in records])
+            return []
+        except (IntegrityError, DataError, ValueError, TypeError) as e:
+            logger.warning("Write-behind batch of %s messages rejected, inserting one by one: %s", len(records), e)
+
+        dead = []
+        for position, record in enumerate(records):
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.create(**record)
+            except (IntegrityError, DataError, ValueError, TypeError) as e:
+                dead.append((record, e))
+            except Exception as e:
+                logger.error("Write-behind insert failed, will retry %s messages: %s", len(records) - position, e)
+                self._dead_letter(dead)
+                return records[position:]
+        self._dead_letter(dead)
+        return []
+
+    def _dead_letter(self, failed):
+        if not failed:
+            return
+        path = os.path.join(self.spill_dir, f'dead-{os.getpid()}.jsonl')
+        with open(path, 'a', encoding='utf-8') as dead:
+            for record, error in failed:
+                dead.write(json.dumps(dict(record, created_at=record['created_at'].isoformat(), error=str(error))) + '\n')
+        logger.error("Write-behind dead-lettered %s messages to %s", len(failed), path)
+
+    def stop(self):
+        """Flush everything still queued; registered to run at interpreter exit"""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        thread.join(timeout=30)
+        self.flush()
+
+    def _replay_orphans(self):
+        """Commit spill files left behind by processes that died before flushing"""
+        for name in sorted(os.listdir(self.spill_dir)):
+            if name.startswith('chat-'):
+                owner, original = name[len('chat-'):].split('.')[0], name
+            elif name.startswith('replay-'):
+                # A replay that was itself interrupted
+                _, owner, original = name.split('-', 2)
+            else:
+                continue
+            if not owner.isdigit() or (int(owner) != os.getpid() and _pid_alive(int(owner))):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            claimed = os.path.join(self.spill_dir, f'replay-{os.getpid()}-{original}')
+            try:
+                # Atomic claim, so two starting workers never replay the same file
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            self._replay_file(claimed)
+
+    def _replay_file(self, path):
+        with open(path, encoding='utf-8') as spill:
+            records = [json.loads(line) for line in spill if line.strip()]
+        if not records:
+            os.remove(path)
+            return
+        for record in records:
+            record['created_at'] = datetime.fromisoformat(record['created_at'])
+
+        # The batch may have been committed just before the crash
+        existing = set(ChatMessage.objects.filter(
+            user_id__in={r['user_id'] for r in records},
+            created_at__in={r['created_at'] for r in records}
+        ).values_list('user_id', 'created_at', 'role'))
+        missing = [r for r in records if (r['user_id'], r['created_at'], r['role']) not in existing]
+
+        if self._insert(missing):
+            # Left for the next start to pick up again
+            logger.error("Replaying %s failed; keeping it for the next start", path)
+            return
+        os.remove(path)
+        logger.info("Replayed %s of %s spilled chat messages from %s", len(missing), len(records), path)
+
+chat_writer = ChatMessageWriter(
+    settings.TUTOR_WRITE_BEHIND_SPILL_DIR,
+    batch_size=settings.TUTOR_WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.TUTOR_WRITE_BEHIND_FLUSH_INTERVAL,
+)
@@ -0,0 +1 @@
+"""Offline load tests: fake model server, stub Gemini SDK and a concurrent API driver"""
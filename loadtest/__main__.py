@@ -0,0 +1,149 @@
+# loadtest/__main__.py
+# Offline end-to-end benchmark: starts the fake model server and the Django
+# app (with the stub Gemini SDK) on a scratch database, drives them with
+# concurrent students and writes the JSON report. Nothing leaves the machine,
+# so runs are comparable and can gate performance regressions.
+#
+#   python -m loadtest [--students 20] [--duration 60] [--output report.json]
+#       [--rag-latency lognormal:300:0.5] [--rag-error-rate 0.02] [--rag-timeout-rate 0]
+#       [--gemini-latency lognormal:800:0.4] [--gemini-error-rate 0] [--gemini-timeout-rate 0]
+#       [--server "runserver" | --server "gunicorn ..."] [--env NAME=VALUE ...]
+import argparse
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from .driver import add_driver_arguments, run_load, write_report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DJANGO_DIR = os.path.join(ROOT, 'ai_tutor')
+STUB_DIR = os.path.join(ROOT, 'loadtest', 'stub_genai')
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def wait_until_up(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with {process.returncode} before {url} came up")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test of the tutor against stand-in model backends')
+    add_driver_arguments(parser)
+    parser.add_argument('--rag-latency', default='lognormal:300:0.5', help='fake model server latency spec')
+    parser.add_argument('--rag-error-rate', type=float, default=0.0)
+    parser.add_argument('--rag-timeout-rate', type=float, default=0.0)
+    parser.add_argument('--rag-servers', type=int, default=1, help='fake model servers behind TUTOR_RAG_BACKENDS')
+    parser.add_argument('--gemini-latency', default='lognormal:800:0.4', help='stub Gemini latency spec')
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    parser.add_argument('--gemini-timeout-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-after', type=float, default=30.0, help='seconds an injected timeout hangs')
+    parser.add_argument('--server', default='runserver',
+                        help='"runserver", or a command serving ai_tutor on {port} (e.g. "gunicorn -w 4 -b 127.0.0.1:{port} ai_tutor.wsgi")')
+    parser.add_argument('--ratelimit', action='store_true', help='keep per-student chat rate limits on')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='extra settings for the app')
+    parser.add_argument('--workdir', help='scratch directory for the database and logs (default: a temporary one)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='tutor-loadtest-')
+    os.makedirs(workdir, exist_ok=True)
+    app_port = free_port()
+    rag_ports = [free_port() for _ in range(args.rag_servers)]
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([STUB_DIR, ROOT, os.environ.get('PYTHONPATH', '')]),
+        GOOGLE_API_KEY='loadtest',
+        TUTOR_DB_PROFILE='sqlite_wal',
+        TUTOR_DB_SQLITE_PATH=os.path.join(workdir, 'db.sqlite3'),
+        TUTOR_RAG_BACKENDS=','.join(f'http://127.0.0.1:{port}/generate' for port in rag_ports),
+        TUTOR_RATELIMIT_ENABLED='True' if args.ratelimit else 'False',
+        LOADTEST_GEMINI_LATENCY=args.gemini_latency,
+        LOADTEST_GEMINI_ERROR_RATE=str(args.gemini_error_rate),
+        LOADTEST_GEMINI_TIMEOUT_RATE=str(args.gemini_timeout_rate),
+        LOADTEST_GEMINI_TIMEOUT_AFTER=str(args.timeout_after),
+    )
+    for assignment in args.env:
+        name, _, value = assignment.partition('=')
+        env[name] = value
+
+    manage = [sys.executable, 'manage.py']
+    for command in (['migrate', '--noinput'], ['populate_dummy_data']):
+        subprocess.run(manage + command, cwd=DJANGO_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    if args.server == 'runserver':
+        server = manage + ['runserver', '--noreload', f'127.0.0.1:{app_port}']
+    else:
+        server = shlex.split(args.server.format(port=app_port))
+
+    processes = []
+    try:
+        for port in rag_ports:
+            log = open(os.path.join(workdir, f'model-server-{port}.log'), 'w')
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'loadtest.fake_model_server', '--port', str(port),
+                 '--latency', args.rag_latency, '--error-rate', str(args.rag_error_rate),
+                 '--timeout-rate', str(args.rag_timeout_rate), '--timeout-after', str(args.timeout_after),
+                 '--seed', str(args.seed + port)],
+                cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+            ))
+            wait_until_up(f'http://127.0.0.1:{port}/health', processes[-1])
+        log = open(os.path.join(workdir, 'app.log'), 'w')
+        processes.append(subprocess.Popen(server, cwd=DJANGO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT))
+        base_url = f'http://127.0.0.1:{app_port}'
+        wait_until_up(base_url + '/api/auth/login/', processes[-1])
+
+        report = run_load(
+            base_url, args.students, args.duration, args.journeys, args.think_time,
+            prefix=args.prefix, timeout=args.timeout, seed=args.seed,
+        )
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+    report['config'].update({
+        'server': args.server,
+        'rag': {
+            'servers': args.rag_servers,
+            'latency': args.rag_latency,
+            'error_rate': args.rag_error_rate,
+            'timeout_rate': args.rag_timeout_rate,
+        },
+        'gemini': {
+            'latency': args.gemini_latency,
+            'error_rate': args.gemini_error_rate,
+            'timeout_rate': args.gemini_timeout_rate,
+        },
+        'timeout_after_s': args.timeout_after,
+        'ratelimit': args.ratelimit,
+        'env': args.env,
+        'workdir': workdir,
+    })
+    write_report(report, args.output)
+    if not report['journeys']:
+        sys.exit(f'No journey completed; see the logs in {workdir}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+# loadtest/driver.py
+# Concurrent load driver for the tutor API. Each synthetic student registers
+# (first run only), logs in and then walks the app the way the frontend does:
+# subjects -> chapters of one subject -> history of one chapter -> a chat
+# question, over and over until the run ends. GETs revalidate with the ETag of
+# the previous response like a browser cache, so unchanged listings come
+# back as 304s. Prints throughput and p50/p95/p99 latency per endpoint as JSON.
+#
+#   python -m loadtest.driver --base-url http://127.0.0.1:8000 [--students 20]
+#       [--duration 60 | --journeys 50] [--think-time 0] [--output report.json]
+import argparse
+import collections
+import json
+import random
+import sys
+import threading
+import time
+
+import requests
+
+STANDARDS = ['8th', '9th', '10th']
+QUESTIONS = [
+    'Can you explain the main idea of this chapter?',
+    'What is the difference between {a} and {b}?',
+    'Give me an example of {a} from everyday life.',
+    'Why is {a} important?',
+    'How do I solve a question about {a} step by step?',
+    'Summarise {a} in three points.',
+]
+TOPICS = ['the first section', 'the key formula', 'the definition', 'the diagram', 'the exercise', 'the summary']
+ENDPOINTS = ['register', 'login', 'select_standard', 'subjects', 'chapters', 'history', 'chat']
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+class Recorder:
+    """Latencies and status codes per endpoint, shared by all students"""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+        self.sources = collections.Counter()
+        self.journeys = 0
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][str(status)] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        with self.lock:
+            for endpoint in ENDPOINTS:
+                samples = sorted(self.latencies.get(endpoint, []))
+                if not samples:
+                    continue
+                statuses = dict(self.statuses[endpoint])
+                errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+                endpoints[endpoint] = {
+                    'requests': len(samples),
+                    'errors': errors,
+                    'error_rate': round(errors / len(samples), 4),
+                    'statuses': statuses,
+                    'throughput_rps': round(len(samples) / elapsed, 2),
+                    'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+                    'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+                    'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+                    'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+                    'max_ms': round(samples[-1] * 1000, 2),
+                }
+            total = sum(summary['requests'] for summary in endpoints.values())
+            return {
+                'duration_s': round(elapsed, 2),
+                'requests': total,
+                'errors': sum(summary['errors'] for summary in endpoints.values()),
+                'throughput_rps': round(total / elapsed, 2),
+                'journeys': self.journeys,
+                'journeys_per_s': round(self.journeys / elapsed, 2),
+                'chat_sources': dict(self.sources),
+                'endpoints': endpoints,
+            }
+
+class Student:
+    def __init__(self, number, base_url, recorder, password, prefix, think_time, timeout, seed):
+        self.username = f'{prefix}{number}'
+        self.email = f'{self.username}@loadtest.local'
+        self.standard = STANDARDS[number % len(STANDARDS)]
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.password = password
+        self.think_time = think_time
+        self.timeout = timeout
+        self.rng = random.Random(seed * 100003 + number)
+        self.session = requests.Session()
+        self._cached = {}
+
+    def call(self, endpoint, method, path, **kwargs):
+        """One timed request; returns (status, json body or None)"""
+        url = self.base_url + path
+        headers = {}
+        if method == 'GET' and url in self._cached:
+            headers['If-None-Match'] = self._cached[url][0]
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            status = response.status_code
+            if status == 304:
+                body = self._cached[url][1]
+            else:
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+                if method == 'GET' and status == 200 and response.headers.get('ETag'):
+                    self._cached[url] = (response.headers['ETag'], body)
+        except requests.Timeout:
+            status, body = 'timeout', None
+        except requests.RequestException:
+            status, body = 'connection_error', None
+        self.recorder.record(endpoint, time.perf_counter() - started, status)
+        if self.think_time:
+            time.sleep(self.rng.expovariate(1 / self.think_time))
+        return status, body
+
+    def sign_in(self):
+        """Register if needed and log in; False if the student can't get a session"""
+        status, body = self.call('register', 'POST', '/api/auth/register/', json={
+            'username': self.username, 'email': self.email, 'password': self.password, 'standard': self.standard,
+        })
+        if status not in (201, 400):
+            return False
+        status, body = self.call('login', 'POST', '/api/auth/login/', json={'email': self.email, 'password': self.password})
+        if status != 200:
+            return False
+        if body['user'].get('standard') != self.standard:
+            status, body = self.call('select_standard', 'POST', '/api/auth/select-standard/', json={'standard': self.standard})
+        return status == 200
+
+    def question(self):
+        a, b = self.rng.sample(TOPICS, 2)
+        return self.rng.choice(QUESTIONS).format(a=a, b=b)
+
+    def journey(self):
+        """subjects -> chapters -> history -> chat"""
+        status, body = self.call('subjects', 'GET', '/api/subjects/')
+        if status not in (200, 304) or not body or not body.get('subjects'):
+            return False
+        subject = self.rng.choice(body['subjects'])
+        status, chapters = self.call('chapters', 'GET', f"/api/chapters/{subject['id']}/")
+        if status not in (200, 304) or not chapters:
+            return False
+        chapter = self.rng.choice(chapters)
+        params = f"?subject_id={subject['id']}&chapter_id={chapter['id']}"
+        self.call('history', 'GET', f'/api/chat/history/{params}')
+        status, body = self.call('chat', 'POST', '/api/chat/', json={
+            'message': self.question(), 'subject_id': subject['id'], 'chapter_id': chapter['id'],
+        })
+        with self.recorder.lock:
+            self.recorder.sources[body.get('source') if status == 200 and body else 'failed'] += 1
+            self.recorder.journeys += 1
+        return True
+
+    def run(self, deadline, journeys, stop):
+        try:
+            # Every attempt is recorded; a retry keeps a transient failure from shrinking the load
+            if not any(self.sign_in() for _ in range(3)):
+                return
+            done = 0
+            while not stop.is_set() and time.monotonic() < deadline and (not journeys or done < journeys):
+                self.journey()
+                done += 1
+        finally:
+            self.session.close()
+
+def run_load(base_url, students=20, duration=60.0, journeys=0, think_time=0.0, password='loadtest-password',
+             prefix='loadtest_student_', timeout=60.0, seed=1):
+    """Drive the API with concurrent students and return the report dict"""
+    recorder = Recorder()
+    stop = threading.Event()
+    deadline = time.monotonic() + (duration if not journeys else float('inf'))
+    threads = [
+        threading.Thread(
+            target=Student(n, base_url, recorder, password, prefix, think_time, timeout, seed).run,
+            args=(deadline, journeys, stop), name=f'student-{n}', daemon=True,
+        )
+        for n in range(students)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # Report what was measured so far
+        stop.set()
+        for thread in threads:
+            thread.join(timeout)
+    report = recorder.summary(time.perf_counter() - started)
+    report['config'] = {
+        'base_url': base_url,
+        'students': students,
+        'duration_s': duration if not journeys else None,
+        'journeys_per_student': journeys or None,
+        'think_time_s': think_time,
+        'timeout_s': timeout,
+        'seed': seed,
+    }
+    return report
+
+def write_report(report, output=None):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+def add_driver_arguments(parser):
+    parser.add_argument('--students', type=int, default=20, help='concurrent synthetic students')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds to run')
+    parser.add_argument('--journeys', type=int, default=0, help='journeys per student instead of --duration')
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean pause in seconds after each request')
+    parser.add_argument('--timeout', type=float, default=60.0, help='client timeout per request in seconds')
+    parser.add_argument('--prefix', default='loadtest_student_', help='username prefix of the synthetic students')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the tutor API with concurrent synthetic students')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    add_driver_arguments(parser)
+    args = parser.parse_args()
+    report = run_load(
+        args.base_url, args.students, args.duration, args.journeys, args.think_time,
+        prefix=args.prefix, timeout=args.timeout, seed=args.seed,
+    )
+    write_report(report, args.output)
+    if not report['journeys']:
+        sys.exit('No journey completed; is the server up and seeded (populate_dummy_data)?')
+
+if __name__ == '__main__':
+    main()
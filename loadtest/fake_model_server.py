@@ -0,0 +1,68 @@
+# loadtest/fake_model_server.py
+# The example model server (model_server_example.py) with injected latency
+# and failures on /generate, standing in for the fine-tuned model during load
+# tests. Requests still go through the real micro-batcher and, with --index or
+# --corpus, the real retriever; the injected delay models inference time.
+#
+#   python -m loadtest.fake_model_server [--port 5002] [--latency lognormal:300:0.5]
+#       [--error-rate 0.02] [--timeout-rate 0.01] [--timeout-after 30] [--index DIR]
+import argparse
+import logging
+
+from flask import jsonify, request
+
+import model_server_example
+from model_server_example import app
+
+from .faults import Faults
+
+faults = Faults()
+
+@app.before_request
+def inject_faults():
+    """Delay /generate and fail a share of calls before the real handler runs"""
+    if request.path != '/generate':
+        return None
+    outcome = faults.apply()
+    if outcome == 'timeout':
+        # Past the client's timeout already; answer so the worker thread is freed
+        return jsonify({'success': False, 'error': 'Injected timeout'}), 504
+    if outcome == 'error':
+        return jsonify({'success': False, 'error': 'Injected failure'}), 500
+    return None
+
+@app.route('/faults', methods=['GET'])
+def describe_faults():
+    return jsonify(faults.describe())
+
+def main():
+    parser = argparse.ArgumentParser(description='Model server with injected latency and failures')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--latency', default='lognormal:300:0.5', help='fixed:MS, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 500')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share of requests that hang for --timeout-after')
+    parser.add_argument('--timeout-after', type=float, default=30.0, help='seconds a hanging request takes')
+    parser.add_argument('--seed', type=int)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--index', help='on-disk index built with python -m retrieval.manage')
+    source.add_argument('--corpus', help='chapter corpus to index in memory (JSONL file or directory)')
+    parser.add_argument('--batch-size', type=int, default=16, help='most requests per batch')
+    args = parser.parse_args()
+
+    global faults
+    faults = Faults(args.latency, args.error_rate, args.timeout_rate, args.timeout_after, args.seed)
+    model_server_example.batcher.max_batch = args.batch_size
+    if args.index:
+        model_server_example.open_index(args.index)
+    elif args.corpus:
+        model_server_example.load_retriever(args.corpus)
+
+    model_server_example.logger.info(f"Injecting faults: {faults.describe()}")
+    # Per-request access lines would dominate the log at load-test rates
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    model_server_example.logger.setLevel(logging.WARNING)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# loadtest/faults.py
+# Latency and failure injection shared by the fake model server and the stub
+# Gemini SDK. Latencies are given as a spec string:
+#
+#   fixed:MS                  always MS milliseconds
+#   uniform:LOW:HIGH          uniformly between LOW and HIGH ms
+#   lognormal:MEDIAN:SIGMA    long-tailed, median MEDIAN ms (sigma 0.5 puts p99 near 3.2x the median)
+#
+# A plain number is read as fixed:MS.
+import math
+import random
+import threading
+import time
+
+class Latency:
+    """Draws delays in seconds from a latency spec"""
+
+    def __init__(self, spec='fixed:0', seed=None):
+        self.spec = str(spec)
+        kind, _, params = self.spec.partition(':')
+        if not params:
+            kind, params = 'fixed', kind
+        try:
+            values = [float(value) for value in params.split(':')]
+        except ValueError as err:
+            raise ValueError(f"Invalid latency spec {spec!r}") from err
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2}
+        if kind not in expected or len(values) != expected[kind] or min(values) < 0:
+            raise ValueError(f"Invalid latency spec {spec!r}; use fixed:MS, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+        self.kind = kind
+        self.values = values
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.kind == 'fixed':
+                ms = self.values[0]
+            elif self.kind == 'uniform':
+                ms = self._rng.uniform(*self.values)
+            else:
+                median, sigma = self.values
+                ms = self._rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return ms / 1000
+
+    def __repr__(self):
+        return f'Latency({self.spec!r})'
+
+class Faults:
+    """Per-call outcome: 'ok', 'error' or 'timeout', plus the delay to apply
+
+    A timeout sleeps timeout_after seconds before failing, like an upstream
+    that stopped answering; errors fail after the sampled latency.
+    """
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, timeout_rate=0.0, timeout_after=30.0, seed=None):
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency, seed)
+        self.error_rate = float(error_rate)
+        self.timeout_rate = float(timeout_rate)
+        self.timeout_after = float(timeout_after)
+        if self.error_rate < 0 or self.timeout_rate < 0 or self.error_rate + self.timeout_rate > 1:
+            raise ValueError("error_rate and timeout_rate must be non-negative and sum to at most 1")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Return (outcome, delay_seconds) for one call"""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.timeout_rate:
+            return 'timeout', self.timeout_after
+        outcome = 'error' if roll < self.timeout_rate + self.error_rate else 'ok'
+        return outcome, self.latency.sample()
+
+    def apply(self):
+        """Sleep for one call and return its outcome"""
+        outcome, delay = self.draw()
+        if delay > 0:
+            time.sleep(delay)
+        return outcome
+
+    def describe(self):
+        return {
+            'latency': self.latency.spec,
+            'error_rate': self.error_rate,
+            'timeout_rate': self.timeout_rate,
+            'timeout_after': self.timeout_after,
+        }
@@ -0,0 +1,84 @@
+# loadtest/stub_genai/google/generativeai/__init__.py
+# Offline stand-in for the google.generativeai SDK, covering the calls the
+# tutor makes. Put loadtest/stub_genai first on PYTHONPATH (python -m loadtest
+# does) and `import google.generativeai` resolves here instead of the real
+# package. Latency and failures come from the environment:
+#
+#   LOADTEST_GEMINI_LATENCY        latency spec, see loadtest/faults.py (default lognormal:800:0.4)
+#   LOADTEST_GEMINI_ERROR_RATE     share of calls raising a 503 (default 0)
+#   LOADTEST_GEMINI_TIMEOUT_RATE   share of calls raising Deadline Exceeded after LOADTEST_GEMINI_TIMEOUT_AFTER s
+import asyncio
+import os
+import time
+
+from loadtest.faults import Faults
+
+faults = Faults(
+    os.getenv('LOADTEST_GEMINI_LATENCY', 'lognormal:800:0.4'),
+    float(os.getenv('LOADTEST_GEMINI_ERROR_RATE', '0')),
+    float(os.getenv('LOADTEST_GEMINI_TIMEOUT_RATE', '0')),
+    float(os.getenv('LOADTEST_GEMINI_TIMEOUT_AFTER', '30')),
+)
+
+MODELS = ['models/gemini-2.0-flash-exp', 'models/gemini-2.0-flash', 'models/gemini-1.5-pro']
+
+def configure(api_key=None, **kwargs):
+    if not api_key:
+        raise ValueError("api_key is required")
+
+class _Model:
+    def __init__(self, name):
+        self.name = name
+        self.supported_generation_methods = ['generateContent', 'countTokens']
+
+def list_models():
+    return [_Model(name) for name in MODELS]
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+def _answer(prompt):
+    question = str(prompt).strip().splitlines()[-1] if str(prompt).strip() else ''
+    return (
+        f"Let's work through this step by step. {question[:120]} "
+        "First, recall the key idea from the chapter, then apply it to the example, "
+        "and finally check the result against what the question asks."
+    )
+
+def _fail(outcome):
+    if outcome == 'timeout':
+        raise TimeoutError("504 Deadline Exceeded")
+    if outcome == 'error':
+        raise RuntimeError("503 The service is currently unavailable.")
+
+class GenerativeModel:
+    def __init__(self, model_name='gemini-2.0-flash', **kwargs):
+        if f'models/{model_name}' not in MODELS and model_name not in MODELS:
+            raise ValueError(f"404 models/{model_name} is not found")
+        self.model_name = model_name
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        outcome, delay = faults.draw()
+        if not stream:
+            time.sleep(delay)
+            _fail(outcome)
+            return _Response(_answer(contents))
+        return self._stream(contents, outcome, delay)
+
+    def _stream(self, contents, outcome, delay):
+        # First chunk after a third of the latency, the rest spread over the remainder
+        time.sleep(delay / 3)
+        _fail(outcome)
+        words = _answer(contents).split(' ')
+        step = max(1, len(words) // 8)
+        chunks = [' '.join(words[i:i + step]) + ' ' for i in range(0, len(words), step)]
+        for chunk in chunks:
+            yield _Response(chunk)
+            time.sleep(delay * 2 / 3 / len(chunks))
+
+    async def generate_content_async(self, contents, **kwargs):
+        outcome, delay = faults.draw()
+        await asyncio.sleep(delay)
+        _fail(outcome)
+        return _Response(_answer(contents))
@@ -2,16 +2,137 @@
 Example Model Server for AI Tutor
 This is a simple Flask server that can be used as a template for your fine-tuned model server.
 
-Run with: python model_server_example.py
+Run with: python model_server_example.py [--port 5002] [--index DIR | --corpus chapters.jsonl]
+
+With --index (built by `python -m retrieval.manage build DIR chapters.jsonl`)
+or --corpus the server retrieves the most relevant chapter passages for
+every question (see retrieval/corpus.py for the corpus format) and returns
+them with the answer. --index memory-maps the prebuilt index, so startup is
+instant and worker processes share one copy; --corpus indexes in memory.
+
+Concurrent /generate requests are micro-batched: up to --batch-size of
+them share one retrieval and generation pass. Requests that queue while a
+batch runs form the next one; --batch-window-ms additionally holds a batch
+open for latecomers. GET /stats reports batch-size and queue-wait histograms.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import json
 import logging
+import os
+import time
+
+from retrieval import IndexStore, Retriever, chunk_corpus, load_corpus
+from retrieval.batching import MicroBatcher
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Built at startup from --index or --corpus; None answers with the placeholder only
+retriever = None
+# Set with --index; reopened when `python -m retrieval.manage` updates it
+index_store = None
+
+def load_retriever(path):
+    """Chunk and index the chapter corpus at path"""
+    global retriever
+    started = time.perf_counter()
+    retriever = Retriever.build(chunk_corpus(load_corpus(path)))
+    logger.info(f"Indexed {path} in {time.perf_counter() - started:.1f}s: {retriever.stats()}")
+
+def open_index(path):
+    """Map the on-disk index at path"""
+    global retriever, index_store
+    started = time.perf_counter()
+    index_store = IndexStore(path)
+    retriever = index_store.open()
+    logger.info(f"Opened index {path} in {(time.perf_counter() - started) * 1000:.0f}ms: {retriever.stats()}")
+
+def current_retriever():
+    """The retriever, reopened first if the on-disk index changed"""
+    global retriever
+    if index_store is not None and index_store.changed():
+        try:
+            retriever = index_store.open(retriever.embedder if retriever else None)
+            logger.info(f"Reopened updated index: {retriever.stats()}")
+        except Exception as e:
+            # Keep serving the previous version; the next request retries
+            logger.error(f"Error reopening index: {str(e)}")
+    return retriever
+
+def compose_answer(message, chapter_id, passages):
+    """Placeholder answer grounded in the retrieved passages"""
+    if not passages:
+        return f"This is a placeholder response for your question about chapter {chapter_id}: {message}"
+    # Example: a real model would condition generation on these passages
+    excerpts = '\n\n'.join(f"From \"{p['title']}\": {p['text']}" for p in passages[:2])
+    return f"Here is what your textbook says about this:\n\n{excerpts}"
+
+def generate_batch(requests):
+    """One retrieval and generation pass for a batch of /generate requests"""
+    passages = [[] for _ in requests]
+    active_retriever = current_retriever()
+    if active_retriever is not None:
+        started = time.perf_counter()
+        passages = active_retriever.search_batch([
+            {
+                'query': req['message'],
+                'k': req['top_k'],
+                'chapter_id': req['chapter_id'],
+                'subject': req['subject'],
+                'standard': req['standard'],
+            }
+            for req in requests
+        ])
+        logger.info(f"Retrieved passages for {len(requests)} requests in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    # TODO: Replace this with your actual fine-tuned model inference
+    # This is just a placeholder that quotes the retrieved passages
+    responses = [compose_answer(req['message'], req['chapter_id'], found) for req, found in zip(requests, passages, strict=True)]
+
+    # Example: You would integrate your model here, one forward pass per batch
+    # model = load_your_model()
+    # responses = model.generate_batch([(req['message'], found, req['context']) for ...])
+    return list(zip(responses, passages, strict=True))
+
+batcher = MicroBatcher(generate_batch, max_batch=16)
+
+MAX_TOP_K = 50
+
+def parse_filters(data):
+    """(filters, error) for the optional chapter_id, subject, standard and top_k of a request
+
+    Checked before a request joins a batch, so bad input is a 400 for its
+    sender rather than an error in everyone's batch.
+    """
+    chapter_id = data.get('chapter_id')
+    if chapter_id is not None:
+        if isinstance(chapter_id, bool):
+            return None, 'chapter_id must be an integer'
+        try:
+            chapter_id = int(chapter_id)
+        except (TypeError, ValueError):
+            return None, 'chapter_id must be an integer'
+
+    top_k = data.get('top_k', 4)
+    if isinstance(top_k, bool) or not isinstance(top_k, (int, str)):
+        return None, f'top_k must be an integer from 1 to {MAX_TOP_K}'
+    try:
+        top_k = int(top_k)
+    except ValueError:
+        top_k = 0
+    if not 1 <= top_k <= MAX_TOP_K:
+        return None, f'top_k must be an integer from 1 to {MAX_TOP_K}'
+
+    filters = {'chapter_id': chapter_id, 'top_k': top_k}
+    for field in ('subject', 'standard'):
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            return None, f'{field} must be a string'
+        filters[field] = value or None
+    return filters, None
+
 
 @app.route('/generate', methods=['POST'])
 def generate():
@@ -21,15 +142,30 @@ def generate():
     Expected JSON payload:
     {
         "message": "user question here",
-        "chapter_id": 1
+        "chapter_id": 1,
+        "subject": "Science",     (optional, narrows retrieval)
+        "standard": "10th",       (optional, narrows retrieval)
+        "top_k": 4,               (optional, passages to retrieve)
+        "stream": false,
+        "context": {
+            "summary": "summary of earlier turns, or null",
+            "turns": [{"role": "user" | "ai", "message": "..."}]
+        }
     }
+
+    "context" is only sent for follow-up questions; its turns are the most
+    recent ones, oldest first, and fit the tutor's token budget.
     
     Returns:
     {
         "success": true/false,
         "response": "AI generated response",
+        "passages": [{"subject", "standard", "chapter_id", "title", "position", "text", "score"}],
         "error": "error message if success is false"
     }
+
+    With "stream": true the response is NDJSON, one {"delta": "..."} line per
+    generated chunk followed by {"done": true, "passages": [...]}.
     """
     try:
         data = request.get_json()
@@ -42,26 +178,40 @@ def generate():
         
         message = data.get('message', '').strip()
         chapter_id = data.get('chapter_id')
+        context = data.get('context') or {}
         
         if not message:
             return jsonify({
                 'success': False,
                 'error': 'Message is required'
             }), 400
+
+        filters, error = parse_filters(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
         
-        logger.info(f"Received request - message: {message[:50]}..., chapter_id: {chapter_id}")
-        
-        # TODO: Replace this with your actual fine-tuned model inference
-        # This is just a placeholder that returns a simple response
-        response_text = f"This is a placeholder response for your question about chapter {chapter_id}: {message}"
+        logger.info(f"Received request - message: {message[:50]}..., chapter_id: {chapter_id}, context turns: {len(context.get('turns', []))}")
         
-        # Example: You would integrate your model here
-        # model = load_your_model()
-        # response_text = model.generate(message, chapter_id)
+        response_text, passages = batcher.submit(dict(filters, message=message, context=context))
+
+        if data.get('stream'):
+            # Example: with a real model, yield tokens from its streaming generate()
+            def generate_chunks():
+                words = response_text.split(' ')
+                for i, word in enumerate(words):
+                    delta = word if i == len(words) - 1 else word + ' '
+                    yield json.dumps({'delta': delta}) + '\n'
+                yield json.dumps({'done': True, 'passages': passages}) + '\n'
+
+            return Response(generate_chunks(), mimetype='application/x-ndjson')
         
         return jsonify({
             'success': True,
-            'response': response_text
+            'response': response_text,
+            'passages': passages
         })
         
     except Exception as e:
@@ -75,9 +225,41 @@ def generate():
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy'}), 200
+    status = {'status': 'healthy'}
+    active_retriever = current_retriever()
+    if active_retriever is not None:
+        status['index'] = active_retriever.stats()
+    return jsonify(status), 200
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Batching histograms"""
+    return jsonify({'batching': batcher.stats()}), 200
 
 
 if __name__ == '__main__':
-    # Run on port 5001
-    app.run(host='127.0.0.1', port=5001, debug=True)
+    import argparse
+
+    # Start several instances on different ports and list them in
+    # TUTOR_RAG_BACKENDS to load-balance across them
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5002)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--index', help='on-disk index built with python -m retrieval.manage')
+    source.add_argument('--corpus', help='chapter corpus to index in memory (JSONL file or directory)')
+    parser.add_argument('--batch-size', type=int, default=16, help='most requests per batch')
+    parser.add_argument('--batch-window-ms', type=float, default=0, help='how long a batch waits to fill')
+    args = parser.parse_args()
+
+    batcher.max_batch = args.batch_size
+    batcher.max_wait = args.batch_window_ms / 1000
+
+    if args.index:
+        open_index(args.index)
+    elif args.corpus:
+        load_retriever(args.corpus)
+
+    # The debugger runs arbitrary code for whoever can reach it; opt in for local use only
+    app.run(host=args.host, port=args.port, debug=os.getenv('MODEL_SERVER_DEBUG') == 'True')
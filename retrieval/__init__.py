@@ -0,0 +1,6 @@
+"""Local retrieval engine for the model server: chunked chapter corpus, BM25 + dense hybrid search"""
+from .corpus import chunk_corpus, load_corpus
+from .index import HashingEmbedder, Retriever, Segment
+from .store import IndexStore
+
+__all__ = ['HashingEmbedder', 'IndexStore', 'Retriever', 'Segment', 'chunk_corpus', 'load_corpus']
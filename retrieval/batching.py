@@ -0,0 +1,135 @@
+# retrieval/batching.py
+# Dynamic micro-batching for the model server. Request threads submit()
+# single items; a scheduler thread takes what is queued, optionally waiting
+# a short window for more (up to a full batch), runs the handler once for
+# the whole batch and hands each caller its own result. While one batch
+# runs the next one queues up, so batches grow with load and the per-request
+# cost of the handler falls instead of requests queueing one by one. When a
+# batch fails, its items are rerun one at a time, so a single bad request
+# only fails itself.
+import collections
+import threading
+import time
+
+class Histogram:
+    """Cumulative bucket counts, like a Prometheus histogram"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets + ['+Inf'], counts, strict=True):
+            running += count
+            cumulative[str(bound)] = running
+        return {'buckets': cumulative, 'count': running, 'sum': round(total, 3)}
+
+class _Pending:
+    __slots__ = ('item', 'enqueued', 'done', 'result', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class MicroBatcher:
+    """Groups concurrent submit() calls into handler(items) -> results calls
+
+    max_wait is how long the first request of a batch waits for company;
+    0 takes whatever queued up while the previous batch ran, which costs
+    an idle server nothing.
+    """
+
+    def __init__(self, handler, max_batch=16, max_wait=0.0, timeout=120):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+        self.queue_wait_ms = Histogram([0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000])
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._worker = None
+
+    def submit(self, item):
+        """Run item through the handler as part of a batch and return its result"""
+        pending = _Pending(item)
+        with self._cond:
+            if self._worker is None or not self._worker.is_alive():
+                # Started lazily so forked worker processes each get their own
+                self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._worker.start()
+            self._queue.append(pending)
+            self._cond.notify()
+        if not pending.done.wait(self.timeout):
+            raise TimeoutError("Batch did not complete in time")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0].enqueued + self.max_wait
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            self.batch_sizes.observe(len(batch))
+            for pending in batch:
+                self.queue_wait_ms.observe((started - pending.enqueued) * 1000)
+            try:
+                results = self.handler([pending.item for pending in batch])
+                for pending, result in zip(batch, results, strict=True):
+                    pending.result = result
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].error = e
+                else:
+                    # Find the culprit(s) rather than fail everyone with their error
+                    for pending in batch:
+                        self._run_alone(pending)
+            for pending in batch:
+                pending.done.set()
+
+    def _run_alone(self, pending):
+        try:
+            [pending.result] = self.handler([pending.item])
+        except Exception as e:
+            pending.result, pending.error = None, e
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'queued': queued,
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_wait_ms': self.queue_wait_ms.snapshot(),
+        }
@@ -0,0 +1,83 @@
+# retrieval/bench.py
+# Query latency of the retriever over a corpus, or over a synthetic syllabus
+# the size of 8th-10th standard (6 subjects x 3 standards x 15 chapters).
+#
+#   python -m retrieval.bench [--corpus PATH | --index DIR] [--queries 1000] [--k 4]
+import argparse
+import random
+import statistics
+import time
+
+from .corpus import chunk_corpus, load_corpus
+from .index import Retriever
+from .store import IndexStore
+
+SUBJECTS = ['Science', 'Mathematics', 'Social Science', 'English', 'Hindi', 'Sanskrit']
+STANDARDS = ['8th', '9th', '10th']
+
+def synthetic_syllabus(chapters_per_standard=15, words_per_chapter=6000, seed=7):
+    """Chapters of Zipf-distributed pseudo-words, each with its own topical vocabulary"""
+    rng = random.Random(seed)
+    syllables = ['ka', 'ro', 'mi', 'tu', 'len', 'sa', 'vo', 'dri', 'pha', 'ne', 'gu', 'tor']
+    vocabulary = list({''.join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(30000)})
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    for subject in SUBJECTS:
+        for standard in STANDARDS:
+            for chapter_id in range(1, chapters_per_standard + 1):
+                topical = rng.sample(vocabulary, 40)
+                words = rng.choices(vocabulary, weights, k=words_per_chapter)
+                for i in range(0, len(words), 8):
+                    words[i] = rng.choice(topical)
+                yield {
+                    'subject': subject,
+                    'standard': standard,
+                    'chapter_id': chapter_id,
+                    'title': f'{subject} {standard} chapter {chapter_id}',
+                    'text': ' '.join(words),
+                }
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure retrieval latency')
+    parser.add_argument('--corpus', help='JSONL file or directory; defaults to a synthetic syllabus')
+    parser.add_argument('--index', help='on-disk index to open instead of building one')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=4)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.index:
+        retriever = IndexStore(args.index).open()
+        print(f"Opened index in {(time.perf_counter() - started) * 1000:.1f}ms: {retriever.stats()}")
+    else:
+        chapters = load_corpus(args.corpus) if args.corpus else synthetic_syllabus()
+        retriever = Retriever.build(chunk_corpus(chapters))
+        print(f"Built index in {time.perf_counter() - started:.1f}s: {retriever.stats()}")
+
+    rng = random.Random(1)
+    passages = [
+        segment.passage(doc)
+        for segment in retriever.segments
+        for doc in rng.sample(range(segment.docs), min(segment.docs, args.queries))
+    ]
+    for label, filtered in (('whole corpus', False), ('one chapter', True)):
+        timings = []
+        for _ in range(args.queries):
+            passage = rng.choice(passages)
+            words = passage['text'].split()
+            start = rng.randrange(max(1, len(words) - 8))
+            query = ' '.join(words[start:start + 8])
+            filters = {'chapter_id': passage['chapter_id']} if filtered else {}
+            began = time.perf_counter()
+            retriever.search(query, k=args.k, **filters)
+            timings.append((time.perf_counter() - began) * 1000)
+        print(
+            f"{label}: p50 {statistics.median(timings):.2f} ms, "
+            f"p99 {percentile(timings, 0.99):.2f} ms, max {max(timings):.2f} ms"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# retrieval/corpus.py
+# Chapter corpus loading. A corpus is a JSONL file, one chapter per line:
+#   {"subject": "Science", "standard": "10th", "chapter_id": 1,
+#    "title": "Chemical Reactions and Equations", "text": "..."}
+# or a directory laid out as <subject>/<standard>/<chapter_id>[-title].txt.
+# chapter_id is the chapter's order within its subject and standard, which is
+# the chapter_id the tutor sends to /generate.
+import json
+import os
+
+from .text import chunk_words
+
+def load_corpus(path):
+    """Yield chapter dicts from a JSONL file or a directory tree"""
+    if os.path.isdir(path):
+        yield from _load_directory(path)
+        return
+    with open(path, encoding='utf-8') as corpus:
+        for line in corpus:
+            if line.strip():
+                chapter = json.loads(line)
+                chapter['chapter_id'] = int(chapter['chapter_id'])
+                yield chapter
+
+def _load_directory(root):
+    for subject in sorted(os.listdir(root)):
+        subject_dir = os.path.join(root, subject)
+        if not os.path.isdir(subject_dir):
+            continue
+        for standard in sorted(os.listdir(subject_dir)):
+            standard_dir = os.path.join(subject_dir, standard)
+            if not os.path.isdir(standard_dir):
+                continue
+            for name in sorted(os.listdir(standard_dir)):
+                stem, ext = os.path.splitext(name)
+                if ext != '.txt':
+                    continue
+                chapter_id, _, title = stem.partition('-')
+                with open(os.path.join(standard_dir, name), encoding='utf-8') as text:
+                    yield {
+                        'subject': subject,
+                        'standard': standard,
+                        'chapter_id': int(chapter_id),
+                        'title': title.replace('_', ' ') or f'Chapter {chapter_id}',
+                        'text': text.read(),
+                    }
+
+def chunk_corpus(chapters, size=120, overlap=30):
+    """Flatten chapters into passage dicts carrying their chapter's metadata"""
+    for chapter in chapters:
+        for position, passage in enumerate(chunk_words(chapter['text'], size, overlap)):
+            yield {
+                'subject': chapter['subject'],
+                'standard': chapter['standard'],
+                'chapter_id': chapter['chapter_id'],
+                'title': chapter.get('title', ''),
+                'position': position,
+                'text': passage,
+            }
@@ -0,0 +1,361 @@
+# retrieval/index.py
+# Hybrid passage retrieval: BM25 over an inverted index plus cosine over a
+# dense embedding matrix. An index is a list of immutable segments whose
+# arrays are plain NumPy (in memory, or memory-mapped from disk by
+# retrieval/store.py), so a query is a handful of vectorised ops per segment.
+from collections import Counter
+import json
+import os
+import zlib
+
+import numpy as np
+
+from .text import tokenize
+
+# Arrays of a segment; on disk each is <name>.npy in the segment directory
+#   embeddings    (docs, dim) float32/float16, L2-normalised rows
+#   lengths       (docs,) token count per passage, for BM25 length normalisation
+#   chapter_refs  (docs,) index into the segment's chapter list
+#   positions     (docs,) passage number within its chapter
+#   text_offsets  (docs + 1,) byte offsets of each passage in texts
+#   texts         UTF-8 passage texts, concatenated
+#   term_offsets  (terms + 1,) byte offsets of each term in terms
+#   terms         UTF-8 vocabulary, sorted bytewise, concatenated
+#   indptr        (terms + 1,) postings of term t are doc_ids/tfs[indptr[t]:indptr[t + 1]]
+#   doc_ids, tfs  (postings,) passage and term frequency of each posting
+ARRAYS = (
+    'embeddings', 'lengths', 'chapter_refs', 'positions', 'text_offsets', 'texts',
+    'term_offsets', 'terms', 'indptr', 'doc_ids', 'tfs',
+)
+
+class HashingEmbedder:
+    """Signed feature hashing of word unigrams and bigrams, L2-normalised
+
+    A dependency-free stand-in for a sentence-embedding model: swap in any
+    object with the same embed(texts) -> (n, dim) float32 contract.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self._slots = {}
+
+    def _features(self, tokens):
+        for token in tokens:
+            yield token
+        for first, second in zip(tokens, tokens[1:], strict=False):
+            yield f'{first} {second}'
+
+    def _slot(self, feature):
+        # Signed bucket of a feature: +/-(index + 1), memoised per embedder
+        slot = self._slots.get(feature)
+        if slot is None:
+            hashed = zlib.crc32(feature.encode('utf-8'))
+            slot = (hashed % self.dim + 1) * (1 if hashed & 0x80000000 else -1)
+            if len(self._slots) < 1_000_000:
+                self._slots[feature] = slot
+        return slot
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(map(self._slot, self._features(tokenize(text))))
+            if not counts:
+                continue
+            slots = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            values = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            matrix[row] = np.bincount(np.abs(slots) - 1, weights=np.sign(slots) * values, minlength=self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+def _normalise_label(value):
+    return str(value or '').strip().lower()
+
+def _normalise_standard(standard):
+    """'10', '10th' and ' 10TH ' all name standard '10th', as in the tutor app"""
+    standard = _normalise_label(standard)
+    return standard + 'th' if standard.isdigit() else standard
+
+def _concat(strings):
+    """(offsets, uint8 blob) for a list of UTF-8 byte strings"""
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in strings])
+    return offsets, np.frombuffer(b''.join(strings), dtype=np.uint8).copy()
+
+def _dot(matrix, vector, block=4096):
+    """matrix @ vector (or a matrix of column vectors) in float32
+
+    float16 matrices are upcast a block at a time for BLAS.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ vector
+    out = np.empty((len(matrix),) + vector.shape[1:], dtype=np.float32)
+    for start in range(0, len(matrix), block):
+        out[start:start + block] = matrix[start:start + block].astype(np.float32) @ vector
+    return out
+
+def _load(path, mmap):
+    try:
+        # Plain ndarray views of the mapping; np.memmap adds per-index overhead
+        return np.load(path, mmap_mode='r' if mmap else None).view(np.ndarray)
+    except ValueError:
+        # Zero-length arrays can't be mapped
+        return np.load(path)
+
+class Segment:
+    """An immutable batch of passages with its own postings and embeddings
+
+    chapters lists the [subject, standard, chapter_id, title] of the
+    segment's chapters; deleted holds the refs of chapters tombstoned since
+    the segment was written, whose passages are skipped by every query.
+    """
+
+    def __init__(self, chapters, arrays, deleted=()):
+        self.chapters = [tuple(chapter) for chapter in chapters]
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.deleted = frozenset(deleted)
+        self.docs = len(self.lengths)
+        if self.deleted:
+            live = ~np.isin(self.chapter_refs, list(self.deleted))
+            self.live_docs = int(live.sum())
+            self.live_tokens = int(self.lengths[live].sum())
+        else:
+            self.live_docs = self.docs
+            self.live_tokens = int(self.lengths.sum())
+
+    @classmethod
+    def build(cls, passages, embedder, embeddings=None, dtype='float32'):
+        """Index passages; embeddings may be passed to skip re-embedding"""
+        passages = list(passages)
+        chapters, refs, chapter_refs, token_lists = [], {}, [], []
+        for passage in passages:
+            key = (passage['subject'], passage['standard'], int(passage['chapter_id']))
+            if key not in refs:
+                refs[key] = len(chapters)
+                chapters.append([*key, passage.get('title', '')])
+            chapter_refs.append(refs[key])
+            token_lists.append(tokenize(passage['text']))
+
+        postings = {}
+        for doc_id, tokens in enumerate(token_lists):
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term.encode('utf-8'), []).append((doc_id, tf))
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.uint16)
+        for term_id, term in enumerate(terms):
+            plist = postings[term]
+            start, end = indptr[term_id], indptr[term_id + 1]
+            doc_ids[start:end] = [doc for doc, _ in plist]
+            tfs[start:end] = [min(tf, 0xFFFF) for _, tf in plist]
+
+        if embeddings is None:
+            embeddings = embedder.embed([passage['text'] for passage in passages])
+        text_offsets, texts = _concat([passage['text'].encode('utf-8') for passage in passages])
+        term_offsets, term_blob = _concat(terms)
+        arrays = {
+            'embeddings': np.asarray(embeddings, dtype=dtype),
+            'lengths': np.array([len(tokens) for tokens in token_lists], dtype=np.int32),
+            'chapter_refs': np.array(chapter_refs, dtype=np.int32),
+            'positions': np.array([passage.get('position', 0) for passage in passages], dtype=np.int32),
+            'text_offsets': text_offsets,
+            'texts': texts,
+            'term_offsets': term_offsets,
+            'terms': term_blob,
+            'indptr': indptr,
+            'doc_ids': doc_ids,
+            'tfs': tfs,
+        }
+        return cls(chapters, arrays)
+
+    def write(self, path):
+        os.makedirs(path)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, 'segment.json'), 'w', encoding='utf-8') as meta:
+            json.dump({'docs': self.docs, 'chapters': self.chapters}, meta)
+
+    @classmethod
+    def open(cls, path, deleted=(), mmap=True):
+        """Map a written segment; pages are shared by every process that opens it"""
+        with open(os.path.join(path, 'segment.json'), encoding='utf-8') as meta:
+            chapters = json.load(meta)['chapters']
+        arrays = {name: _load(os.path.join(path, f'{name}.npy'), mmap) for name in ARRAYS}
+        return cls(chapters, arrays, deleted)
+
+    def postings(self, term):
+        """(doc_ids, tfs) of term, or None; binary search over the sorted vocabulary"""
+        target = term.encode('utf-8')
+        low, high = 0, len(self.term_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            start, end = self.term_offsets[middle], self.term_offsets[middle + 1]
+            if self.terms[start:end].tobytes() < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(self.term_offsets) - 1:
+            return None
+        start, end = self.term_offsets[low], self.term_offsets[low + 1]
+        if self.terms[start:end].tobytes() != target:
+            return None
+        first, last = self.indptr[low], self.indptr[low + 1]
+        return self.doc_ids[first:last], self.tfs[first:last]
+
+    def candidates(self, chapter_id=None, subject=None, standard=None):
+        """Indices of live passages matching the filters, or None for all of them"""
+        subject, standard = _normalise_label(subject), _normalise_standard(standard)
+        allowed = np.array([
+            ref not in self.deleted
+            and (chapter_id is None or chapter[2] == int(chapter_id))
+            and (not subject or _normalise_label(chapter[0]) == subject)
+            and (not standard or _normalise_standard(chapter[1]) == standard)
+            for ref, chapter in enumerate(self.chapters)
+        ], dtype=bool)
+        if allowed.all():
+            return None
+        return np.flatnonzero(allowed[self.chapter_refs])
+
+    def live_refs(self):
+        return [ref for ref in range(len(self.chapters)) if ref not in self.deleted]
+
+    def passage(self, doc):
+        subject, standard, chapter_id, title = self.chapters[self.chapter_refs[doc]]
+        start, end = self.text_offsets[doc], self.text_offsets[doc + 1]
+        return {
+            'subject': subject,
+            'standard': standard,
+            'chapter_id': chapter_id,
+            'title': title,
+            'position': int(self.positions[doc]),
+            'text': self.texts[start:end].tobytes().decode('utf-8'),
+        }
+
+class Retriever:
+    """Top-k hybrid search over the passages of one or more segments"""
+
+    def __init__(self, segments, embedder, k1=1.5, b=0.75):
+        self.segments = segments
+        self.embedder = embedder
+        self.k1 = k1
+        self.b = b
+        self.docs = sum(segment.live_docs for segment in segments)
+        self.avg_length = sum(segment.live_tokens for segment in segments) / max(1, self.docs)
+        # BM25 length normalisation per passage, fixed until the index changes
+        self._length_norms = [
+            (k1 * (1 - b + b * segment.lengths / max(1.0, self.avg_length))).astype(np.float32)
+            for segment in segments
+        ]
+
+    @classmethod
+    def build(cls, passages, embedder=None):
+        """In-memory retriever over passages"""
+        embedder = embedder or HashingEmbedder()
+        return cls([Segment.build(passages, embedder)], embedder)
+
+    def _bm25(self, number, hits, idf):
+        length_norms = self._length_norms[number]
+        scores = np.zeros(len(length_norms), dtype=np.float32)
+        for term, (doc_ids, tfs) in hits.items():
+            tf = tfs.astype(np.float32)
+            norm = length_norms[doc_ids]
+            # Doc ids are unique within a posting list, so fancy-index += is exact
+            scores[doc_ids] += idf[term] * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k=4, chapter_id=None, subject=None, standard=None, alpha=0.5):
+        """Best k passages for query; alpha weighs dense against BM25 relevance"""
+        request = {'query': query, 'k': k, 'chapter_id': chapter_id, 'subject': subject, 'standard': standard}
+        return self.search_batch([request], alpha)[0]
+
+    def search_batch(self, requests, alpha=0.5):
+        """search() for many queries with one embedding pass and one scan of each matrix
+
+        Each request is a dict of search() keyword arguments.
+        """
+        vectors = self.embedder.embed([request['query'] for request in requests])
+        scans = {}
+
+        def scan(number):
+            # Dense scores of a whole segment against every query of the batch
+            if number not in scans:
+                scans[number] = _dot(self.segments[number].embeddings, vectors.T)
+            return scans[number]
+
+        return [
+            self._search(request, vectors[column], lambda number, column=column: scan(number)[:, column], alpha)
+            for column, request in enumerate(requests)
+        ]
+
+    def _search(self, request, vector, scan, alpha):
+        terms = set(tokenize(request['query']))
+        hits = []
+        for segment in self.segments:
+            found = ((term, segment.postings(term)) for term in terms)
+            hits.append({term: posting for term, posting in found if posting is not None})
+        # Document frequencies span segments; tombstoned passages still count
+        # until compaction, which only nudges idf
+        df = Counter()
+        for segment_hits in hits:
+            for term, (doc_ids, _) in segment_hits.items():
+                df[term] += len(doc_ids)
+        idf = {term: np.log(1 + (self.docs - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+
+        owners, lexical, dense = [], [], []
+        for number, (segment, segment_hits) in enumerate(zip(self.segments, hits, strict=True)):
+            candidates = segment.candidates(request.get('chapter_id'), request.get('subject'), request.get('standard'))
+            if candidates is None:
+                candidates = np.arange(segment.docs)
+                lexical.append(self._bm25(number, segment_hits, idf))
+                dense.append(scan(number))
+            elif len(candidates):
+                lexical.append(self._bm25(number, segment_hits, idf)[candidates])
+                if len(candidates) > segment.docs // 4:
+                    # Cheaper to score every row than to gather most of the matrix
+                    dense.append(scan(number)[candidates])
+                else:
+                    dense.append(_dot(segment.embeddings[candidates], vector))
+            else:
+                continue
+            owners.append((number, candidates))
+        if not owners:
+            return []
+
+        lexical = np.concatenate(lexical)
+        # concatenate copies, so the shared batch scan isn't modified below
+        dense = np.concatenate(dense)
+        # Put both on [0, 1] before mixing; negative cosine means unrelated
+        np.clip(dense, 0, None, out=dense)
+        if lexical.max() > 0:
+            lexical /= lexical.max()
+        if dense.max() > 0:
+            dense /= dense.max()
+        combined = alpha * dense + (1 - alpha) * lexical
+
+        k = min(request.get('k', 4), len(combined))
+        top = np.argpartition(-combined, k - 1)[:k]
+        top = top[np.argsort(-combined[top])]
+        bounds = np.cumsum([len(candidates) for _, candidates in owners])
+        results = []
+        for i in top:
+            if combined[i] <= 0:
+                break
+            owner = int(np.searchsorted(bounds, i, side='right'))
+            number, candidates = owners[owner]
+            offset = i - (bounds[owner - 1] if owner else 0)
+            passage = self.segments[number].passage(candidates[offset])
+            passage['score'] = round(float(combined[i]), 4)
+            results.append(passage)
+        return results
+
+    def stats(self):
+        return {
+            'passages': self.docs,
+            'segments': len(self.segments),
+            'terms': sum(len(segment.term_offsets) - 1 for segment in self.segments),
+            'postings': sum(int(segment.indptr[-1]) for segment in self.segments),
+            'dim': self.embedder.dim,
+        }
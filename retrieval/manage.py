@@ -0,0 +1,83 @@
+# retrieval/manage.py
+# Maintain an on-disk retrieval index (see retrieval/store.py). Running model
+# servers pick up changes on their next request.
+#
+#   python -m retrieval.manage build INDEX CORPUS [--dim 256] [--dtype float16]
+#   python -m retrieval.manage add INDEX CORPUS
+#   python -m retrieval.manage add INDEX --text FILE --subject S --standard 10th --chapter-id 3 [--title T]
+#   python -m retrieval.manage delete INDEX --subject S --standard 10th --chapter-id 3
+#   python -m retrieval.manage compact INDEX
+#   python -m retrieval.manage info INDEX
+import argparse
+import json
+import sys
+import time
+
+from .corpus import load_corpus
+from .store import IndexStore
+
+def _chapters(args):
+    if args.corpus:
+        return load_corpus(args.corpus)
+    if not (args.text and args.subject and args.standard and args.chapter_id is not None):
+        sys.exit('add needs CORPUS, or --text with --subject, --standard and --chapter-id')
+    with open(args.text, encoding='utf-8') as text:
+        return [{
+            'subject': args.subject,
+            'standard': args.standard,
+            'chapter_id': args.chapter_id,
+            'title': args.title or f'Chapter {args.chapter_id}',
+            'text': text.read(),
+        }]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Maintain a retrieval index')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='index a whole corpus from scratch')
+    build.add_argument('index')
+    build.add_argument('corpus')
+    build.add_argument('--dim', type=int, default=256)
+    # float16 halves the embedding matrix on disk and in page cache, but
+    # queries upcast it to float32, which is several times slower
+    build.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+
+    add = commands.add_parser('add', help='add or replace chapters')
+    add.add_argument('index')
+    add.add_argument('corpus', nargs='?')
+    add.add_argument('--text', help='chapter text file')
+    add.add_argument('--title')
+
+    delete = commands.add_parser('delete', help="remove one chapter's passages")
+    delete.add_argument('index')
+    for command in (add, delete):
+        command.add_argument('--subject')
+        command.add_argument('--standard')
+        command.add_argument('--chapter-id', type=int)
+
+    commands.add_parser('compact', help='merge segments and drop deleted passages').add_argument('index')
+    commands.add_parser('info', help='show index statistics').add_argument('index')
+    args = parser.parse_args(argv)
+
+    store = IndexStore(args.index)
+    started = time.perf_counter()
+    if args.command == 'build':
+        store.reset(dim=args.dim, dtype=args.dtype)
+        added, _ = store.upsert(load_corpus(args.corpus))
+        print(f"Indexed {added} passages")
+    elif args.command == 'add':
+        added, removed = store.upsert(_chapters(args))
+        print(f"Added {added} passages, replaced {removed}")
+    elif args.command == 'delete':
+        if not (args.subject and args.standard and args.chapter_id is not None):
+            sys.exit('delete needs --subject, --standard and --chapter-id')
+        removed = store.delete(args.subject, args.standard, args.chapter_id)
+        print(f"Removed {removed} passages")
+    elif args.command == 'compact':
+        print(f"Compacted {store.compact()} passages into one segment")
+    else:
+        print(json.dumps({**store.open().stats(), 'manifest': store.read_manifest()}, indent=1))
+    print(f"Done in {time.perf_counter() - started:.2f}s")
+
+if __name__ == '__main__':
+    main()
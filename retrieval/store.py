@@ -0,0 +1,166 @@
+# retrieval/store.py
+# On-disk retrieval index: a directory of immutable segments (see Segment in
+# retrieval/index.py) listed by manifest.json. Readers memory-map segments,
+# so every model server worker shares one page-cached copy and opening an
+# index costs milliseconds. Writers never modify a segment in place: adding
+# or replacing a chapter writes a new segment and tombstones the chapter's
+# old passages in the manifest, and compact() merges everything back into
+# one segment. The manifest is swapped atomically, so readers see either the
+# old index or the new one.
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+
+import numpy as np
+
+from .corpus import chunk_corpus
+from .index import HashingEmbedder, Retriever, Segment, _normalise_label, _normalise_standard
+
+MANIFEST = 'manifest.json'
+FORMAT = 1
+
+def chapter_key(subject, standard, chapter_id):
+    # Spelled as search filters compare them, so '10' and '10th' are one chapter
+    return (_normalise_label(subject), _normalise_standard(standard), int(chapter_id))
+
+class IndexStore:
+    """Reads and updates the index directory at path"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._manifest_mtime = None
+
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST)
+
+    def exists(self):
+        return os.path.exists(self._manifest_path())
+
+    def read_manifest(self):
+        with open(self._manifest_path(), encoding='utf-8') as manifest:
+            return json.load(manifest)
+
+    def _write_manifest(self, manifest):
+        temporary = self._manifest_path() + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as out:
+            json.dump(manifest, out, indent=1)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temporary, self._manifest_path())
+
+    @contextlib.contextmanager
+    def _writer(self):
+        """Serialise writers across processes; yields the manifest to update"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not self.exists():
+                    self._write_manifest({'format': FORMAT, 'dim': 256, 'dtype': 'float32', 'segments': [], 'next_segment': 1})
+                yield self.read_manifest()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def embedder(self, manifest=None):
+        manifest = manifest or self.read_manifest()
+        return HashingEmbedder(manifest['dim'])
+
+    def open(self, embedder=None):
+        """Retriever over the current segments, memory-mapped"""
+        mtime = os.stat(self._manifest_path()).st_mtime_ns
+        manifest = self.read_manifest()
+        if manifest['format'] != FORMAT:
+            raise ValueError(f"Unsupported index format {manifest['format']} in {self.path}")
+        segments = [
+            Segment.open(os.path.join(self.path, entry['name']), entry['deleted'])
+            for entry in manifest['segments']
+        ]
+        self._manifest_mtime = mtime
+        return Retriever(segments, embedder or self.embedder(manifest))
+
+    def changed(self):
+        """Whether the manifest was replaced since the last open()"""
+        try:
+            return os.stat(self._manifest_path()).st_mtime_ns != self._manifest_mtime
+        except FileNotFoundError:
+            return False
+
+    def _add_segment(self, manifest, segment):
+        name = f"seg-{manifest['next_segment']:06d}"
+        manifest['next_segment'] += 1
+        temporary = os.path.join(self.path, name + '.tmp')
+        shutil.rmtree(temporary, ignore_errors=True)
+        segment.write(temporary)
+        os.rename(temporary, os.path.join(self.path, name))
+        manifest['segments'].append({'name': name, 'docs': segment.docs, 'deleted': []})
+
+    def _tombstone(self, manifest, keys):
+        """Mark the chapters with these keys deleted in every segment; returns passages removed"""
+        removed, kept = 0, []
+        for entry in manifest['segments']:
+            segment = Segment.open(os.path.join(self.path, entry['name']), entry['deleted'])
+            for ref in segment.live_refs():
+                if chapter_key(*segment.chapters[ref][:3]) in keys:
+                    entry['deleted'].append(ref)
+                    removed += int((segment.chapter_refs == ref).sum())
+            # Drop segments with nothing left
+            if len(entry['deleted']) < len(segment.chapters):
+                kept.append(entry)
+        manifest['segments'] = kept
+        return removed
+
+    def upsert(self, chapters, size=120, overlap=30):
+        """Add chapters, replacing any already indexed under the same subject, standard and chapter id"""
+        chapters = list(chapters)
+        with self._writer() as manifest:
+            keys = {chapter_key(c['subject'], c['standard'], c['chapter_id']) for c in chapters}
+            removed = self._tombstone(manifest, keys)
+            passages = list(chunk_corpus(chapters, size, overlap))
+            if passages:
+                segment = Segment.build(passages, self.embedder(manifest), dtype=manifest['dtype'])
+                self._add_segment(manifest, segment)
+            self._write_manifest(manifest)
+            self._collect(manifest)
+        return len(passages), removed
+
+    def delete(self, subject, standard, chapter_id):
+        """Remove one chapter's passages; returns how many were removed"""
+        with self._writer() as manifest:
+            removed = self._tombstone(manifest, {chapter_key(subject, standard, chapter_id)})
+            self._write_manifest(manifest)
+            self._collect(manifest)
+        return removed
+
+    def compact(self):
+        """Merge all live passages into one segment, reusing their embeddings"""
+        with self._writer() as manifest:
+            passages, embeddings = [], []
+            for entry in manifest['segments']:
+                segment = Segment.open(os.path.join(self.path, entry['name']), entry['deleted'])
+                live = segment.candidates()
+                live = np.arange(segment.docs) if live is None else live
+                passages.extend(segment.passage(doc) for doc in live)
+                embeddings.append(np.asarray(segment.embeddings[live]))
+            manifest['segments'] = []
+            if passages:
+                segment = Segment.build(passages, None, np.concatenate(embeddings), dtype=manifest['dtype'])
+                self._add_segment(manifest, segment)
+            self._write_manifest(manifest)
+            self._collect(manifest)
+        return len(passages)
+
+    def reset(self, dim=256, dtype='float32'):
+        """Empty the index, e.g. before a full rebuild with another dimension or dtype"""
+        with self._writer() as manifest:
+            manifest.update({'dim': dim, 'dtype': dtype, 'segments': []})
+            self._write_manifest(manifest)
+            self._collect(manifest)
+
+    def _collect(self, manifest):
+        # Open readers keep their mappings of removed segments until they reopen
+        live = {entry['name'] for entry in manifest['segments']}
+        for name in os.listdir(self.path):
+            if name.startswith('seg-') and name not in live:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import model_server_example
+from model_server_example import MAX_TOP_K, parse_filters
+
+from .batching import MicroBatcher
+from .store import IndexStore
+
+
+def chapter(chapter_id, text, standard='10th', subject='Science'):
+    return {'subject': subject, 'standard': standard, 'chapter_id': chapter_id, 'title': f'Chapter {chapter_id}', 'text': text}
+
+
+class IndexStoreTests(unittest.TestCase):
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        self.store = IndexStore(path)
+        self.store.upsert([
+            chapter(1, 'Acids turn blue litmus red and react with bases to form salt and water.'),
+            chapter(2, 'Metals conduct electricity and react with oxygen to form basic oxides.'),
+        ])
+
+    def chapters_found(self, query, **filters):
+        return [(passage['standard'], passage['chapter_id']) for passage in self.store.open().search(query, **filters)]
+
+    def segment_dirs(self):
+        return sorted(name for name in os.listdir(self.store.path) if name.startswith('seg-'))
+
+    def test_upsert_replaces_a_chapter(self):
+        # '10' names the same standard as '10th'
+        added, removed = self.store.upsert([chapter(1, 'Plants make glucose by photosynthesis in sunlight.', standard='10')])
+        self.assertEqual((added, removed), (1, 1))
+        self.assertEqual(self.chapters_found('acids litmus', chapter_id=1), [])
+        self.assertEqual(self.chapters_found('photosynthesis', standard='10th'), [('10', 1)])
+        self.assertEqual(self.chapters_found('metals oxides'), [('10th', 2)])
+
+    def test_delete_tombstones_until_compaction(self):
+        self.assertEqual(self.store.delete('science', '10', 2), 1)
+        self.assertEqual(self.chapters_found('metals oxides', chapter_id=2), [])
+        # The passage stays in its segment, only skipped
+        segment, = self.store.read_manifest()['segments']
+        self.assertEqual((segment['docs'], segment['deleted']), (2, [1]))
+        self.assertEqual(self.store.open().stats()['passages'], 1)
+        self.assertEqual(self.store.delete('Science', '10th', 2), 0)
+
+    def test_compact_merges_live_passages(self):
+        self.store.upsert([chapter(3, 'Light reflects from mirrors and refracts through lenses.')])
+        self.store.delete('Science', '10th', 2)
+        before = self.segment_dirs()
+        self.assertEqual(len(before), 2)
+
+        self.assertEqual(self.store.compact(), 2)
+        after = self.segment_dirs()
+        self.assertEqual(len(after), 1)
+        self.assertNotIn(after[0], before)
+        self.assertEqual(self.store.open().stats()['passages'], 2)
+        self.assertEqual(self.chapters_found('acids litmus'), [('10th', 1)])
+        self.assertEqual(self.chapters_found('mirrors lenses'), [('10th', 3)])
+        self.assertEqual(self.chapters_found('metals oxides', chapter_id=2), [])
+
+    def test_reopen_after_changed(self):
+        retriever = self.store.open()
+        self.assertFalse(self.store.changed())
+        self.store.upsert([chapter(3, 'Light reflects from mirrors and refracts through lenses.')])
+        self.assertTrue(self.store.changed())
+        # An open reader keeps its view until it reopens
+        self.assertEqual(retriever.search('mirrors lenses', chapter_id=3), [])
+
+        self.assertEqual([passage['chapter_id'] for passage in self.store.open().search('mirrors lenses')], [3])
+        self.assertFalse(self.store.changed())
+
+
+class MicroBatcherTests(unittest.TestCase):
+    def test_failed_batch_is_retried_item_by_item(self):
+        batches = []
+
+        def handler(items):
+            batches.append(list(items))
+            if 'bad' in items:
+                raise ValueError('bad item')
+            return [item.upper() for item in items]
+
+        # A long window, so the four submissions share the first batch
+        batcher = MicroBatcher(handler, max_batch=4, max_wait=1.0)
+        items = ['acid', 'bad', 'base', 'salt']
+        results = {}
+
+        def submit(item):
+            try:
+                results[item] = batcher.submit(item)
+            except ValueError as e:
+                results[item] = e
+
+        threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(sorted(batches[0]), sorted(items))
+        self.assertEqual(sorted(batches[1:]), [[item] for item in sorted(items)])
+        self.assertEqual({item: results[item] for item in ('acid', 'base', 'salt')}, {'acid': 'ACID', 'base': 'BASE', 'salt': 'SALT'})
+        self.assertIsInstance(results['bad'], ValueError)
+
+
+class ParseFiltersTests(unittest.TestCase):
+    def test_defaults_and_conversions(self):
+        self.assertEqual(parse_filters({}), ({'chapter_id': None, 'top_k': 4, 'subject': None, 'standard': None}, None))
+        self.assertEqual(
+            parse_filters({'chapter_id': '3', 'top_k': '10', 'subject': 'Science', 'standard': '10th'}),
+            ({'chapter_id': 3, 'top_k': 10, 'subject': 'Science', 'standard': '10th'}, None),
+        )
+
+    def test_rejected_values(self):
+        for data in ({'top_k': 0}, {'top_k': MAX_TOP_K + 1}, {'top_k': 'many'}, {'top_k': 2.5}, {'top_k': True},
+                     {'chapter_id': 'three'}, {'chapter_id': [3]}, {'chapter_id': True}, {'subject': 7}):
+            filters, error = parse_filters(data)
+            self.assertIsNone(filters, data)
+            self.assertTrue(error, data)
+
+    def test_generate_answers_400(self):
+        client = model_server_example.app.test_client()
+        response = client.post('/generate', json={'message': 'What is an acid?', 'chapter_id': 1, 'top_k': False})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json(), {'success': False, 'error': f'top_k must be an integer from 1 to {MAX_TOP_K}'})
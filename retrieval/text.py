@@ -0,0 +1,29 @@
+# retrieval/text.py
+# Tokenising and chunking of chapter texts.
+import re
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Function words that carry no retrieval signal
+STOPWORDS = frozenset("""
+a an and are as at be been but by can did do does for from had has have how i if in into is it its
+me my no not of on or our so than that the their them then there these they this to was we were
+what when where which while who why will with would you your
+""".split())
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords"""
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+def chunk_words(text, size=120, overlap=30):
+    """Split text into passages of `size` words, consecutive ones sharing `overlap` words"""
+    words = text.split()
+    if len(words) <= size:
+        return [' '.join(words)] if words else []
+    step = size - overlap
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(' '.join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return chunks